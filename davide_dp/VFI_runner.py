@@ -1,11 +1,12 @@
 import sys
 import os
-import pandas as pd
 import argparse
 
 # from utils import check_log_step, update_log_step
-from davide_dp.configs import read_config
-from davide_dp.utils.progress_db import is_step_complete, log_step_event, update_summary_for_video
+from davide_dp.pipeline import PipelineContext
+from davide_dp.utils.progress_db import record_step_event
+from davide_dp.utils.metrics import StepMetrics, count_files
+from davide_dp.utils.video_source import FolderFrameSource
 import davide_dp.XVFI as XVFI
 
 def main_parser(argv=None):
@@ -18,45 +19,53 @@ def main_parser(argv=None):
     return args, parser
 
 
-def main(args, parser):
-    config = read_config(args.config)
-    idx = args.id
-
-    # Get root directory
-    root_dir = config['DAVIDE-tmp']['ROOT']
-    # Get video list
-    data_annotations_path = config['DATA-GEN-PARAMS']['annotations']
-    annotations = pd.read_csv(data_annotations_path)
-    video_list = annotations['recording'].values.tolist()
-    
+def run_step(ctx:PipelineContext, video_name:str, gpu:int=0):
+    """Step 2: interpolate the rgb frames of a video with XVFI."""
+    config = ctx.config
+
     # Check if step 1 is done
-    if not is_step_complete(dp_step='step_1', videos=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log']):
-        raise ValueError(f"Step 1 is not done yet for video {video_list[idx]}. Check dp log.")
+    ctx.require_steps(video_name, ['step_1'])
 
     # Input and output paths
-    input_dir = os.path.join(root_dir, video_list[idx], config['DAVIDE-tmp']['rgb_folder'])
-    output_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['VFI_folder'])
+    input_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['rgb_folder'])
+    output_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['VFI_folder'])
     os.makedirs(output_dir, exist_ok=True)
 
-    # XVFI settings
-    xvfi_config = config['DATA-GEN-PARAMS']['XVFI_config']
+    # XVFI reads png frames: write them if step 1 did not
+    rgb_source = ctx.rgb_source(video_name, pix_fmt='bgr24')
+    if not isinstance(rgb_source, FolderFrameSource):
+        from davide_dp.extract_rgb import write_frame_folder
+
+        print('Writing png frames of {} for XVFI ...'.format(rgb_source.path))
+        extraction = config['RGB-EXTRACTION']
+        # The folder only appears when complete: a re-run after an interrupted write writes it again
+        write_frame_folder(rgb_source, input_dir, extraction['workers'], extraction['png_compression'])
 
+    # XVFI settings. XVFI.run builds and loads its model on every call.
+    args, parser = main_parser(['--config', ctx.config_file, '--id', '0', '--gpu', str(gpu)])
     args.input_dir = input_dir
     args.output_dir = output_dir
     args.pretrained = config['DATA-GEN-PARAMS']['XVFI_pretrained']
-    args.config = xvfi_config
+    args.config = config['DATA-GEN-PARAMS']['XVFI_config']
     args.multiple = config['DATA-GEN-PARAMS']['sr_factor']
     args = XVFI.add_default_args(args, parser)
 
     # Run XVFI
-    XVFI.run(args)
+    with StepMetrics(video_name, 'step_2', ctx.db_path, output_dirs=output_dir) as metrics:
+        metrics.frames_in = count_files(input_dir)
+        XVFI.run(args)
+        metrics.frames_out = count_files(output_dir)
 
     # Update dp log
-    log_step_event(video_name=video_list[idx], dp_step='step_2', new_status=1, db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    update_summary_for_video(video_name=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    print(f"Step 2 completed for video {video_list[idx]}.")
+    record_step_event(video_name=video_name, dp_step='step_2', new_status=1, db_path=ctx.db_path)
+    print(f"Step 2 completed for video {video_name}.")
+
+
+def main(args, parser):
+    ctx = PipelineContext(args.config)
+    run_step(ctx, ctx.video_name(args.id), gpu=args.gpu)
 
 
 if __name__ == '__main__':
     args, parser = main_parser(sys.argv[1:])
-    main(args, parser)
\ No newline at end of file
+    main(args, parser)
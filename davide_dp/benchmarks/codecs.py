@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import cv2
+import numpy as np
+
+from davide_dp.utils.codecs import ImageCodec, list_images, read_image
+
+
+# Codec settings to compare
+VARIANTS = {
+    'png-0': ImageCodec('png', level=0),
+    'png-1': ImageCodec('png', level=1),    # OpenCV default
+    'png-3': ImageCodec('png', level=3),
+    'png-6': ImageCodec('png', level=6),
+    'png-9': ImageCodec('png', level=9),
+    'webp': ImageCodec('webp'),
+    'tiff': ImageCodec('tiff'),
+    'tiff-lzw': ImageCodec('tiff', compression='lzw'),
+    'tiff-deflate': ImageCodec('tiff', compression='deflate'),
+    'npy': ImageCodec('npy'),
+}
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Encode/decode speed and size of the image codecs on frames of the pipeline')
+    parser.add_argument("--frames", type=str, nargs='+', default=None,
+                        help='Folders of frames to benchmark (e.g. DAVIDE-tmp/<video>/blurry and .../depth). Default: synthetic rgb, depth and confidence frames')
+    parser.add_argument("--count", type=int, default=20, help='Frames sampled from each folder')
+    parser.add_argument("--size", type=str, default='1920x1440', help='Size of the synthetic frames')
+    parser.add_argument("--codecs", type=str, nargs='+', default=list(VARIANTS), choices=list(VARIANTS), help='Codec settings to compare')
+    parser.add_argument("--dir", type=str, default=None, help='Directory for the encoded frames. Default: temporary directory')
+    parser.add_argument("--output", type=str, default=None, help='Save the results as json')
+    args = parser.parse_args(argv)
+    return args
+
+
+def synthetic_frames(count:int, size:tuple, seed:int=0) -> dict:
+    """Rgb, 16-bit depth and 8-bit confidence frames of a synthetic clip, as written by steps 3 and 4."""
+    from davide_dp.benchmarks.synthetic import make_scene, plane_frame, plane_depth
+
+    rng = np.random.default_rng(seed)
+    K, R, positions, plane, texture = make_scene(rng, size, count, 30)
+    frames = {'rgb': [], 'depth': [], 'confidence': []}
+    for i in range(count):
+        frames['rgb'].append(plane_frame(K, R[i], positions[i], plane, texture, size))
+        # Depth maps are upsampled from 192x256 to the frame size by step 4
+        depth = cv2.resize(plane_depth(K, R[i], positions[i], plane, size), size, interpolation=cv2.INTER_LINEAR)
+        frames['depth'].append(np.clip(depth * 1000, 0, 65535).astype(np.uint16))
+        # Confidence levels upsampled from the 192x256 maps, as step 4 resizes them
+        levels = cv2.resize(rng.integers(0, 3, (24, 32)).astype(np.float32), size, interpolation=cv2.INTER_LINEAR)
+        frames['confidence'].append((levels / 2 * 255).astype(np.uint8))
+    return frames
+
+
+def load_frames(folder:str, count:int) -> list:
+    """`count` frames sampled uniformly from a folder, as stored (bit depth and channels unchanged)."""
+    names = list_images(folder)
+    assert names, f"No frames in {folder}"
+    ids = np.unique(np.linspace(0, len(names) - 1, count).astype(int))
+    return [read_image(os.path.join(folder, names[i])) for i in ids]
+
+
+def benchmark(frames:list, codec:ImageCodec, work_dir:str) -> dict:
+    """Encode and decode the frames with a codec. Times are per frame, sizes in MB per frame."""
+    os.makedirs(work_dir, exist_ok=True)
+    paths = []
+    t0 = time.perf_counter()
+    for i, frame in enumerate(frames):
+        paths.append(codec.write(os.path.join(work_dir, '{:08d}'.format(i)), frame))
+    encode = time.perf_counter() - t0
+
+    # Decode from the page cache: the cost of the codec, not of the disk
+    t0 = time.perf_counter()
+    decoded = [read_image(path) for path in paths]
+    decode = time.perf_counter() - t0
+
+    size = sum(os.path.getsize(path) for path in paths)
+    lossless = all(np.array_equal(a, b) for a, b in zip(frames, decoded))
+    shutil.rmtree(work_dir)
+    return {'encode_ms': 1000 * encode / len(frames), 'decode_ms': 1000 * decode / len(frames),
+            'size_mb': size / len(frames) / 2**20, 'raw_mb': frames[0].nbytes / 2**20, 'lossless': lossless}
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    work_dir = args.dir or tempfile.mkdtemp(prefix='codecs_')
+    if args.frames:
+        sets = {os.path.normpath(folder): load_frames(folder, args.count) for folder in args.frames}
+    else:
+        width, height = (int(x) for x in args.size.split('x'))
+        sets = synthetic_frames(args.count, (width, height))
+
+    results = {}
+    failed = False
+    for name, frames in sets.items():
+        frame = frames[0]
+        print('\n{}: {} frames of {} {}'.format(name, len(frames), 'x'.join(str(x) for x in frame.shape), frame.dtype))
+        print('{:<14} {:>10} {:>10} {:>9} {:>7} {:>9}'.format('codec', 'encode ms', 'decode ms', 'MB/frame', 'ratio', 'lossless'))
+        results[name] = {}
+        for variant in args.codecs:
+            codec = VARIANTS[variant]
+            if codec.codec == 'webp' and (frame.dtype != np.uint8 or frame.ndim != 3):
+                continue
+            result = benchmark(frames, codec, os.path.join(work_dir, variant))
+            results[name][variant] = result
+            failed |= not result['lossless']
+            print('{:<14} {:>10.1f} {:>10.1f} {:>9.2f} {:>7.2f} {:>9}'.format(
+                variant, result['encode_ms'], result['decode_ms'], result['size_mb'],
+                result['raw_mb'] / result['size_mb'], 'yes' if result['lossless'] else 'NO'))
+    if not args.dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'frames': args.frames or 'synthetic', 'cv2': cv2.__version__, 'results': results}, f, indent=2)
+        print('Results saved to {}'.format(args.output))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
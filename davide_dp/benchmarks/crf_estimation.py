@@ -0,0 +1,146 @@
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+from davide_dp.crf_estimation import estimate_homographies, estimate_crf, BORDER_CROP, OVER_EXPOSED_LIMIT
+from davide_dp.utils.metrics import available_cpus
+from davide_dp.benchmarks.synthetic import make_texture
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Self-check of the CRF estimation on a synthetic exposure bracket: '
+                                                 'the default alignment must give the CRF of the exhaustive one, '
+                                                 'much closer than an unaligned bracket does')
+    parser.add_argument("--size", type=str, default='1280x960',
+                        help='Frame size of the bracket. The check holds from 1280x960 up: smaller views of '
+                             'the synthetic scene have too few features to align, even exhaustively')
+    parser.add_argument("--exposures", type=int, default=7, help='Exposures of the bracket (one stop apart)')
+    parser.add_argument("--jitter", type=float, default=4.0, help='Hand-held jitter between exposures, in pixels')
+    parser.add_argument("--samples", type=int, default=70, help='Number of samples for Debevec calibration')
+    parser.add_argument("--workers", type=int, default=None, help='Threads of the default alignment. Default: available CPUs')
+    parser.add_argument("--ratio", type=float, default=0.5,
+                        help='Largest difference between the default and exhaustive log CRFs, '
+                             'as a fraction of the difference between the unaligned and exhaustive ones')
+    parser.add_argument("--seed", type=int, default=0, help='Seed of the scene and the jitter')
+    args = parser.parse_args(argv)
+    return args
+
+
+def ground_truth_crf(gamma:np.ndarray) -> np.ndarray:
+    """Inverse of the synthetic CRF (256, 3) in RGB order, normalized to 1 at intensity 128 as Debevec's curves."""
+    levels = np.arange(256, dtype=np.float64)[:, None] / 255
+    crf_inv = np.maximum(levels, 0.5 / 255) ** gamma[::-1]
+    return crf_inv / crf_inv[128]
+
+
+def make_bracket(rng:np.random.Generator, size:tuple, exposures:int, jitter:float, gamma:np.ndarray) -> tuple:
+    """
+    Exposure bracket of a textured scene with a gamma CRF per channel (BGR),
+    each exposure moved by a random homography of about `jitter` pixels.
+    Returns the images, the exposure times and the homographies of the images.
+    """
+    width, height = size
+    texture = make_texture(rng, 2048).astype(np.float32) / 255
+    # Irradiance with a dynamic range of 1:300, mid-gray at the middle exposure
+    irradiance = np.exp((texture - 1) * np.log(300))
+    times = 2.0 ** (np.arange(exposures) - exposures // 2)
+
+    images, homographies = [], []
+    for t in times:
+        angle = rng.normal(0, jitter / max(size))
+        shift = rng.normal(0, jitter, 2)
+        perspective = rng.normal(0, jitter / max(size) ** 2, 2)
+        H = np.array([[np.cos(angle), -np.sin(angle), shift[0]],
+                      [np.sin(angle), np.cos(angle), shift[1]],
+                      [perspective[0], perspective[1], 1]])
+        homographies.append(H)
+        # View of the center of the scene
+        center = np.array([[1, 0, (2048 - width) / 2], [0, 1, (2048 - height) / 2], [0, 0, 1]])
+        frame = cv2.warpPerspective(irradiance, center @ H, size, flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+        signal = np.clip(frame * t, 0, 1) ** (1 / gamma)
+        noise = rng.normal(0, 0.5, signal.shape)
+        images.append(np.clip(np.round(signal * 255 + noise), 0, 255).astype(np.uint8))
+    return images, times.astype(np.float32), homographies
+
+
+def align(images:list, homographies:list) -> list:
+    """Warps the images with the homographies and crops the borders, as image_alignment."""
+    aligned = []
+    for img, H in zip(images, homographies):
+        img = cv2.warpPerspective(img, H, (img.shape[1], img.shape[0]))
+        aligned.append(img[BORDER_CROP:-BORDER_CROP, BORDER_CROP:-BORDER_CROP, :])
+    return aligned
+
+
+def alignment_error(homographies:list, true_homographies:list, size:tuple) -> float:
+    """Largest distance, in pixels, between the estimated and true mapping to the
+    reference image of the points of a 9x9 grid over each image."""
+    width, height = size
+    xs, ys = np.meshgrid(np.linspace(0, width - 1, 9), np.linspace(0, height - 1, 9))
+    points = np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)])
+    ref_id = len(homographies) // 2 + 1
+    error = 0.0
+    for H, H_true in zip(homographies, true_homographies):
+        estimated = H @ points
+        # Images are sampled at H_true @ x in the scene, so x maps to inv(H_ref) @ H_true @ x
+        true = np.linalg.inv(true_homographies[ref_id]) @ H_true @ points
+        distance = np.linalg.norm(estimated[:2] / estimated[2] - true[:2] / true[2], axis=0)
+        error = max(error, distance.max())
+    return error
+
+
+def crf_difference(crf_inv:np.ndarray, reference:np.ndarray, start:int=0) -> np.ndarray:
+    """
+    Largest difference of the log responses (the curves Debevec solves for) of
+    each channel in [start, over-exposed limit), relative to the range of the reference.
+    """
+    crf_inv, reference = np.log(crf_inv[start:OVER_EXPOSED_LIMIT]), np.log(reference[start:OVER_EXPOSED_LIMIT])
+    return np.abs(crf_inv - reference).max(axis=0) / np.ptp(reference, axis=0)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    width, height = (int(x) for x in args.size.split('x'))
+    rng = np.random.default_rng(args.seed)
+    gamma = np.array([2.4, 2.2, 2.0])
+    images, exposures, homographies = make_bracket(rng, (width, height), args.exposures, args.jitter, gamma)
+    print('Synthetic bracket: {} exposures, {}x{}, jitter {} px'.format(len(images), width, height, args.jitter))
+
+    configurations = {
+        'unaligned': None,
+        'exhaustive': dict(scale=1.0, matcher='bf', ecc_iterations=0, workers=1),
+        'default': dict(scale=0.5, matcher='flann', ecc_iterations=1, workers=args.workers or available_cpus()),
+    }
+    curves = {}
+    print('{:<12} {:>8} {:>10} {:>26}'.format('alignment', 'time', 'error', 'vs ground truth (R, G, B)'))
+    for name, kwargs in configurations.items():
+        t0 = time.time()
+        if kwargs is None:
+            H_cum_list = [np.eye(3)] * len(images)
+        else:
+            H_cum_list = estimate_homographies(images, **kwargs)
+        aligned = align(images, H_cum_list)
+        elapsed = time.time() - t0
+        # Same pixel samples for all alignments
+        cv2.setRNGSeed(args.seed)
+        curves[name] = estimate_crf(aligned, exposures, args.samples)
+        # Intensities below 16 are dominated by the noise of the bracket
+        error = crf_difference(curves[name], ground_truth_crf(gamma), start=16)
+        print('{:<12} {:>6.2f} s {:>7.2f} px {:>8.4f} {:.4f} {:.4f}'.format(
+            name, elapsed, alignment_error(H_cum_list, homographies, (width, height)), *error))
+
+    # Differences of the log CRFs, relative to their range, below the over-exposed limit
+    baseline = crf_difference(curves['unaligned'], curves['exhaustive'])
+    error = crf_difference(curves['default'], curves['exhaustive'])
+    print('Unaligned vs exhaustive alignment: R {:.4f}, G {:.4f}, B {:.4f}'.format(*baseline))
+    print('Default vs exhaustive alignment:   R {:.4f}, G {:.4f}, B {:.4f}'.format(*error))
+    if error.max() > args.ratio * baseline.max():
+        print('CRFs differ by more than {} of the unaligned baseline ({:.4f})'.format(args.ratio, args.ratio * baseline.max()))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
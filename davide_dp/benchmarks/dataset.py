@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import cv2
+import numpy as np
+import pandas as pd
+
+from davide_dp.dataset import DAVIDEDataset, DEFAULT_FOLDERS
+from davide_dp.utils.codecs import ImageCodec, CODECS
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Throughput of the DAVIDE dataset reader (windows/s) against a plain imread + csv loop')
+    parser.add_argument("--root", type=str, default=None, help='DAVIDE folder with exported splits. Default: synthetic split in a temporary directory')
+    parser.add_argument("--split", type=str, default='train', help='Split to read')
+    parser.add_argument("--recordings", type=int, default=2, help='[synthetic] Recordings of the split')
+    parser.add_argument("--frames", type=int, default=24, help='[synthetic] Blurry frames per recording')
+    parser.add_argument("--size", type=str, default='960x720', help='[synthetic] Frame size')
+    parser.add_argument("--codec", type=str, default='png', choices=list(CODECS), help='[synthetic] Codec of the frames')
+    parser.add_argument("--window", type=int, default=5, help='Frames per window')
+    parser.add_argument("--workers", type=int, nargs='+', default=[0, 4], help='Decode threads of the dataset (one run each)')
+    parser.add_argument("--crop", type=str, default=None, help='Crop size of the windows, e.g. 256x256')
+    parser.add_argument("--epochs", type=int, default=2, help='Epochs of each run (the first one fills the cache)')
+    parser.add_argument("--output", type=str, default=None, help='Save the results as json')
+    args = parser.parse_args(argv)
+    return args
+
+
+def write_split(split_dir:str, recordings:int, frames:int, size:tuple, codec:ImageCodec, seed:int=0, num_frames:int=4):
+    """
+    Synthetic split in the layout exported by step 8: blur, gt, depth and
+    confidence frames and the intrinsics, poses and imu csv of each recording.
+    """
+    from davide_dp.benchmarks.synthetic import make_scene, plane_frame, plane_depth, quaternion_from_matrix, imu_data
+
+    middle_frame_num = num_frames // 2 if num_frames % 2 == 0 else num_frames // 2 + 1
+    for r in range(recordings):
+        recording = 'synthetic{:02d}'.format(r + 1)
+        rng = np.random.default_rng(seed + r)
+        # Captured frames of the recording, and their frame stamps as in step 5
+        captured = frames * num_frames + 1
+        K, R, positions, plane, texture = make_scene(rng, size, captured, 30)
+        stamps = (np.arange(captured) - middle_frame_num) / num_frames
+
+        folders = {name: os.path.join(split_dir, DEFAULT_FOLDERS[key], recording) for name, key in
+                   [('blur', 'blur_folder'), ('gt', 'sharp_folder'), ('depth', 'depth_folder'), ('conf', 'confidence_folder')]}
+        for folder in folders.values():
+            os.makedirs(folder, exist_ok=True)
+        for k in range(frames):
+            images = [plane_frame(K, R[i], positions[i], plane, texture, size) for i in range(k * num_frames, (k + 1) * num_frames)]
+            middle = k * num_frames + middle_frame_num
+            depth = cv2.resize(plane_depth(K, R[middle], positions[middle], plane, size), size, interpolation=cv2.INTER_LINEAR)
+            levels = cv2.resize(rng.integers(0, 3, (24, 32)).astype(np.float32), size, interpolation=cv2.INTER_LINEAR)
+            name = '{:08d}'.format(middle)
+            codec.write(os.path.join(folders['blur'], name), np.mean(images, axis=0).astype(np.uint8))
+            codec.write(os.path.join(folders['gt'], name), images[middle_frame_num])
+            depth_codec = codec if codec.codec != 'webp' else ImageCodec('png')
+            depth_codec.write(os.path.join(folders['depth'], name), np.clip(depth * 1000, 0, 65535).astype(np.uint16))
+            depth_codec.write(os.path.join(folders['conf'], name), (levels / 2 * 255).astype(np.uint8))
+
+        imu = imu_data(R, positions, 30)
+        tables = {
+            'intrinsics_folder': pd.DataFrame({'fx': K[0, 0], 'fy': K[1, 1], 'cx': K[0, 2], 'cy': K[1, 2]}, index=range(captured)),
+            'poses_folder': pd.DataFrame(np.concatenate([positions, quaternion_from_matrix(R)], axis=1),
+                                         columns=['tx', 'ty', 'tz', 'qw', 'qx', 'qy', 'qz']),
+            'imu_folder': pd.DataFrame(np.concatenate([imu['acc'], imu['g'], imu['att'], imu['rr']], axis=1),
+                                       columns=['accx', 'accy', 'accz', 'gx', 'gy', 'gz', 'attqw', 'attqx', 'attqy', 'attqz', 'rrx', 'rry', 'rrz']),
+        }
+        for key, table in tables.items():
+            table.insert(0, 'frame-stamp', stamps)
+            os.makedirs(os.path.join(split_dir, DEFAULT_FOLDERS[key]), exist_ok=True)
+            table.to_csv(os.path.join(split_dir, DEFAULT_FOLDERS[key], '{}.csv'.format(recording)), sep=',', header=True, index=False)
+
+
+def naive_epoch(dataset:DAVIDEDataset) -> int:
+    """Read the windows of the dataset with a plain loop: imread of every frame and csv parsing per window."""
+    frames = 0
+    for recording, start in dataset.samples:
+        entry = dataset.index['recordings'][recording]
+        for modality in ['blur', 'gt', 'depth', 'conf']:
+            for frame in entry['frames'][start:start + dataset.window]:
+                path = os.path.join(dataset.modality_dir(modality), recording, frame + entry['extensions'][modality])
+                if path.endswith('.npy'):
+                    np.load(path)
+                else:
+                    cv2.imread(path, cv2.IMREAD_UNCHANGED)
+                frames += 1
+        for modality in ['intrinsics', 'poses', 'imu']:
+            pd.read_csv(os.path.join(dataset.modality_dir(modality), '{}.csv'.format(recording)))
+    return frames
+
+
+def run(dataset:DAVIDEDataset, epochs:int) -> list:
+    results = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        for i in range(len(dataset)):
+            dataset[i]
+        seconds = time.perf_counter() - start
+        results.append({'epoch': epoch, 'seconds': seconds, 'windows_per_s': len(dataset) / seconds, **dataset.cache_info()})
+    return results
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    work_dir = None
+    root = args.root
+    if root is None:
+        work_dir = tempfile.mkdtemp(prefix='dataset_')
+        root = work_dir
+        width, height = (int(x) for x in args.size.split('x'))
+        print('Writing synthetic split ({} recordings of {} frames, {}x{}, {}) ...'.format(args.recordings, args.frames, width, height, args.codec))
+        write_split(os.path.join(root, args.split), args.recordings, args.frames, (width, height), ImageCodec(args.codec))
+    crop = tuple(int(x) for x in args.crop.split('x'))[::-1] if args.crop else None
+    modalities = ['blur', 'gt', 'depth', 'conf', 'intrinsics', 'poses', 'imu']
+
+    results = {}
+    try:
+        # Index: built on the first start, read from its cache file afterwards
+        dataset = DAVIDEDataset(root, args.split, window=args.window, modalities=modalities, crop_size=crop)
+        os.remove(dataset.index_file)
+        start = time.perf_counter()
+        dataset = DAVIDEDataset(root, args.split, window=args.window, modalities=modalities, crop_size=crop)
+        results['index_build_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        dataset = DAVIDEDataset(root, args.split, window=args.window, modalities=modalities, crop_size=crop)
+        results['index_cached_s'] = time.perf_counter() - start
+        print('Index: {} windows, built in {:.3f} s, loaded from cache in {:.3f} s'.format(
+            len(dataset), results['index_build_s'], results['index_cached_s']))
+
+        print('{:<16} {:>6} {:>10} {:>10} {:>10}'.format('reader', 'epoch', 'windows/s', 'cache hits', 'cache MB'))
+        start = time.perf_counter()
+        naive_epoch(dataset)
+        seconds = time.perf_counter() - start
+        results['naive'] = {'seconds': seconds, 'windows_per_s': len(dataset) / seconds}
+        print('{:<16} {:>6} {:>10.1f}'.format('imread + csv', 0, len(dataset) / seconds))
+        for workers in args.workers:
+            dataset = DAVIDEDataset(root, args.split, window=args.window, modalities=modalities, crop_size=crop,
+                                    random_crop=crop is not None, workers=workers)
+            name = 'workers={}'.format(workers)
+            results[name] = run(dataset, args.epochs)
+            for epoch in results[name]:
+                print('{:<16} {:>6} {:>10.1f} {:>10} {:>10.0f}'.format(name, epoch['epoch'], epoch['windows_per_s'], epoch['hits'], epoch['mb']))
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'root': args.root or 'synthetic', 'window': args.window, 'crop': args.crop, 'results': results}, f, indent=2)
+        print('Results saved to {}'.format(args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import tempfile
+import cv2
+import numpy as np
+
+from davide_dp.extract_rgb import write_frames
+from davide_dp.utils.video_source import VideoFrameSource
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Self-check and benchmark of segment-parallel rgb extraction on a synthetic encoded clip')
+    parser.add_argument("--frames", type=int, default=600, help='Frames of the synthetic clip')
+    parser.add_argument("--size", type=str, default='1280x720', help='Frame size of the synthetic clip')
+    parser.add_argument("--gop", type=int, default=30, help='Keyframe interval of the synthetic clip')
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare')
+    parser.add_argument("--dir", type=str, default=None, help='Working directory. Default: temporary directory')
+    args = parser.parse_args(argv)
+    return args
+
+
+def make_clip(path:str, frames:int, size:str, gop:int):
+    """Encode a synthetic clip (ffmpeg testsrc2) with B-frames and a fixed keyframe interval."""
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc2=size={}:rate=30'.format(size),
+               '-frames:v', str(frames), '-g', str(gop), '-pix_fmt', 'yuv420p']
+    result = subprocess.run(command + ['-c:v', 'libx264', '-bf', '2', path], capture_output=True, text=True)
+    if result.returncode != 0:
+        # ffmpeg builds without libx264
+        subprocess.run(command + ['-c:v', 'mpeg4', '-bf', '2', '-q:v', '3', path], check=True)
+
+
+def compare_folders(reference:str, output:str) -> list:
+    """Names of the frames that are missing or differ from the reference."""
+    names = sorted(os.listdir(reference))
+    differences = sorted(set(os.listdir(output)) ^ set(names))
+    for name in names:
+        if name in differences:
+            continue
+        if not np.array_equal(cv2.imread(os.path.join(reference, name)), cv2.imread(os.path.join(output, name))):
+            differences.append(name)
+    return differences
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    work_dir = args.dir or tempfile.mkdtemp(prefix='extract_rgb_')
+    os.makedirs(work_dir, exist_ok=True)
+    clip = os.path.join(work_dir, 'clip.mp4')
+    make_clip(clip, args.frames, args.size, args.gop)
+    source = VideoFrameSource(clip, pix_fmt='bgr24')
+    print('Synthetic clip {}: {} frames, {}x{}, {} keyframes'.format(clip, len(source), source.width, source.height, len(source.keyframes())))
+
+    # Reference: sequential extraction with ffmpeg, as step 1 did before
+    reference = os.path.join(work_dir, 'reference')
+    os.makedirs(reference, exist_ok=True)
+    t0 = time.time()
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', clip, '-start_number', '0',
+                    os.path.join(reference, '%08d.png')], check=True)
+    print('{:<24} {:>8.2f} s'.format('ffmpeg png (reference)', time.time() - t0))
+
+    failed = False
+    base = None
+    for workers in args.workers:
+        output = os.path.join(work_dir, 'workers_{}'.format(workers))
+        t0 = time.time()
+        written = write_frames(source, output, workers=workers)
+        elapsed = time.time() - t0
+        base = base or elapsed
+        differences = compare_folders(reference, output)
+        failed |= bool(differences) or written != len(source)
+        print('{:<24} {:>8.2f} s  speed-up {:>5.2f}  {}'.format(
+            'workers={}'.format(workers), elapsed, base / elapsed,
+            'identical' if not differences else 'DIFFERENT: {} frames, e.g. {}'.format(len(differences), differences[:3])))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
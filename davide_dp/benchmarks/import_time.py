@@ -0,0 +1,79 @@
+import os
+import sys
+import argparse
+import subprocess
+
+
+# Lightweight entry points and their startup budget in milliseconds (cumulative import time)
+ENTRY_POINTS = {
+    'davide_dp.update_db': 250,
+    'davide_dp.configs.export': 300,
+    'davide_dp.cli': 300,
+    'davide_dp.init_db': 1000,
+    'davide_dp.report': 1000,
+    'davide_dp.scheduler': 1000,
+    'davide_dp.work_queue': 1000,
+    'davide_dp.job_planner': 1000,
+    'davide_dp.disk_budget': 1000,
+}
+
+# Packages that lightweight entry points must not import
+HEAVY_PACKAGES = ['torch', 'cv2', 'skimage', 'matplotlib', 'cupy', 'transformers', 'pytransform3d', 'davide_dp.XVFI']
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Import-time benchmark of the lightweight entry points (python -X importtime)')
+    parser.add_argument("--modules", type=str, nargs='+', default=list(ENTRY_POINTS), help='Modules to import')
+    parser.add_argument("--repeat", type=int, default=3, help='Imports per module. The fastest one is reported')
+    parser.add_argument("--scale", type=float, default=1.0, help='Scale factor of the budgets (e.g. for slow file systems)')
+    args = parser.parse_args(argv)
+    return args
+
+
+def measure_import(module:str) -> tuple:
+    """Import a module in a fresh interpreter with -X importtime.
+    Returns the cumulative import time in ms and the list of imported modules."""
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([REPO_ROOT, env.get('PYTHONPATH', '')]).rstrip(os.pathsep)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            capture_output=True, text=True, env=env, cwd=REPO_ROOT)
+    if result.returncode != 0:
+        raise RuntimeError('Import of {} failed:\n{}'.format(module, result.stderr.strip().splitlines()[-1]))
+
+    # Lines: "import time: self [us] | cumulative | imported package"
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(total) / 1000
+    return cumulative[module], list(cumulative)
+
+
+def heavy_imports(imported:list) -> list:
+    return sorted({package for package in HEAVY_PACKAGES
+                   for name in imported if name == package or name.startswith(package + '.')})
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    failed = False
+    print('{:<28} {:>10} {:>10}  {}'.format('module', 'time [ms]', 'budget', 'heavy imports'))
+    for module in args.modules:
+        times = []
+        for _ in range(args.repeat):
+            elapsed, imported = measure_import(module)
+            times.append(elapsed)
+        elapsed = min(times)
+        budget = ENTRY_POINTS.get(module, float('inf')) * args.scale
+        heavy = heavy_imports(imported)
+        ok = elapsed <= budget and not heavy
+        failed |= not ok
+        print('{:<28} {:>10.0f} {:>10.0f}  {}{}'.format(module, elapsed, budget, ', '.join(heavy) or '-', '' if ok else '  FAIL'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from davide_dp.configs import read_config
+from davide_dp.utils.ids import parse_id_list
+from davide_dp.utils.progress_db import DP_STEPS, create_tables, initialize_summary_from_raw_list, get_step_status
+from davide_dp.utils.metrics import available_cpus
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_CONFIG = os.path.join(REPO_ROOT, 'davide_dp', 'configs', 'config.yaml')
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark of the pipeline steps on synthetic raw captures. Results are stored as JSON to compare commits')
+    parser.add_argument("command", type=str, nargs='?', default='run', choices=['run', 'compare', 'vfi'],
+                        help='run: generate synthetic captures and run the steps. compare: compare result files. vfi: CPU stand-in of step 2 (used by run)')
+    parser.add_argument("results", type=str, nargs='*', help='[compare] Baseline and new result files')
+    parser.add_argument("--workspace", type=str, default=None, help='[run] New or empty directory for the synthetic data. Default: temporary directory, removed at the end')
+    parser.add_argument("--config", type=str, default=DEFAULT_CONFIG, help='[run] Base config file. [vfi] Config file')
+    parser.add_argument("--clips", type=int, default=1, help='[run] Number of synthetic recordings')
+    parser.add_argument("--frames", type=int, default=241, help='[run] Frames per recording')
+    parser.add_argument("--size", type=str, default='1920x1440', help='[run] Frame size of the recordings')
+    parser.add_argument("--fps", type=float, default=60, help='[run] Frame rate of the recordings')
+    parser.add_argument("--seed", type=int, default=0, help='[run] Random seed of the synthetic recordings')
+    parser.add_argument("--steps", type=str, default='1-6,8', help='[run] Steps to run. E.g. 1-6,8. Step 7 downloads the mono depth model')
+    parser.add_argument("--xvfi", action='store_true', help='[run] Run XVFI (GPU) for step 2 instead of the CPU stand-in')
+    parser.add_argument("--output", type=str, default=None, help='[run] Result file. Default: pipeline-<commit>.json')
+    parser.add_argument("--label", type=str, default=None, help='[run] Label of the results. Default: commit')
+    parser.add_argument("--threshold", type=float, default=0.1, help='[compare] Relative throughput drop or memory increase reported as regression')
+    parser.add_argument("--id", type=int, default=0, help='[vfi] Video id')
+    args = parser.parse_args(argv)
+    return args
+
+
+def interpolate_frames(config_file:str, clip_id:int):
+    """
+    CPU stand-in of step 2: linear blend of consecutive rgb frames. The output has
+    the frame count and names of the XVFI output read by step 3
+    (<frame>_<k>.png, sr_factor frames per input frame).
+    """
+    import cv2
+    from davide_dp.pipeline import PipelineContext
+    from davide_dp.utils.metrics import StepMetrics
+    from davide_dp.utils.progress_db import record_step_event
+
+    ctx = PipelineContext(config_file)
+    video_name = ctx.video_name(clip_id)
+    ctx.require_steps(video_name, ['step_1'])
+    config = ctx.config
+    output_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['VFI_folder'])
+    os.makedirs(output_dir, exist_ok=True)
+    multiple = config['DATA-GEN-PARAMS']['sr_factor']
+    params = [cv2.IMWRITE_PNG_COMPRESSION, config['RGB-EXTRACTION']['png_compression']]
+
+    source = ctx.rgb_source(video_name, pix_fmt='bgr24')
+    with StepMetrics(video_name, 'step_2', ctx.db_path, output_dirs=output_dir) as metrics:
+        previous = None
+        for index, frame in source.frames():
+            if previous is not None:
+                stem = os.path.splitext(source.frame_name(index - 1))[0]
+                for k in range(multiple):
+                    blend = cv2.addWeighted(previous, 1 - k / multiple, frame, k / multiple, 0)
+                    cv2.imwrite(os.path.join(output_dir, '{}_{:03d}.png'.format(stem, k)), blend, params)
+                metrics.frames_out += multiple
+            previous = frame.copy()
+            metrics.frames_in += 1
+
+    record_step_event(video_name=video_name, dp_step='step_2', new_status=1, db_path=ctx.db_path)
+    print(f"Step 2 (linear interpolation stand-in) completed for video {video_name}.")
+
+
+def commit_info() -> tuple:
+    """Short hash of the checked out commit and whether the tree has uncommitted changes."""
+    def git(*args):
+        result = subprocess.run(['git', *args], capture_output=True, text=True, cwd=REPO_ROOT)
+        return result.stdout.strip() if result.returncode == 0 else None
+    commit = git('rev-parse', '--short', 'HEAD')
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return commit or 'unknown', bool(status)
+
+
+def file_stats(paths:list) -> dict:
+    """Modification time and size of the files below the given paths."""
+    stats = {}
+    for path in paths:
+        for root, _, names in os.walk(path):
+            for name in names:
+                stat = os.stat(os.path.join(root, name))
+                stats[os.path.join(root, name)] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def run_measured(command:list, log_file:str) -> dict:
+    """Run a command and measure its wall time, CPU time and peak RSS (largest process of its tree).
+
+    The peak RSS of a child includes the RSS of this process when the child is
+    started, so the benchmark process does not import numpy, OpenCV or pandas
+    and generates the synthetic data in a subprocess.
+    """
+    start = time.perf_counter()
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=REPO_ROOT)
+        _, status, rusage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    process.returncode = returncode
+    return {
+        'returncode': returncode,
+        'wall_time': wall_time,
+        'cpu_time': rusage.ru_utime + rusage.ru_stime,
+        # ru_maxrss is reported in KB on Linux
+        'peak_rss_mb': rusage.ru_maxrss / 1024,
+    }
+
+
+def run_benchmark(args, workspace:str) -> dict:
+    """Generate the synthetic recordings and run the steps for each of them. Returns the results."""
+    from davide_dp.scheduler import step_command
+
+    subprocess.run([sys.executable, '-m', 'davide_dp.benchmarks.synthetic', '--workspace', workspace, '--config', args.config,
+                    '--clips', str(args.clips), '--frames', str(args.frames), '--size', args.size, '--fps', str(args.fps),
+                    '--seed', str(args.seed)], check=True, cwd=REPO_ROOT)
+    config_file = os.path.join(workspace, 'config.yaml')
+    config = read_config(config_file)
+    db_path = config['DATA-GEN-PARAMS']['dp_log']
+    video_list = ['bundle-synthetic-{:02d}'.format(clip) for clip in range(args.clips)]
+    create_tables(db_path)
+    initialize_summary_from_raw_list(video_list, db_path)
+
+    steps = ['step_{}'.format(i) for i in parse_id_list(args.steps)]
+    for dp_step in steps:
+        assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+    mono_depth = 'step_7' in steps
+    conda_envs = config['SCHEDULER'].get('conda_envs') or {}
+    log_dir = os.path.join(workspace, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    runs, failed = [], set()
+    for dp_step in steps:
+        for clip_id, video_name in enumerate(video_list):
+            run = {'step': dp_step, 'video': video_name, 'frames': args.frames}
+            runs.append(run)
+            if video_name in failed:
+                run['status'] = 'skipped'
+                continue
+            if dp_step == 'step_2' and not args.xvfi:
+                command = [sys.executable, '-m', 'davide_dp.benchmarks.pipeline', 'vfi', '--config', config_file, '--id', str(clip_id)]
+            else:
+                command = step_command(dp_step, clip_id, config_file, mono_depth, conda_envs.get(dp_step))
+            output_dirs = [os.path.join(config['DAVIDE-tmp']['ROOT'], video_name), config['DAVIDE']['ROOT']]
+            before = file_stats(output_dirs)
+            log_file = os.path.join(log_dir, '{}_{}.txt'.format(video_name, dp_step))
+            run.update(run_measured(command, log_file))
+            # Size of the files created or modified by the step
+            run['bytes_written'] = sum(size for file, (mtime, size) in file_stats(output_dirs).items() if before.get(file) != (mtime, size))
+            run['fps'] = args.frames / run['wall_time']
+            complete = get_step_status(db_path, videos=[video_name], steps=[dp_step]).get(video_name, {}).get(dp_step, False)
+            run['status'] = 'ok' if run['returncode'] == 0 and complete else 'failed'
+            if run['status'] != 'ok':
+                failed.add(video_name)
+            print('{:<8} {:<22} {:>8.1f} s {:>8.1f} frames/s {:>8.0f} MB peak RSS {:>9.1f} MB written  {}'.format(
+                dp_step, video_name, run['wall_time'], run['fps'], run['peak_rss_mb'], run['bytes_written'] / 2**20,
+                run['status'] if run['status'] == 'ok' else '{} (see {})'.format(run['status'].upper(), log_file)))
+
+    # Totals of each step over the recordings
+    summary = {}
+    for dp_step in steps:
+        step_runs = [run for run in runs if run['step'] == dp_step and run['status'] == 'ok']
+        status = 'ok' if len(step_runs) == len(video_list) else 'failed'
+        if not step_runs:
+            summary[dp_step] = {'status': status}
+            continue
+        wall_time = sum(run['wall_time'] for run in step_runs)
+        summary[dp_step] = {
+            'status': status,
+            'videos': len(step_runs),
+            'frames': sum(run['frames'] for run in step_runs),
+            'wall_time': wall_time,
+            'cpu_time': sum(run['cpu_time'] for run in step_runs),
+            'fps': sum(run['frames'] for run in step_runs) / wall_time,
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in step_runs),
+            'bytes_written': sum(run['bytes_written'] for run in step_runs),
+        }
+
+    commit, dirty = commit_info()
+    return {
+        'label': args.label or commit,
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': socket.gethostname(),
+        'cpus': available_cpus(),
+        'python': platform.python_version(),
+        'params': {'clips': args.clips, 'frames': args.frames, 'size': args.size, 'fps': args.fps, 'seed': args.seed,
+                   'steps': steps, 'step_2': 'xvfi' if args.xvfi else 'linear'},
+        'steps': summary,
+        'runs': runs,
+    }
+
+
+def compare(baseline:dict, results:dict, threshold:float) -> bool:
+    """Print the change of each step between two result files. Returns True if no step regressed:
+    throughput lower or peak memory higher than the baseline by more than `threshold`."""
+    if baseline['params'] != results['params']:
+        print('Warning: the benchmarks ran with different parameters:\n  {}: {}\n  {}: {}'.format(
+            baseline['label'], baseline['params'], results['label'], results['params']))
+    print('{:<8} {:>12} {:>12} {:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'step', 'frames/s A', 'frames/s B', 'change', 'RSS A [MB]', 'RSS B [MB]', 'MB written A', 'MB written B'))
+    ok = True
+    for dp_step in sorted(set(baseline['steps']) | set(results['steps'])):
+        a, b = baseline['steps'].get(dp_step, {}), results['steps'].get(dp_step, {})
+        if a.get('status') != 'ok' or b.get('status') != 'ok':
+            print('{:<8} {:>12} {:>12}'.format(dp_step, a.get('status', '-'), b.get('status', '-')))
+            ok &= b.get('status') == 'ok' or a.get('status') != 'ok'
+            continue
+        change = b['fps'] / a['fps'] - 1
+        regression = change < -threshold or b['peak_rss_mb'] > (1 + threshold) * a['peak_rss_mb']
+        ok &= not regression
+        print('{:<8} {:>12.2f} {:>12.2f} {:>+7.1f}% {:>12.0f} {:>12.0f} {:>12.1f} {:>12.1f}{}'.format(
+            dp_step, a['fps'], b['fps'], 100 * change, a['peak_rss_mb'], b['peak_rss_mb'],
+            a['bytes_written'] / 2**20, b['bytes_written'] / 2**20, '  REGRESSION' if regression else ''))
+    print('A: {} ({}), B: {} ({})'.format(baseline['label'], baseline['date'], results['label'], results['date']))
+    return ok
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    if args.command == 'vfi':
+        interpolate_frames(args.config, args.id)
+        return 0
+    if args.command == 'compare':
+        assert len(args.results) == 2, "compare needs a baseline and a new result file"
+        files = []
+        for path in args.results:
+            with open(path) as f:
+                files.append(json.load(f))
+        return 0 if compare(*files, args.threshold) else 1
+
+    workspace = args.workspace or tempfile.mkdtemp(prefix='davide_benchmark_')
+    assert not os.path.exists(workspace) or not os.listdir(workspace), f"Workspace {workspace} is not empty"
+    try:
+        results = run_benchmark(args, os.path.abspath(workspace))
+    finally:
+        if args.workspace is None:
+            shutil.rmtree(workspace)
+
+    output = args.output or 'pipeline-{}.json'.format(results['commit'])
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to {}'.format(output))
+    return 0 if all(step['status'] == 'ok' for step in results['steps'].values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
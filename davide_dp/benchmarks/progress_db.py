@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+import numpy as np
+
+from davide_dp.utils.progress_db import (
+    DP_STEPS,
+    EVENTS_TABLE,
+    run_transaction,
+    create_tables,
+    initialize_summary_from_raw_list,
+    record_step_event,
+    get_step_status,
+)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Stress benchmark of the progress database with concurrent writer processes')
+    parser.add_argument("--db", type=str, default=None, help='Path to benchmark database. Default: temporary file')
+    parser.add_argument("--writers", type=int, default=93, help='Number of concurrent writer processes')
+    parser.add_argument("--events", type=int, default=len(DP_STEPS), help='Step events written by each writer')
+    parser.add_argument("--history", type=int, default=10000, help='Number of pre-existing events in the database')
+    args = parser.parse_args(argv)
+    return args
+
+
+def _writer(db_path, video_name, num_events, start_event, latencies):
+    """Write step events for one video, as a SLURM array task finishing its steps."""
+    start_event.wait()
+    for i in range(num_events):
+        t0 = time.perf_counter()
+        record_step_event(video_name, DP_STEPS[i % len(DP_STEPS)], 1, db_path)
+        latencies.append(time.perf_counter() - t0)
+
+
+def run_benchmark(db_path, writers, events, history):
+    """Run concurrent writers against a fresh database and return a summary dictionary."""
+    videos = ['video_{:03d}'.format(i) for i in range(writers)]
+    create_tables(db_path)
+    initialize_summary_from_raw_list(videos, db_path)
+
+    # Pre-existing history, so that event scans are not trivially cheap
+    rows = [('history_{:05d}'.format(i % 500), DP_STEPS[i % len(DP_STEPS)], 0) for i in range(history)]
+    run_transaction(db_path, lambda cursor: cursor.executemany(
+        f"INSERT INTO {EVENTS_TABLE} (video_name, step, status) VALUES (?, ?, ?)", rows))
+
+    manager = mp.Manager()
+    latencies = manager.list()
+    start_event = mp.Event()
+    processes = [mp.Process(target=_writer, args=(db_path, video, events, start_event, latencies)) for video in videos]
+    for process in processes:
+        process.start()
+
+    t0 = time.perf_counter()
+    start_event.set()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - t0
+
+    # Check final status
+    status = get_step_status(db_path, videos=videos)
+    expected = set(DP_STEPS[i % len(DP_STEPS)] for i in range(events))
+    consistent = all(
+        status[video][step] == (step in expected) for video in videos for step in DP_STEPS
+    )
+    failed = sum(process.exitcode != 0 for process in processes)
+
+    latencies = np.asarray(list(latencies))
+    return {
+        'writers': writers,
+        'events': writers * events,
+        'failed_writers': failed,
+        'consistent_summary': consistent,
+        'elapsed_s': elapsed,
+        'events_per_s': len(latencies) / elapsed,
+        'latency_p50_ms': 1000 * float(np.percentile(latencies, 50)) if len(latencies) else float('nan'),
+        'latency_p99_ms': 1000 * float(np.percentile(latencies, 99)) if len(latencies) else float('nan'),
+        'latency_max_ms': 1000 * float(np.max(latencies)) if len(latencies) else float('nan'),
+    }
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = args.db or os.path.join(tmp_dir, 'stress.db')
+        result = run_benchmark(db_path, args.writers, args.events, args.history)
+
+    print('--'*30)
+    for key, value in result.items():
+        print('{:>20}: {}'.format(key, value))
+    if result['failed_writers'] or not result['consistent_summary']:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
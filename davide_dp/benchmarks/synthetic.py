@@ -0,0 +1,255 @@
+import os
+import sys
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+import cv2
+from omegaconf import OmegaConf
+from tqdm import tqdm
+
+from davide_dp.utils.ffmpeg_io import FFmpegWriter
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_CONFIG = os.path.join(REPO_ROOT, 'davide_dp', 'configs', 'config.yaml')
+
+# Resolution of the depth and confidence maps of the capture app
+DEPTH_SHAPE = (192, 256)
+# Columns of the raw text files, in the header format read by utils.read_txt_data
+POSES_COLUMNS = ['timestamp', 'tx', 'ty', 'tz', 'qw', 'qx', 'qy', 'qz', 'accx', 'accy', 'accz',
+                 'gx', 'gy', 'gz', 'attqw', 'attqx', 'attqy', 'attqz', 'rrx', 'rry', 'rrz']
+FRAMES_COLUMNS = ['timestamp', 'frame', 'fx', 'fy', 'cx', 'cy']
+GRAVITY = 9.81
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Writes synthetic raw captures (DAVIDE-raw layout), annotations and a config to run the pipeline on them')
+    parser.add_argument("--workspace", type=str, required=True, help='Output directory (used as DATA_WORKSPACE)')
+    parser.add_argument("--config", type=str, default=DEFAULT_CONFIG, help='Base config file')
+    parser.add_argument("--clips", type=int, default=1, help='Number of synthetic recordings')
+    parser.add_argument("--frames", type=int, default=241, help='Frames per recording')
+    parser.add_argument("--size", type=str, default='1920x1440', help='Frame size of the videos (width x height)')
+    parser.add_argument("--fps", type=float, default=60, help='Frame rate of the videos')
+    parser.add_argument("--seed", type=int, default=0, help='Random seed (scene and trajectory)')
+    args = parser.parse_args(argv)
+    return args
+
+
+def video_encoder_args(fps:float) -> list:
+    """Output arguments of the synthetic videos: H.264 with B-frames and one keyframe per second
+    (MPEG-4 part 2 if ffmpeg has no libx264)."""
+    encoders = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
+    gop = ['-g', str(int(round(fps))), '-bf', '2']
+    if 'libx264' in encoders:
+        return ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', *gop, '-pix_fmt', 'yuv420p']
+    return ['-c:v', 'mpeg4', '-q:v', '3', *gop, '-pix_fmt', 'yuv420p']
+
+
+def make_texture(rng:np.random.Generator, size:int=4096) -> np.ndarray:
+    """RGB texture of the scene: multi-scale color noise with sharp-edged shapes."""
+    texture = np.zeros((size, size, 3), dtype=np.float32)
+    for cells in [4, 16, 64, 256, 1024]:
+        noise = rng.random((cells, cells, 3), dtype=np.float32)
+        texture += cv2.resize(noise, (size, size), interpolation=cv2.INTER_CUBIC) * (cells ** -0.4)
+    texture = (texture - texture.min()) / (texture.max() - texture.min()) * 255
+    texture = texture.astype(np.uint8)
+    for _ in range(400):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = tuple(int(c) for c in rng.integers(0, size, 2))
+        if rng.random() < 0.5:
+            cv2.circle(texture, center, int(rng.integers(10, 120)), color, -1, cv2.LINE_AA)
+        else:
+            corner = tuple(int(c) for c in np.add(center, rng.integers(20, 240, 2)))
+            cv2.rectangle(texture, center, corner, color, -1, cv2.LINE_AA)
+    return texture
+
+
+def rotation_matrix(angles:np.ndarray) -> np.ndarray:
+    """Rotation matrices (N, 3, 3) from roll, pitch, yaw angles (N, 3) in radians (R = Rz Ry Rx)."""
+    rx, ry, rz = angles[:, 0], angles[:, 1], angles[:, 2]
+    ones, zeros = np.ones_like(rx), np.zeros_like(rx)
+    Rx = np.stack([ones, zeros, zeros, zeros, np.cos(rx), -np.sin(rx), zeros, np.sin(rx), np.cos(rx)], -1).reshape(-1, 3, 3)
+    Ry = np.stack([np.cos(ry), zeros, np.sin(ry), zeros, ones, zeros, -np.sin(ry), zeros, np.cos(ry)], -1).reshape(-1, 3, 3)
+    Rz = np.stack([np.cos(rz), -np.sin(rz), zeros, np.sin(rz), np.cos(rz), zeros, zeros, zeros, ones], -1).reshape(-1, 3, 3)
+    return Rz @ Ry @ Rx
+
+
+def quaternion_from_matrix(R:np.ndarray) -> np.ndarray:
+    """Quaternions (N, 4) as (w, x, y, z) with w >= 0 of rotation matrices (N, 3, 3) close to identity."""
+    w = np.sqrt(np.maximum(1 + R[:, 0, 0] + R[:, 1, 1] + R[:, 2, 2], 1e-12)) / 2
+    x = (R[:, 2, 1] - R[:, 1, 2]) / (4 * w)
+    y = (R[:, 0, 2] - R[:, 2, 0]) / (4 * w)
+    z = (R[:, 1, 0] - R[:, 0, 1]) / (4 * w)
+    q = np.stack([w, x, y, z], axis=-1)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def camera_trajectory(rng:np.random.Generator, num_frames:int, fps:float) -> tuple:
+    """Hand-held camera motion: camera-to-world rotations (N, 3, 3) and positions (N, 3) in meters.
+    Sums of random sinusoids (0.2-3 Hz) around the origin, looking along -z as ARKit cameras."""
+    t = np.arange(num_frames) / fps
+    positions = np.zeros((num_frames, 3))
+    angles = np.zeros((num_frames, 3))
+    for _ in range(4):
+        frequency = rng.uniform(0.2, 3.0, 6)
+        phase = rng.uniform(0, 2 * np.pi, 6)
+        wave = np.sin(2 * np.pi * frequency * t[:, None] + phase) / frequency
+        positions += 0.04 * wave[:, :3]
+        angles += np.deg2rad(1.5) * wave[:, 3:]
+    return rotation_matrix(angles), positions
+
+
+def plane_frame(K:np.ndarray, R:np.ndarray, position:np.ndarray, plane:dict, texture:np.ndarray, size:tuple) -> np.ndarray:
+    """Image of the textured plane seen by a camera (camera-to-world R, position)."""
+    # Plane point of texture pixel (u, v): origin + (u - size/2) * pixel * e1 + (v - size/2) * pixel * e2
+    h, w = texture.shape[:2]
+    A = np.array([[plane['pixel'], 0, -plane['pixel'] * w / 2],
+                  [0, plane['pixel'], -plane['pixel'] * h / 2],
+                  [0, 0, 1]])
+    # Camera coordinates of the plane point (a, b): R^T (origin + a e1 + b e2 - position)
+    P = R.T @ np.stack([plane['e1'], plane['e2'], plane['origin'] - position], axis=1)
+    # Projection of ARKit camera coordinates (x right, y up, z backwards)
+    P = np.diag([1, -1, -1]) @ P
+    H = K @ P @ A
+    return cv2.warpPerspective(texture, H, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+
+def plane_depth(K:np.ndarray, R:np.ndarray, position:np.ndarray, plane:dict, size:tuple) -> np.ndarray:
+    """Depth map (DEPTH_SHAPE, meters along the optical axis) of the plane."""
+    height, width = DEPTH_SHAPE
+    # Camera matrix scaled to the depth resolution
+    u, v = np.meshgrid((np.arange(width) + 0.5) * size[0] / width - 0.5, (np.arange(height) + 0.5) * size[1] / height - 0.5)
+    rays = np.stack([(u - K[0, 2]) / K[0, 0], -(v - K[1, 2]) / K[1, 1], -np.ones_like(u)], axis=-1)
+    normal = R.T @ plane['normal']
+    offset = normal @ (R.T @ (plane['origin'] - position))
+    return (offset / (rays @ normal)).astype(np.float32)
+
+
+def imu_data(R:np.ndarray, positions:np.ndarray, fps:float) -> dict:
+    """Device motion (Core Motion conventions) of the trajectory: user acceleration and gravity in g,
+    attitude quaternion and rotation rate in rad/s, all in the device frame."""
+    velocity = np.gradient(positions, 1 / fps, axis=0)
+    acceleration = np.gradient(velocity, 1 / fps, axis=0) / GRAVITY
+    gravity = np.array([0.0, -1.0, 0.0])
+    # Angular velocity from the relative rotation between consecutive frames
+    relative = np.transpose(R, (0, 2, 1))[:-1] @ R[1:]
+    rate = np.stack([relative[:, 2, 1] - relative[:, 1, 2], relative[:, 0, 2] - relative[:, 2, 0],
+                     relative[:, 1, 0] - relative[:, 0, 1]], axis=-1) / 2 * fps
+    rate = np.concatenate([rate, rate[-1:]])
+    return {
+        'acc': np.einsum('nji,nj->ni', R, acceleration),
+        'g': np.einsum('nji,j->ni', R, gravity),
+        'att': quaternion_from_matrix(R),
+        'rr': rate,
+    }
+
+
+def write_txt_data(path:str, columns:list, data:np.ndarray):
+    """Write a raw text file: header line '#col1, col2, ...' and comma separated values."""
+    with open(path, 'w') as f:
+        f.write('#' + ', '.join(columns) + '\n')
+        np.savetxt(f, data, delimiter=',', fmt='%.9g')
+
+
+def make_scene(rng:np.random.Generator, size:tuple, num_frames:int, fps:float) -> tuple:
+    """Intrinsics, camera trajectory (R, positions), plane and texture of a synthetic clip."""
+    width, height = size
+    # Camera: ~64 degrees horizontal field of view
+    focal = 0.78 * width
+    K = np.array([[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]])
+    R, positions = camera_trajectory(rng, num_frames, fps)
+
+    # Plane 2 m in front of the camera, tilted around the x axis
+    tilt = np.deg2rad(rng.uniform(15, 35))
+    normal = np.array([0, np.sin(tilt), np.cos(tilt)])
+    e1 = np.array([1.0, 0, 0])
+    e2 = np.cross(normal, e1)
+    texture = make_texture(rng)
+    plane = {'origin': np.array([0, 0, -2.0]), 'normal': normal, 'e1': e1, 'e2': -e2, 'pixel': 5.0 / texture.shape[0]}
+    return K, R, positions, plane, texture
+
+
+def write_raw_clip(video_dir:str, raw_config:dict, num_frames:int, size:tuple, fps:float, seed:int):
+    """
+    Write a synthetic raw capture in the layout of the capture app: the video, the
+    depth (float32) and confidence (uint8) maps at 192x256 as .bin files, the camera
+    poses with device motion (ARposes.txt) and the intrinsics (Frames.txt).
+
+    The scene is a tilted textured plane filmed with hand-held motion, so that the
+    video, depth, poses and IMU data are consistent with each other.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    depth_dir = os.path.join(video_dir, raw_config['depth_folder'])
+    conf_dir = os.path.join(video_dir, raw_config['confidence_folder'])
+    os.makedirs(depth_dir, exist_ok=True)
+    os.makedirs(conf_dir, exist_ok=True)
+    K, R, positions, plane, texture = make_scene(rng, size, num_frames, fps)
+
+    timestamps = np.arange(num_frames) / fps
+    with FFmpegWriter(os.path.join(video_dir, raw_config['video']), width, height, fps, output_args=video_encoder_args(fps)) as writer:
+        for i in tqdm(range(num_frames), desc='Synthetic clip {}'.format(os.path.basename(video_dir))):
+            writer.write(plane_frame(K, R[i], positions[i], plane, texture, size))
+            depth = plane_depth(K, R[i], positions[i], plane, size)
+            depth.tofile(os.path.join(depth_dir, '{:05d}.bin'.format(i)))
+            # Confidence levels of ARKit (0 low, 1 medium, 2 high): lower far away and in random patches
+            conf = np.where(depth < 3.0, 2, 1).astype(np.uint8)
+            conf[cv2.resize(rng.random((12, 16)), DEPTH_SHAPE[::-1], interpolation=cv2.INTER_NEAREST) < 0.08] = 0
+            conf.tofile(os.path.join(conf_dir, '{:05d}.bin'.format(i)))
+
+    imu = imu_data(R, positions, fps)
+    poses = np.column_stack([timestamps, positions, quaternion_from_matrix(R), imu['acc'], imu['g'], imu['att'], imu['rr']])
+    write_txt_data(os.path.join(video_dir, raw_config['camera_info']), POSES_COLUMNS, poses)
+    intrinsics = np.column_stack([timestamps, np.arange(num_frames), np.tile([K[0, 0], K[1, 1], K[0, 2], K[1, 2]], (num_frames, 1))])
+    write_txt_data(os.path.join(video_dir, raw_config['intrinsics']), FRAMES_COLUMNS, intrinsics)
+
+
+def write_config(workspace:str, base_config:str=DEFAULT_CONFIG) -> str:
+    """Copy of the base config with all data, meta-data and cache paths inside the workspace.
+    Returns the path of the new config file."""
+    config = OmegaConf.load(base_config)
+    for root in ['DAVIDE-raw', 'DAVIDE-tmp', 'DAVIDE']:
+        config[root]['ROOT'] = os.path.join(workspace, root)
+    config['DATA-GEN-PARAMS']['annotations'] = os.path.join(workspace, 'meta-data', 'DAVIDE-annotations.csv')
+    config['DATA-GEN-PARAMS']['dp_log'] = os.path.join(workspace, 'meta-data', 'DAVIDE-DP_log.db')
+    config['PLANNER']['frame_index'] = os.path.join(workspace, 'meta-data', 'DAVIDE-frames.csv')
+    config['MONO-DEPTH']['cache_dir'] = os.path.join(workspace, 'DAVIDE-tmp', '.cache', 'mono-depth')
+    # Repository files
+    config['DATA-GEN-PARAMS']['XVFI_config'] = os.path.join(REPO_ROOT, config['DATA-GEN-PARAMS']['XVFI_config'])
+    config['CRF_calibration']['crf_file'] = os.path.join(REPO_ROOT, config['CRF_calibration']['crf_file'])
+    config_file = os.path.join(workspace, 'config.yaml')
+    OmegaConf.save(config, config_file)
+    return config_file
+
+
+def generate(workspace:str, clips:int=1, frames:int=241, size:tuple=(1920, 1440), fps:float=60, seed:int=0,
+             base_config:str=DEFAULT_CONFIG) -> str:
+    """
+    Write synthetic recordings in `workspace`: raw captures in DAVIDE-raw, the
+    annotations CSV and a config that points to them. Returns the config file.
+    """
+    workspace = os.path.abspath(workspace)
+    os.makedirs(os.path.join(workspace, 'meta-data'), exist_ok=True)
+    config_file = write_config(workspace, base_config)
+    config = OmegaConf.to_container(OmegaConf.load(config_file), resolve=True)
+
+    recordings = []
+    for clip in range(clips):
+        video_name = 'bundle-synthetic-{:02d}'.format(clip)
+        write_raw_clip(os.path.join(config['DAVIDE-raw']['ROOT'], video_name), config['DAVIDE-raw'], frames, size, fps, seed + clip)
+        recordings.append({'recording': video_name, 'start': 0, 'end': frames - 1, 'tag': 'synthetic', 'split': 'test', 'flag': None})
+    pd.DataFrame(recordings).to_csv(config['DATA-GEN-PARAMS']['annotations'], index=False)
+    print('{} synthetic recordings written to {}. Config: {}'.format(clips, config['DAVIDE-raw']['ROOT'], config_file))
+    return config_file
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    width, height = (int(x) for x in args.size.split('x'))
+    generate(args.workspace, args.clips, args.frames, (width, height), args.fps, args.seed, args.config)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -8,8 +8,8 @@ import argparse
 from pytransform3d import transformations
 from pytransform3d import trajectories
 
-from davide_dp.configs import read_config
-from davide_dp.utils import read_txt_data, is_step_complete, log_step_event, update_summary_for_video
+from davide_dp.pipeline import PipelineContext
+from davide_dp.utils import read_txt_data, record_step_event, StepMetrics
 
 
 def parse_args(argv):
@@ -73,52 +73,47 @@ def export_imu(camera_data:pd.DataFrame, imu_file:str):
     pd.DataFrame(imu).to_csv(imu_file, sep=',', header=True, index=False)
 
 
-def main(argv):
-    # Parse arguments and read config
-    args = parse_args(argv)
-    config = read_config(args.config)
-    idx = args.id
-
-    # Get root directory and video list
-    root_dir = config['DAVIDE-raw']['ROOT']
-    data_annotations_path = config['DATA-GEN-PARAMS']['annotations']
-    annotations = pd.read_csv(data_annotations_path)
-    video_list = annotations['recording'].values.tolist()
-    input_video_dir = os.path.join(root_dir, video_list[idx])
+def run_step(ctx:PipelineContext, video_name:str):
+    """Step 5: export camera poses, intrinsics and imu data of a video."""
+    config = ctx.config
+    input_video_dir = ctx.video_dir(video_name, root='DAVIDE-raw')
     print('Input video dir: ', input_video_dir)
 
     # Check if step 1 is done
-    if not is_step_complete(dp_step='step_1', videos=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log']):
-        raise ValueError(f"Step 1 is not done yet for video {video_list[idx]}. Check dp log.")
+    ctx.require_steps(video_name, ['step_1'])
 
     # Input and output paths
     input_intrinsics_file = os.path.join(input_video_dir, config['DAVIDE-raw']['intrinsics'])
     input_camera_file = os.path.join(input_video_dir, config['DAVIDE-raw']['camera_info'])
-    output_intrinsics_file = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['camera_intrinsics'])
-    output_poses_file = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['camera_poses'])
-    output_imu_file = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['imu_data'])
-    os.makedirs(os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx]), exist_ok=True)
-
-    # Read input files
-    intrinsics_data = read_txt_data(input_intrinsics_file)
-    camera_data = read_txt_data(input_camera_file)
-
-    # Define frame-stamp
-    num_frames = config['DATA-GEN-PARAMS']['num_frames']
-    middle_frame_num = num_frames // 2 if num_frames % 2 == 0 else num_frames // 2 + 1
-    tN = (len(camera_data)-1)//num_frames * num_frames
-    frame_stamp = (np.linspace(0, tN , tN +1) - middle_frame_num)/num_frames
-
-    # Concatenate frame-stamp to camera data and intrinsics data
-    camera_data = camera_data[:len(frame_stamp)]
-    intrinsics_data = intrinsics_data[:len(frame_stamp)]
-    camera_data['frame-stamp'] = frame_stamp
-    intrinsics_data['frame-stamp'] = frame_stamp
-
-    # Export camera poses, intrinsics, and imu data
-    export_poses(camera_data, output_poses_file)
-    export_intrinsics(intrinsics_data, output_intrinsics_file)
-    export_imu(camera_data, output_imu_file)
+    output_intrinsics_file = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['camera_intrinsics'])
+    output_poses_file = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['camera_poses'])
+    output_imu_file = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['imu_data'])
+    os.makedirs(ctx.video_dir(video_name), exist_ok=True)
+
+    output_files = [output_poses_file, output_intrinsics_file, output_imu_file]
+    with StepMetrics(video_name, 'step_5', ctx.db_path, output_dirs=output_files) as metrics:
+        # Read input files
+        intrinsics_data = read_txt_data(input_intrinsics_file)
+        camera_data = read_txt_data(input_camera_file)
+        metrics.frames_in = len(camera_data)
+
+        # Define frame-stamp
+        num_frames = config['DATA-GEN-PARAMS']['num_frames']
+        middle_frame_num = num_frames // 2 if num_frames % 2 == 0 else num_frames // 2 + 1
+        tN = (len(camera_data)-1)//num_frames * num_frames
+        frame_stamp = (np.linspace(0, tN , tN +1) - middle_frame_num)/num_frames
+
+        # Concatenate frame-stamp to camera data and intrinsics data
+        camera_data = camera_data[:len(frame_stamp)]
+        intrinsics_data = intrinsics_data[:len(frame_stamp)]
+        camera_data['frame-stamp'] = frame_stamp
+        intrinsics_data['frame-stamp'] = frame_stamp
+
+        # Export camera poses, intrinsics, and imu data
+        export_poses(camera_data, output_poses_file)
+        export_intrinsics(intrinsics_data, output_intrinsics_file)
+        export_imu(camera_data, output_imu_file)
+        metrics.frames_out = len(frame_stamp)
 
     print('--'*30)
     print('Poses data exported to: ', output_poses_file)
@@ -126,9 +121,15 @@ def main(argv):
     print('IMU data exported to: ', output_imu_file)
 
     # Update dp log
-    log_step_event(video_name=video_list[idx], dp_step='step_5', new_status=1, db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    update_summary_for_video(video_name=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    print(f"Step 5 completed for video {video_list[idx]}.")
+    record_step_event(video_name=video_name, dp_step='step_5', new_status=1, db_path=ctx.db_path)
+    print(f"Step 5 completed for video {video_name}.")
+
+
+def main(argv):
+    # Parse arguments and create pipeline context
+    args = parse_args(argv)
+    ctx = PipelineContext(args.config)
+    run_step(ctx, ctx.video_name(args.id))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+import sys
+import time
+import argparse
+import importlib
+import subprocess
+
+from davide_dp.utils.ids import parse_id_list
+from davide_dp.utils.progress_db import DP_STEPS, get_step_status, step_dependencies
+
+
+# Subcommands that forward their arguments to the main function of a module
+COMMANDS = {
+    'report': 'davide_dp.report',
+    'schedule': 'davide_dp.scheduler',
+    'plan': 'davide_dp.job_planner',
+    'queue': 'davide_dp.work_queue',
+    'export': 'davide_dp.configs.export',
+}
+
+# In-process implementation of each step. Step 6 runs its shell driver in a subprocess.
+STEP_MODULES = {
+    'step_1': 'davide_dp.extract_rgb',
+    'step_2': 'davide_dp.VFI_runner',
+    'step_3': 'davide_dp.rgb_blur',
+    'step_4': 'davide_dp.depth',
+    'step_5': 'davide_dp.camera_data',
+    'step_7': 'davide_dp.mono_depth',
+    'step_8': 'davide_dp.data_selection',
+}
+
+USAGE = """davide-dp <command> [options]
+
+Commands:
+  run        Run data processing steps for many videos in one process
+  report     Performance metrics of the steps (davide_dp.report)
+  schedule   Local dependency-aware scheduler (davide_dp.scheduler)
+  plan       Job planner for cluster submission (davide_dp.job_planner)
+  queue      Work queue: populate, worker, status (davide_dp.work_queue)
+  export     Config and step status for shell drivers (davide_dp.configs.export)
+
+Run `davide-dp <command> -h` for the options of each command."""
+
+
+def parse_run_args(argv):
+    parser = argparse.ArgumentParser(prog='davide-dp run', description='Runs data processing steps for many videos in one process, reusing config, annotations and models')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--steps", type=str, default='2-5,7,8', help='Steps to run. E.g. 2-5,7,8. Step 8 exports mono depth if step 7 is included')
+    parser.add_argument("--clips", type=str, default=None, help='Video ids. E.g. 0-92 or 0,2,5-7. Default: all videos')
+    parser.add_argument("--gpu", type=int, default=0, help='gpu index (steps 2 and 3)')
+    parser.add_argument("--rerun", action='store_true', help='Run steps that are already complete in the dp log')
+    parser.add_argument("--keep_going", action='store_true', help='Continue with the other videos when a step fails')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def step_options(dp_step:str, args, mono_depth:bool) -> dict:
+    """Keyword arguments of the run_step function of a step."""
+    if dp_step in ['step_2', 'step_3']:
+        return {'gpu': args.gpu}
+    if dp_step == 'step_8':
+        return {'mono_depth': mono_depth}
+    return {}
+
+
+def run(argv=None) -> int:
+    """Run steps in step-major order: each step runs for all videos before the next one,
+    so that its model stays loaded while it is needed."""
+    from davide_dp.pipeline import PipelineContext
+    from davide_dp.scheduler import step_command
+
+    args = parse_run_args(argv)
+    ctx = PipelineContext(args.config)
+    clip_ids = parse_id_list(args.clips) if args.clips is not None else list(range(len(ctx.video_list)))
+    steps = ['step_{}'.format(i) for i in parse_id_list(args.steps)]
+    for dp_step in steps:
+        assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+    mono_depth = 'step_7' in steps
+
+    if 'step_7' in steps:
+        from davide_dp.utils.cpu_inference import set_num_threads
+        set_num_threads(ctx.config['MONO-DEPTH']['num_threads'])
+
+    failed = {}
+    blocked = []
+    for dp_step in steps:
+        for clip_id in clip_ids:
+            video_name = ctx.video_name(clip_id)
+            if video_name in failed:
+                continue
+            status = get_step_status(ctx.db_path, videos=[video_name]).get(video_name, {})
+            if status.get(dp_step, False) and not args.rerun:
+                continue
+            missing = [dep for dep in step_dependencies(dp_step, mono_depth) if not status.get(dep, False)]
+            if missing:
+                print('Skipping {}[{}]: {} not complete.'.format(dp_step, video_name, ', '.join(missing)))
+                blocked.append((video_name, dp_step))
+                continue
+
+            print('--'*30)
+            print('[{}] {}[{}]'.format(time.strftime('%H:%M:%S'), dp_step, video_name))
+            try:
+                if dp_step in STEP_MODULES:
+                    module = importlib.import_module(STEP_MODULES[dp_step])
+                    module.run_step(ctx, video_name, **step_options(dp_step, args, mono_depth))
+                else:
+                    subprocess.run(step_command(dp_step, clip_id, args.config), check=True)
+            except Exception as error:
+                if not args.keep_going:
+                    raise
+                print('FAILED {}[{}]: {!r}'.format(dp_step, video_name, error))
+                failed[video_name] = dp_step
+
+    print('--'*30)
+    for video_name, dp_step in failed.items():
+        print('{} failed at {}'.format(video_name, dp_step))
+    print('Failed: {}, skipped (dependencies not complete): {}'.format(len(failed), len(blocked)))
+    return 1 if failed or blocked else 0
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ['-h', '--help']:
+        print(USAGE)
+        return 0
+    command, argv = argv[0], argv[1:]
+    if command == 'run':
+        return run(argv)
+    if command not in COMMANDS:
+        print(USAGE)
+        print('\nUnknown command: {}'.format(command))
+        return 2
+    return importlib.import_module(COMMANDS[command]).main(argv) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
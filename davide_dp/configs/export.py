@@ -0,0 +1,84 @@
+import os
+import re
+import sys
+import csv
+import json
+import shlex
+import argparse
+
+from davide_dp.configs import read_config
+from davide_dp.utils.progress_db import get_step_status
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Exports the config and the step status of a video for the shell drivers')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--id", type=int, default=None, help='Video id. Exports VIDEO and the status of --steps')
+    parser.add_argument("--steps", type=int, nargs='*', default=[], help='Steps whose status is exported as STEP_<n>=True/False')
+    parser.add_argument("--format", type=str, default='shell', choices=['shell', 'json'], help='Shell assignments (for eval) or JSON')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def flatten(config:dict, prefix:str='') -> dict:
+    """Flatten nested config sections into shell variable names.
+    E.g. config['DAVIDE-tmp']['sample_videos']['folder'] -> DAVIDE_TMP_SAMPLE_VIDEOS_FOLDER"""
+    variables = {}
+    for key, value in config.items():
+        name = re.sub(r'\W', '_', '{}_{}'.format(prefix, key) if prefix else str(key)).upper()
+        if isinstance(value, dict):
+            variables.update(flatten(value, name))
+        else:
+            variables[name] = value
+    return variables
+
+
+def shell_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+def read_video_list(annotations_file:str) -> list:
+    with open(annotations_file, 'r') as f:
+        return [row['recording'] for row in csv.DictReader(f)]
+
+
+def export(config_file:str, clip_id:int=None, steps:list=()) -> dict:
+    """
+    Config values, the number of videos (NUM_VIDEOS) if the annotations file
+    exists and, if a video id is given, its name and step status.
+    """
+    config = read_config(config_file)
+    variables = flatten(config)
+    annotations_file = config['DATA-GEN-PARAMS']['annotations']
+    video_list = read_video_list(annotations_file) if clip_id is not None or os.path.isfile(annotations_file) else []
+    if video_list:
+        variables['NUM_VIDEOS'] = len(video_list)
+    if clip_id is not None:
+        video_name = video_list[clip_id]
+        variables['CLIP_ID'] = clip_id
+        variables['VIDEO'] = video_name
+        if steps:
+            dp_steps = ['step_{}'.format(step) for step in steps]
+            status = get_step_status(config['DATA-GEN-PARAMS']['dp_log'], videos=[video_name], steps=dp_steps)
+            # Videos without a row in the summary table have no step complete
+            status = status.get(video_name, {})
+            variables.update({dp_step.upper(): status.get(dp_step, False) for dp_step in dp_steps})
+    return variables
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    variables = export(args.config, args.id, args.steps)
+    if args.format == 'json':
+        print(json.dumps(variables, indent=2))
+    else:
+        print('\n'.join('{}={}'.format(name, shlex.quote(shell_value(value))) for name, value in variables.items()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
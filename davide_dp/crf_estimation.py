@@ -3,15 +3,17 @@ import numpy as np
 import os
 import sys
 import argparse
-import torch
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 from davide_dp.configs import read_config
+from davide_dp.utils.metrics import available_cpus
 
 
 BORDER_CROP = 16
 SAVE_PATH = './crf_calibration'
+# Intensities above the limit are extrapolated from the response at the limit
+OVER_EXPOSED_LIMIT = 250
 
 
 def cum_homography(H_list, ref_id):
@@ -40,79 +42,138 @@ def cum_homography(H_list, ref_id):
 
 
 
-def image_alignment(img_list, save_paths):
-    """Aligns images using homography matrices."""
-
-    print('Aligning images ...')
+def detect_features(img, scale=1.0):
+    """SIFT keypoints and descriptors of an image, detected on a copy downscaled by `scale`.
+    Keypoint coordinates are returned at full resolution."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if scale != 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    keypoints, descriptors = cv2.SIFT_create().detectAndCompute(gray, None)
+    points = np.array([kp.pt for kp in keypoints], dtype=np.float64).reshape(-1, 2)
+    if scale != 1:
+        # pixel centers of the downscaled image to full resolution
+        points = (points + 0.5) / scale - 0.5
+    return points, descriptors
+
+
+def match_features(des1, des2, ratio, matcher='flann'):
+    """Indices (query, train) of the matches of two descriptor sets that pass the ratio test."""
+    if matcher == 'flann':
+        # approximate nearest neighbours (randomized kd-trees)
+        matcher = cv2.FlannBasedMatcher(dict(algorithm=1, trees=5), dict(checks=50))
+    else:
+        matcher = cv2.BFMatcher()
+    matches = [pair for pair in matcher.knnMatch(des1, des2, k=2) if len(pair) == 2]
+    indices = np.array([(m.queryIdx, m.trainIdx) for m, _ in matches], dtype=np.int64).reshape(-1, 2)
+    distances = np.array([(m.distance, n.distance) for m, n in matches], dtype=np.float64).reshape(-1, 2)
+    return indices[distances[:, 0] < ratio * distances[:, 1]]
+
+
+def refine_homography(img1, img2, H, iterations, eps=1e-6):
+    """Refine a homography (img1 -> img2) with ECC on the full resolution images.
+    Saturated and dark pixels of img1 are ignored. Returns H if ECC does not converge."""
+    gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
+    gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
+    mask = ((gray1 > 5) & (gray1 < 250)).astype(np.uint8)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, eps)
+    try:
+        _, warp = cv2.findTransformECC(gray1, gray2, (H / H[2, 2]).astype(np.float32), cv2.MOTION_HOMOGRAPHY, criteria, mask, 5)
+    except cv2.error as error:
+        print('ECC refinement failed, keeping feature homography: {}'.format(str(error).strip().splitlines()[-1]))
+        return H
+    return warp.astype(np.float64)
+
+
+def estimate_homographies(img_list, scale=1.0, matcher='bf', ecc_iterations=0, workers=1):
+    """Homographies that map each image to the reference image (len(img_list) // 2 + 1).
+
+    Features are detected once per image, on a copy downscaled by `scale`, and
+    consecutive pairs are matched concurrently on `workers` threads. Homographies
+    are refined with `ecc_iterations` of ECC at full resolution (0: no refinement).
+    The defaults reproduce the original single-threaded alignment.
+    """
     # Ref image id
     ref_id = len(img_list) // 2 + 1
     print('Reference image id: ', ref_id)
-    # List of homography matrices
-    H_list = []
-    # Read by pairs
-    print('Computing homography matrices between consecutive ...')
-    for i in tqdm(range(len(img_list)-1)):
-        # Convert to gray
-        img1 = cv2.cvtColor(img_list[i], cv2.COLOR_BGR2GRAY)
-        img2 = cv2.cvtColor(img_list[i+1], cv2.COLOR_BGR2GRAY)
-
-        # Initiate SIFT detector
-        sift = cv2.SIFT_create()
-        # find the keypoints and descriptors with SIFT
-        kp1, des1 = sift.detectAndCompute(img1,None)
-        kp2, des2 = sift.detectAndCompute(img2,None)
-
-        # BFMatcher with default params
-        bf = cv2.BFMatcher()
-        matches = bf.knnMatch(des1,des2,k=2)
-        # Apply ratio test
-        good = []
-        for m,n in matches:
-            if m.distance < (0.9-0.05*i)*n.distance:
-                good.append([m])
-
-        # Define empty matrices
-        no_of_matches = len(good)
-        p1 = np.zeros((no_of_matches, 2))
-        p2 = np.zeros((no_of_matches, 2))
-        
-        for (i, match) in enumerate(good):
-                p1[i, :] = kp1[match[0].queryIdx].pt
-                p2[i, :] = kp2[match[0].trainIdx].pt
-        
-        # Find the homography matrix.
-        Hi, Mi = cv2.findHomography(p1, p2, cv2.RANSAC)
-        H_list.append(Hi)
-    
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Features of each image
+        print('Detecting features (scale {}) ...'.format(scale))
+        features = list(tqdm(executor.map(lambda img: detect_features(img, scale), img_list), total=len(img_list)))
+
+        def pair_homography(i):
+            (p1, des1), (p2, des2) = features[i], features[i+1]
+            good = match_features(des1, des2, ratio=0.9-0.05*i, matcher=matcher)
+            # Find the homography matrix. Keypoints of downscaled images are less accurate
+            Hi, _ = cv2.findHomography(p1[good[:, 0]], p2[good[:, 1]], cv2.RANSAC, 3.0 / min(scale, 1))
+            if ecc_iterations > 0:
+                Hi = refine_homography(img_list[i], img_list[i+1], Hi, ecc_iterations)
+            return Hi
+
+        # List of homography matrices between consecutive images
+        print('Computing homography matrices between consecutive ...')
+        H_list = list(tqdm(executor.map(pair_homography, range(len(img_list)-1)), total=len(img_list)-1))
+
     # Cumulate homography matrices
     H_cum_list = cum_homography(H_list, ref_id)
     print('Number of homography matrices: ', len(H_cum_list))
     print('Number of images: ', len(img_list))
+    return H_cum_list
 
-    # Warp images
-    img_list_aligned = []
-    print('Warping images ...')
-    for n, (img, H) in tqdm(enumerate(zip(img_list, H_cum_list))):
-        if n == ref_id:
-            img_list_aligned.append(img)
-        else:
-            img_aligned = cv2.warpPerspective(img, H, (img.shape[1], img.shape[0]))
-            img_list_aligned.append(img_aligned)
 
+def image_alignment(img_list, save_paths, scale=1.0, matcher='bf', ecc_iterations=0, workers=1):
+    """Aligns images using homography matrices (see estimate_homographies)."""
+
+    print('Aligning images ...')
+    H_cum_list = estimate_homographies(img_list, scale, matcher, ecc_iterations, workers)
+    ref_id = len(img_list) // 2 + 1
+
+    def warp(n):
+        img, H = img_list[n], H_cum_list[n]
+        if n != ref_id:
+            img = cv2.warpPerspective(img, H, (img.shape[1], img.shape[0]))
         # Crop borders
-        img_list_aligned[n] = img_list_aligned[n][BORDER_CROP:-BORDER_CROP, BORDER_CROP:-BORDER_CROP, :]
+        img = img[BORDER_CROP:-BORDER_CROP, BORDER_CROP:-BORDER_CROP, :]
         # Save aligned images
-        cv2.imwrite(save_paths[n], img_list_aligned[n])
-    
+        cv2.imwrite(save_paths[n], img)
+        return img
+
+    # Warp images
+    print('Warping images ...')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        img_list_aligned = list(tqdm(executor.map(warp, range(len(img_list))), total=len(img_list)))
+
     return img_list_aligned
 
 
+def estimate_crf(img_list_aligned, exposures, samples=70):
+    """Inverse CRF (256, 3) in RGB order of aligned images, with Debevec calibration."""
+    cal = cv2.createCalibrateDebevec(samples=samples)
+    crf_inv = cal.process(img_list_aligned, times=exposures)
+    crf_inv = crf_inv.reshape(-1, 3)    # reshape to (N, 3)
+    crf_inv = crf_inv[:, ::-1]          # reverse order of channels (BGR -> RGB)
+
+    # 1st order approximation at RGB=250 to regularize extreme responses at RGB>251
+    over_exposed_limit = OVER_EXPOSED_LIMIT
+    diff = (crf_inv[over_exposed_limit+1] - crf_inv[over_exposed_limit-1])/2
+    for i in range(over_exposed_limit+1, 256):
+        crf_inv[i] = crf_inv[i-1] + diff
+    return crf_inv
+
+
 def parse_args(argv):
     parser = argparse.ArgumentParser(description='Estimates CRF from image bracket')
     parser.add_argument('-i', "--images", type=str, required=True, help='Directory of images for CRF estimation')
     parser.add_argument('-e', "--exposures", type=str, required=True, help='Path to file containing exposure times')
     parser.add_argument('-f', "--filename", type=str, required=True, help='Output crf file name')
     parser.add_argument('-s', "--save_path", type=str, default=SAVE_PATH, help='Path to save the CRF file and plot')
+    parser.add_argument("--scale", type=float, default=0.5, help='Downscale factor of the images for feature detection')
+    parser.add_argument("--matcher", type=str, default='flann', choices=['flann', 'bf'], help='Feature matcher: approximate (flann) or brute force (bf)')
+    parser.add_argument("--ecc_iterations", type=int, default=1, help='ECC iterations refining the homographies at full resolution. 0: no refinement')
+    parser.add_argument("--samples", type=int, default=70, help='Pixels sampled by the Debevec calibration')
+    parser.add_argument("--workers", type=int, default=None, help='Threads detecting, matching and warping. Default: available CPUs')
+    parser.add_argument("--reference", type=str, default=None, help='CRF file (.pt) to compare the estimated CRF with')
+    parser.add_argument("--tolerance", type=float, default=0.05, help='Maximum difference from the reference CRF below the over-exposed limit, relative to its range')
 
     args = parser.parse_args(argv)
     return args
@@ -121,6 +182,10 @@ def parse_args(argv):
 def main(argv=None):
     # Parse arguments
     args = parse_args(argv)
+    workers = args.workers or available_cpus()
+
+    import torch
+    import matplotlib.pyplot as plt
     SAVE_PATH = args.save_path
     os.makedirs(SAVE_PATH, exist_ok=True)
     plot_file = os.path.join(SAVE_PATH, args.filename + '.png')
@@ -134,13 +199,13 @@ def main(argv=None):
     images_list.sort()
     if len(images_list) == 0:
         print('No png files found in {}'.format(args.images))
-        return
+        return 1
     img_list = [cv2.imread(os.path.join(args.images, img)) for img in images_list]
 
     # Image alignment
     save_paths = [os.path.join(args.images, 'aligned', img) for img in images_list]
     os.makedirs(os.path.join(args.images, 'aligned'), exist_ok=True)
-    img_list_aligned = image_alignment(img_list, save_paths)
+    img_list_aligned = image_alignment(img_list, save_paths, args.scale, args.matcher, args.ecc_iterations, workers)
 
 
     # Read exposure times
@@ -152,16 +217,8 @@ def main(argv=None):
     print('Computing CRF ...')
 
     # Debevec calibration
-    cal = cv2.createCalibrateDebevec()
-    crf_inv = cal.process(img_list_aligned, times=exposures)
-    crf_inv = crf_inv.reshape(-1, 3)    # reshape to (N, 3)
-    crf_inv = crf_inv[:, ::-1]          # reverse order of channels (BGR -> RGB)
-
-    # 1st order approximation at RGB=250 to regularize extreme responses at RGB>251
-    over_exposed_limit = 250
-    diff = (crf_inv[over_exposed_limit+1] - crf_inv[over_exposed_limit-1])/2
-    for i in range(over_exposed_limit+1, 256):
-        crf_inv[i] = crf_inv[i-1] + diff
+    crf_inv = estimate_crf(img_list_aligned, exposures, args.samples)
+    over_exposed_limit = OVER_EXPOSED_LIMIT
 
     # Save CRF
     torch.save(torch.from_numpy(crf_inv.copy()), crf_file)
@@ -183,6 +240,17 @@ def main(argv=None):
 
     print('Estimated CRF saved to {}'.format(crf_file))
 
+    # Compare with a reference CRF
+    if args.reference is not None:
+        # Calibrated intensities only: the extrapolation above is sensitive to the last estimated values
+        reference = torch.load(args.reference).numpy().transpose()[:, :over_exposed_limit]
+        error = np.abs(crf_inv[:, :over_exposed_limit] - reference).max(axis=1) / np.ptp(reference, axis=1)
+        print('Difference from {} (relative to its range): R {:.4f}, G {:.4f}, B {:.4f}'.format(args.reference, *error))
+        if error.max() > args.tolerance:
+            print('CRF differs from the reference by more than {}'.format(args.tolerance))
+            return 1
+    return 0
+
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -8,13 +8,16 @@ import argparse
 from pytransform3d import transformations
 from pytransform3d import trajectories
 
-from configs import read_config
+from davide_dp.pipeline import PipelineContext
 from davide_dp.utils import (
-    is_step_complete,
-    log_step_event,
-    update_summary_for_video,
-    read_txt_data
+    step_dependencies,
+    record_step_event,
+    read_txt_data,
+    StepMetrics,
 )
+from davide_dp.utils.metrics import count_files
+from davide_dp.utils import tracing
+from davide_dp.utils.pyramid import pyramid_levels, level_folder, scale_intrinsics
 
 
 def parse_args(argv):
@@ -22,14 +25,15 @@ def parse_args(argv):
     parser.add_argument("--config", type=str, default='./configs/config.yaml', help='Path to config file')
     parser.add_argument("--id", type=int, required=True, help='Video id')
     parser.add_argument("--mono_depth", action='store_true', help='Export mono depth folder')
+    parser.add_argument("--level", type=int, default=None, help='Resolution pyramid level to export (1: full resolution). Default: RESOLUTION-PYRAMID.export_level in config')
 
     args = parser.parse_args(argv)
     return args
 
 
-def get_frame_ids(start, end, input_video_dir, config):
+def get_frame_ids(start, end, input_video_dir, config, level=1):
     """Get frame ids from start and end annotations."""
-    blur_dir = os.listdir(os.path.join(input_video_dir, config['DAVIDE-tmp']['blur_folder']))
+    blur_dir = os.listdir(level_folder(os.path.join(input_video_dir, config['DAVIDE-tmp']['blur_folder']), level))
     blur_dir.sort()
     frame_ids = np.asarray([int(os.path.splitext(file)[0]) for file in blur_dir])
 
@@ -72,71 +76,71 @@ def convert_recording_name(recording, annotations):
     return recording_name
 
 
-def export_blur_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config):
+def export_blur_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level=1):
     """Export blur folder based on start and end ids."""
     # Get input blur folder
-    blur_folder = os.path.join(input_video_dir, config['DAVIDE-tmp']['blur_folder'])
+    blur_folder = level_folder(os.path.join(input_video_dir, config['DAVIDE-tmp']['blur_folder']), level)
     # Get blur files
     blur_files = os.listdir(blur_folder)
     blur_files.sort()
-    # Get start file
-    start_file = "{:08d}.png".format(start_id)
+    # Get start file (frames of any image codec)
+    start_file = "{:08d}".format(start_id)
     # Get end file
-    end_file = "{:08d}.png".format(end_id)
+    end_file = "{:08d}".format(end_id)
     # Get start and end file ids
-    start_file_id = [i for i, file in enumerate(blur_files) if file == start_file][0]
-    end_file_id = [i for i, file in enumerate(blur_files) if file == end_file][0]
+    start_file_id = [i for i, file in enumerate(blur_files) if os.path.splitext(file)[0] == start_file][0]
+    end_file_id = [i for i, file in enumerate(blur_files) if os.path.splitext(file)[0] == end_file][0]
     # Select blur files
     blur_files = blur_files[start_file_id:end_file_id+1]
     # Export blur files
     for blur_file in tqdm(blur_files, desc='Exporting blur files'):
-        output_parent_dir = os.path.join(output_root_dir, config['DAVIDE']['blur_folder'], recording_name)
+        output_parent_dir = os.path.join(output_root_dir, level_folder(config['DAVIDE']['blur_folder'], level), recording_name)
         os.makedirs(output_parent_dir, exist_ok=True)
         os.system('cp {} {}'.format(os.path.join(blur_folder, blur_file), os.path.join(output_parent_dir, blur_file)))
 
 
-def export_sharp_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config):
+def export_sharp_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level=1):
     """Export sharp folder based on start and end ids."""
     # Get sharp folder
-    sharp_folder = os.path.join(input_video_dir, config['DAVIDE-tmp']['sharp_folder'])
+    sharp_folder = level_folder(os.path.join(input_video_dir, config['DAVIDE-tmp']['sharp_folder']), level)
     # Get sharp files
     sharp_files = os.listdir(sharp_folder)
     sharp_files.sort()
-    # Get start file
-    start_file = "{:08d}.png".format(start_id)
+    # Get start file (frames of any image codec)
+    start_file = "{:08d}".format(start_id)
     # Get end file
-    end_file = "{:08d}.png".format(end_id)
+    end_file = "{:08d}".format(end_id)
     # Get start and end file ids
-    start_file_id = [i for i, file in enumerate(sharp_files) if file == start_file][0]
-    end_file_id = [i for i, file in enumerate(sharp_files) if file == end_file][0]
+    start_file_id = [i for i, file in enumerate(sharp_files) if os.path.splitext(file)[0] == start_file][0]
+    end_file_id = [i for i, file in enumerate(sharp_files) if os.path.splitext(file)[0] == end_file][0]
     # Select sharp files
     sharp_files = sharp_files[start_file_id:end_file_id+1]
     # Export sharp files
     for sharp_file in tqdm(sharp_files, desc='Exporting sharp files'):
-        output_parent_dir = os.path.join(output_root_dir, config['DAVIDE']['sharp_folder'], recording_name)
+        output_parent_dir = os.path.join(output_root_dir, level_folder(config['DAVIDE']['sharp_folder'], level), recording_name)
         os.makedirs(output_parent_dir, exist_ok=True)
         os.system('cp {} {}'.format(os.path.join(sharp_folder, sharp_file), os.path.join(output_parent_dir, sharp_file)))
 
 
-def export_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config):
+def export_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level=1):
     """Export depth folder based on start and end ids."""
     # Get depth folder
-    depth_folder = os.path.join(input_video_dir, config['DAVIDE-tmp']['depth_folder'])
+    depth_folder = level_folder(os.path.join(input_video_dir, config['DAVIDE-tmp']['depth_folder']), level)
     # Get depth files
     depth_files = os.listdir(depth_folder)
     depth_files.sort()
-    # Get start file
-    start_file = "{:08d}.png".format(start_id)
+    # Get start file (frames of any image codec)
+    start_file = "{:08d}".format(start_id)
     # Get end file
-    end_file = "{:08d}.png".format(end_id)
+    end_file = "{:08d}".format(end_id)
     # Get start and end file ids
-    start_file_id = [i for i, file in enumerate(depth_files) if file == start_file][0]
-    end_file_id = [i for i, file in enumerate(depth_files) if file == end_file][0]
+    start_file_id = [i for i, file in enumerate(depth_files) if os.path.splitext(file)[0] == start_file][0]
+    end_file_id = [i for i, file in enumerate(depth_files) if os.path.splitext(file)[0] == end_file][0]
     # Select depth files
     depth_files = depth_files[start_file_id:end_file_id+1]
     # Export depth files
     for depth_file in tqdm(depth_files, desc='Exporting depth maps'):
-        output_parent_dir = os.path.join(output_root_dir, config['DAVIDE']['depth_folder'], recording_name)
+        output_parent_dir = os.path.join(output_root_dir, level_folder(config['DAVIDE']['depth_folder'], level), recording_name)
         os.makedirs(output_parent_dir, exist_ok=True)
         os.system('cp {} {}'.format(os.path.join(depth_folder, depth_file), os.path.join(output_parent_dir, depth_file)))
 
@@ -148,13 +152,13 @@ def export_mono_depth_folder(start_id, end_id, input_video_dir, output_root_dir,
     # Get depth files
     mono_depth_files = os.listdir(mono_depth_folder)
     mono_depth_files.sort()
-    # Get start file
-    start_file = "{:08d}.png".format(start_id)
+    # Get start file (frames of any image codec)
+    start_file = "{:08d}".format(start_id)
     # Get end file
-    end_file = "{:08d}.png".format(end_id)
+    end_file = "{:08d}".format(end_id)
     # Get start and end file ids
-    start_file_id = [i for i, file in enumerate(mono_depth_files) if file == start_file][0]
-    end_file_id = [i for i, file in enumerate(mono_depth_files) if file == end_file][0]
+    start_file_id = [i for i, file in enumerate(mono_depth_files) if os.path.splitext(file)[0] == start_file][0]
+    end_file_id = [i for i, file in enumerate(mono_depth_files) if os.path.splitext(file)[0] == end_file][0]
     # Select depth files
     mono_depth_files = mono_depth_files[start_file_id:end_file_id+1]
     # Export depth files
@@ -165,30 +169,30 @@ def export_mono_depth_folder(start_id, end_id, input_video_dir, output_root_dir,
         os.system('cp {} {}'.format(os.path.join(mono_depth_folder, depth_file), os.path.join(output_parent_dir, depth_file)))
 
 
-def export_confidence_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config):
+def export_confidence_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level=1):
     """Export confidence folder based on start and end ids."""
     # Get confidence folder
-    confidence_folder = os.path.join(input_video_dir, config['DAVIDE-tmp']['confidence_folder'])
+    confidence_folder = level_folder(os.path.join(input_video_dir, config['DAVIDE-tmp']['confidence_folder']), level)
     # Get confidence files
     confidence_files = os.listdir(confidence_folder)
     confidence_files.sort()
-    # Get start file
-    start_file = "{:08d}.png".format(start_id)
+    # Get start file (frames of any image codec)
+    start_file = "{:08d}".format(start_id)
     # Get end file
-    end_file = "{:08d}.png".format(end_id)
+    end_file = "{:08d}".format(end_id)
     # Get start and end file ids
-    start_file_id = [i for i, file in enumerate(confidence_files) if file == start_file][0]
-    end_file_id = [i for i, file in enumerate(confidence_files) if file == end_file][0]
+    start_file_id = [i for i, file in enumerate(confidence_files) if os.path.splitext(file)[0] == start_file][0]
+    end_file_id = [i for i, file in enumerate(confidence_files) if os.path.splitext(file)[0] == end_file][0]
     # Select confidence files
     confidence_files = confidence_files[start_file_id:end_file_id+1]
     # Export confidence files
     for confidence_file in tqdm(confidence_files, desc='Exporting confidence maps'):
-        output_parent_dir = os.path.join(output_root_dir, config['DAVIDE']['confidence_folder'], recording_name)
+        output_parent_dir = os.path.join(output_root_dir, level_folder(config['DAVIDE']['confidence_folder'], level), recording_name)
         os.makedirs(output_parent_dir, exist_ok=True)
         os.system('cp {} {}'.format(os.path.join(confidence_folder, confidence_file), os.path.join(output_parent_dir, confidence_file)))
 
 
-def export_intrinsics(start_id, end_id, input_video_dir, output_root_dir, recording_name, config):
+def export_intrinsics(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level=1):
     """Export intrinsics based on start and end ids."""
     # Get intrinsics file
     intrinsics_file = os.path.join(input_video_dir, config['DAVIDE-tmp']['camera_intrinsics'])
@@ -206,8 +210,13 @@ def export_intrinsics(start_id, end_id, input_video_dir, output_root_dir, record
     frame_stamp = (np.linspace(0, tN , tN +1) - middle_frame_num)/num_frames
     intrinsics['frame-stamp'] = frame_stamp
 
+    # Intrinsics of the frames of the pyramid level
+    if level != 1:
+        intrinsics['fx'], intrinsics['fy'], intrinsics['cx'], intrinsics['cy'] = scale_intrinsics(
+            intrinsics['fx'], intrinsics['fy'], intrinsics['cx'], intrinsics['cy'], level)
+
     # Export intrinsics
-    intrinsics_file = os.path.join(output_root_dir, config['DAVIDE']['intrinsics_folder'], "{}.csv".format(recording_name))
+    intrinsics_file = os.path.join(output_root_dir, level_folder(config['DAVIDE']['intrinsics_folder'], level), "{}.csv".format(recording_name))
     print('Exporting intrinsics to: ', intrinsics_file)
     os.makedirs(os.path.dirname(intrinsics_file), exist_ok=True)
     intrinsics.to_csv(intrinsics_file, sep=',', header=True, index=False)
@@ -287,90 +296,99 @@ def export_imu_data(start_id, end_id, input_video_dir, output_root_dir, recordin
     imu_data.to_csv(imu_file, sep=',', header=True, index=False)
 
 
-MAX_ITER = 50000
-
-
-def main(argv):
-    # Parse arguments and read config
-    args = parse_args(argv)
-    config = read_config(args.config)
-    idx = args.id
-
-    # Get root directory and video list
-    input_root = config['DAVIDE-tmp']['ROOT']
-    data_annotations_path = config['DATA-GEN-PARAMS']['annotations']
-    annotations = pd.read_csv(data_annotations_path)
-    video_list = annotations['recording'].values.tolist()
-    input_video_dir = os.path.join(input_root, video_list[idx])
+def recording_outputs(output_root_dir, recording_name, config, level=1, mono_depth=False) -> list:
+    """Folders and csv files of a recording in an exported split (the other recordings are not measured)."""
+    davide = config['DAVIDE']
+    folders = [level_folder(davide[key], level) for key in ['blur_folder', 'sharp_folder', 'depth_folder', 'confidence_folder']]
+    if mono_depth:
+        folders += ['{}_{}'.format(davide['mono_depth_folder'], rgb_dir) for rgb_dir in ['sharp', 'blur']]
+    csv_folders = [level_folder(davide['intrinsics_folder'], level), davide['poses_folder'], davide['imu_folder']]
+    return [os.path.join(output_root_dir, folder, recording_name) for folder in folders] + \
+           [os.path.join(output_root_dir, folder, '{}.csv'.format(recording_name)) for folder in csv_folders]
+
+
+def run_step(ctx:PipelineContext, video_name:str, mono_depth:bool=False, level:int=None):
+    """Step 8: select the annotated frames of a video and export them to the DAVIDE dataset."""
+    config = ctx.config
+    level = level or (config.get('RESOLUTION-PYRAMID') or {}).get('export_level') or 1
+    assert level == 1 or level in pyramid_levels(config), f"Level {level} is not in RESOLUTION-PYRAMID.levels"
+    # Monocular depth is computed on the full resolution frames only
+    assert level == 1 or not mono_depth, "Mono depth can only be exported at full resolution"
+    input_video_dir = ctx.video_dir(video_name)
     print('Input video dir: ', input_video_dir)
 
-    # Check previous steps are done
-    for step in range(1, 8):
-        if step == 6:
-            # Step 6 is not required for this script
-            continue
-        if step == 7 and not args.mono_depth:
-            # Step 7 is not required if mono depth is not required
-            continue
-        if not is_step_complete(dp_step='step_{}'.format(step), videos=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log']):
-            raise ValueError(f"Step {step} is not done yet for video {video_list[idx]}. Check dp log.")
+    # Check previous steps are done. Step 6 is not required for this script,
+    # step 7 only if mono depth is exported.
+    ctx.require_steps(video_name, step_dependencies('step_8', mono_depth))
 
     # Read annotations
-    annotations_file = config['DATA-GEN-PARAMS']['annotations']
-    for _ in range(MAX_ITER):
-        try:
-            annotations = pd.read_csv(annotations_file)
-            break
-        except Exception:
-            continue
-    annotations = annotations.replace({np.nan: None})
+    annotations = ctx.annotations.replace({np.nan: None})
 
     # Annotations for video id
-    video_annotations = annotations[annotations['recording'] == video_list[idx]]
+    video_annotations = annotations[annotations['recording'] == video_name]
 
     # Start and end ids
-    start_id, end_id = get_frame_ids(video_annotations['start'].values[0], video_annotations['end'].values[0], input_video_dir, config)
+    start_id, end_id = get_frame_ids(video_annotations['start'].values[0], video_annotations['end'].values[0], input_video_dir, config, level)
 
     if start_id == 0 and end_id == 0:
-        print(f'No frames to export for video {video_list[idx]} according to annotations.')
+        print(f'No frames to export for video {video_name} according to annotations.')
         # Update log
-        log_step_event(video_name=video_list[idx], dp_step='step_8', new_status=1, db_path=config['DATA-GEN-PARAMS']['dp_log'])
-        update_summary_for_video(video_name=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log'])
+        record_step_event(video_name=video_name, dp_step='step_8', new_status=1, db_path=ctx.db_path)
         return
 
     # Recording name
-    recording_name = convert_recording_name(video_list[idx], annotations)
+    recording_name = convert_recording_name(video_name, annotations)
 
     # Output video dir
     output_root_dir = os.path.join(config['DAVIDE']['ROOT'], video_annotations['split'].values[0])
     os.makedirs(output_root_dir, exist_ok=True)
 
-    # Export blur folder
-    export_blur_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
-    # Export sharp folder
-    export_sharp_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
-    # Export depth folder
-    export_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
-    # Export confidence folder
-    export_confidence_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
-    # Export intrinsics
-    export_intrinsics(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
-    # Export poses
-    export_poses(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
-    # Export imu data
-    export_imu_data(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
-    # Export mono depth folder if required
-    if args.mono_depth:
-        print('Exporting mono depth folders...')
-        rgb_dir = 'sharp'
-        export_mono_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, rgb_dir)
-        rgb_dir = 'blur'
-        export_mono_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, rgb_dir)
+    output_dirs = recording_outputs(output_root_dir, recording_name, config, level, mono_depth)
+    with StepMetrics(video_name, 'step_8', ctx.db_path, output_dirs=output_dirs) as metrics:
+        # Export blur folder
+        with tracing.span('export_blur', cat='io'):
+            export_blur_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level)
+        # Export sharp folder
+        with tracing.span('export_sharp', cat='io'):
+            export_sharp_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level)
+        # Export depth folder
+        with tracing.span('export_depth', cat='io'):
+            export_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level)
+        # Export confidence folder
+        with tracing.span('export_conf', cat='io'):
+            export_confidence_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level)
+        # Export intrinsics
+        with tracing.span('export_intrinsics', cat='io'):
+            export_intrinsics(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, level)
+        # Export poses
+        with tracing.span('export_poses', cat='io'):
+            export_poses(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
+        # Export imu data
+        with tracing.span('export_imu', cat='io'):
+            export_imu_data(start_id, end_id, input_video_dir, output_root_dir, recording_name, config)
+        # Export mono depth folder if required
+        if mono_depth:
+            print('Exporting mono depth folders...')
+            rgb_dir = 'sharp'
+            with tracing.span('export_mono_depth', cat='io', rgb_dir=rgb_dir):
+                export_mono_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, rgb_dir)
+            rgb_dir = 'blur'
+            with tracing.span('export_mono_depth', cat='io', rgb_dir=rgb_dir):
+                export_mono_depth_folder(start_id, end_id, input_video_dir, output_root_dir, recording_name, config, rgb_dir)
+        exported_frames = count_files(os.path.join(output_root_dir, level_folder(config['DAVIDE']['blur_folder'], level), recording_name))
+        metrics.frames_in = exported_frames
+        metrics.frames_out = exported_frames
 
     # Update log
-    log_step_event(video_name=video_list[idx], dp_step='step_8', new_status=1, db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    update_summary_for_video(video_name=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    print(f"Step 8 completed for video {video_list[idx]}.")
+    record_step_event(video_name=video_name, dp_step='step_8', new_status=1, db_path=ctx.db_path)
+    print(f"Step 8 completed for video {video_name}.")
+
+
+def main(argv):
+    # Parse arguments and create pipeline context
+    args = parse_args(argv)
+    ctx = PipelineContext(args.config)
+    run_step(ctx, ctx.video_name(args.id), mono_depth=args.mono_depth, level=args.level)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,341 @@
+import os
+import json
+import random
+import hashlib
+import threading
+import collections
+import concurrent.futures
+import cv2
+import numpy as np
+import pandas as pd
+
+from davide_dp.utils.codecs import list_images, read_image
+from davide_dp.utils.pyramid import level_folder
+
+
+# Frame modalities of an exported split and the key of their folder in the DAVIDE section of the config
+FRAME_MODALITIES = {
+    'blur': 'blur_folder',
+    'gt': 'sharp_folder',
+    'depth': 'depth_folder',
+    'conf': 'confidence_folder',
+    'mono_depth_sharp': 'mono_depth_folder',
+    'mono_depth_blur': 'mono_depth_folder',
+}
+# Camera data of an exported split (one csv per recording, one row per captured frame)
+TABLE_MODALITIES = {
+    'intrinsics': 'intrinsics_folder',
+    'poses': 'poses_folder',
+    'imu': 'imu_folder',
+}
+MODALITIES = list(FRAME_MODALITIES) + list(TABLE_MODALITIES)
+# Frame modalities served as RGB images
+MODALITIES_COLOR = ['blur', 'gt']
+# Folders of the DAVIDE section of the default config
+DEFAULT_FOLDERS = {
+    'blur_folder': 'blur',
+    'sharp_folder': 'gt',
+    'depth_folder': 'depth',
+    'mono_depth_folder': 'mono-depth',
+    'confidence_folder': 'conf-depth',
+    'intrinsics_folder': 'intrinsics',
+    'poses_folder': 'poses',
+    'imu_folder': 'imu',
+}
+INDEX_VERSION = 1
+
+
+class FrameCache:
+    """LRU cache of decoded frames, bounded in bytes. Safe to use from several threads."""
+
+    def __init__(self, max_bytes:int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame:np.ndarray):
+        if frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._frames:
+                return
+            self._frames[key] = frame
+            self.bytes += frame.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+
+def stack_frames(frames:list, modality:str) -> np.ndarray:
+    """Frames of a window as one array: RGB for color frames, meters for depth."""
+    if modality in MODALITIES_COLOR:
+        stack = np.empty((len(frames),) + frames[0].shape, dtype=np.uint8)
+        for t, frame in enumerate(frames):
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=stack[t])
+        return stack
+    stack = np.stack(frames)
+    return stack.astype(np.float32) / 1000 if modality == 'depth' else stack
+
+
+class DAVIDEDataset:
+    """
+    Reader of an exported DAVIDE split (step 8): temporal windows of aligned frames
+    and camera data of the recordings.
+
+    The split is indexed once. The index (frame names, codecs and frame size of
+    each recording) is cached in a json file in the split folder, and rebuilt
+    when a folder of the split changes. A sample is a window of `window`
+    consecutive blurry frames of a recording, every `stride` frames:
+
+        'blur', 'gt':               (T, H, W, 3) uint8 RGB
+        'depth':                    (T, H, W) float32 meters
+        'conf', 'mono_depth_*':     (T, H, W) uint8
+        'intrinsics':               (T, 4) float32 fx, fy, cx, cy of each frame
+        'poses':                    (T, 7) float32 tx, ty, tz, qw, qx, qy, qz of each frame
+        'imu':                      (M, 13) float32 rows captured during the exposure of the window
+        'frame_stamps', 'imu_stamps', 'recording', 'frames'
+
+    Frames are decoded by a pool of `workers` threads and kept in an LRU cache
+    of `cache_mb` MB per process. With `crop_size` (height, width) all the
+    frames of a window are cropped at the same (random or center) offset and the
+    intrinsics follow the crop; npy frames are memory-mapped so that only the
+    crop is read. Works as a map-style dataset of torch.utils.data.DataLoader.
+
+    Usage:
+        dataset = DAVIDEDataset('/data/DAVIDE', 'train', window=5, crop_size=(256, 256), random_crop=True)
+        sample = dataset[0]
+        dataset = DAVIDEDataset.from_config(config, 'test', modalities=['blur', 'gt'])
+    """
+
+    def __init__(self, root:str, split:str, window:int=1, stride:int=None, modalities:list=None, level:int=1,
+                 crop_size:tuple=None, random_crop:bool=False, cache_mb:int=1024, workers:int=4,
+                 folders:dict=None, index_file:str=None):
+        self.split_dir = os.path.join(root, split)
+        self.window = window
+        self.stride = stride or window
+        self.modalities = list(modalities or ['blur', 'gt', 'depth', 'conf', 'intrinsics', 'poses', 'imu'])
+        for modality in self.modalities:
+            assert modality in MODALITIES, f"Modality must be one of {MODALITIES}"
+        assert 'blur' in self.modalities, "The blurry frames define the windows: 'blur' must be a modality"
+        self.level = level
+        self.crop_size = tuple(crop_size) if crop_size is not None else None
+        self.random_crop = random_crop
+        self.cache_mb = cache_mb
+        self.workers = workers
+        self.folders = dict(DEFAULT_FOLDERS, **(folders or {}))
+        self.index_file = index_file or os.path.join(self.split_dir, '.index_x{}_{}.json'.format(
+            level, hashlib.md5(','.join(sorted(self.modalities)).encode()).hexdigest()[:8]))
+
+        self.index = self.load_index()
+        self.samples = []
+        for recording, entry in self.index['recordings'].items():
+            if self.crop_size is not None:
+                assert self.crop_size[0] <= entry['shape'][0] and self.crop_size[1] <= entry['shape'][1], \
+                    f"Crop size {self.crop_size} is larger than the frames of {recording} {entry['shape']}"
+            for start in range(0, len(entry['frames']) - window + 1, self.stride):
+                self.samples.append((recording, start))
+        self._tables = {}
+        self._reset_workers()
+
+    @classmethod
+    def from_config(cls, config:dict, split:str, **kwargs):
+        """Dataset of a split in the DAVIDE folder of the config."""
+        return cls(config['DAVIDE']['ROOT'], split, folders=dict(config['DAVIDE']), **kwargs)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx:int) -> dict:
+        recording, start = self.samples[idx]
+        entry = self.index['recordings'][recording]
+        frames = entry['frames'][start:start + self.window]
+        crop = self.crop_offset(entry['shape'])
+
+        # Decode the frames of all modalities of the window concurrently
+        jobs = [(modality, os.path.join(self.modality_dir(modality), recording, frame + entry['extensions'][modality]))
+                for modality in self.modalities if modality in FRAME_MODALITIES for frame in frames]
+        decoded = list(self._executor().map(lambda job: self.read_frame(*job, crop), jobs)) if self.workers \
+            else [self.read_frame(*job, crop) for job in jobs]
+
+        sample = {'recording': recording, 'frames': frames, 'frame_stamps': np.arange(start, start + self.window)}
+        for i, modality in enumerate(modality for modality in self.modalities if modality in FRAME_MODALITIES):
+            sample[modality] = stack_frames(decoded[i * self.window:(i + 1) * self.window], modality)
+        for modality in self.modalities:
+            if modality in TABLE_MODALITIES:
+                sample.update(self.read_table(recording, modality, start, crop))
+        return sample
+
+    # ------------------------------ Index ------------------------------
+
+    def modality_dir(self, modality:str) -> str:
+        folder = self.folders[FRAME_MODALITIES.get(modality) or TABLE_MODALITIES[modality]]
+        if modality.startswith('mono_depth_'):
+            folder = '{}_{}'.format(folder, modality[len('mono_depth_'):])
+        # Poses and IMU data do not depend on the resolution
+        if modality in FRAME_MODALITIES or modality == 'intrinsics':
+            folder = level_folder(folder, self.level)
+        return os.path.join(self.split_dir, folder)
+
+    def index_paths(self, recording:str) -> list:
+        """Folders and files of a recording. The index is rebuilt if one of them changes."""
+        paths = []
+        for modality in self.modalities:
+            if modality in FRAME_MODALITIES:
+                paths.append(os.path.join(self.modality_dir(modality), recording))
+            else:
+                paths.append(os.path.join(self.modality_dir(modality), '{}.csv'.format(recording)))
+        return paths
+
+    def build_index(self) -> dict:
+        """List the frames of each recording and check that the modalities are aligned."""
+        blur_dir = self.modality_dir('blur')
+        assert os.path.isdir(blur_dir), f"No blurry frames in {blur_dir}"
+        recordings = {}
+        for recording in sorted(os.listdir(blur_dir)):
+            entry = {'frames': None, 'extensions': {}, 'shape': None}
+            for modality in self.modalities:
+                if modality not in FRAME_MODALITIES:
+                    continue
+                folder = os.path.join(self.modality_dir(modality), recording)
+                names = list_images(folder)
+                assert names, f"No frames in {folder}"
+                stems = [os.path.splitext(name)[0] for name in names]
+                extensions = {os.path.splitext(name)[1] for name in names}
+                assert len(extensions) == 1, f"Frames of {folder} are written with several codecs: {sorted(extensions)}"
+                if entry['frames'] is None:
+                    entry['frames'] = stems
+                    entry['shape'] = list(read_image(os.path.join(folder, names[0])).shape[:2])
+                assert stems == entry['frames'], f"Frames of {folder} do not match the blurry frames of {recording}"
+                entry['extensions'][modality] = extensions.pop()
+            entry['mtimes'] = [os.stat(path).st_mtime_ns for path in self.index_paths(recording)]
+            recordings[recording] = entry
+        return {'version': INDEX_VERSION, 'modalities': sorted(self.modalities), 'level': self.level, 'recordings': recordings}
+
+    def index_valid(self, index:dict) -> bool:
+        if index.get('version') != INDEX_VERSION or index.get('modalities') != sorted(self.modalities) or index.get('level') != self.level:
+            return False
+        if sorted(index['recordings']) != sorted(os.listdir(self.modality_dir('blur'))):
+            return False
+        try:
+            return all([os.stat(path).st_mtime_ns for path in self.index_paths(recording)] == entry['mtimes']
+                       for recording, entry in index['recordings'].items())
+        except FileNotFoundError:
+            return False
+
+    def load_index(self) -> dict:
+        """Cached index of the split, rebuilt if the split changed."""
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                index = json.load(f)
+            if self.index_valid(index):
+                return index
+        index = self.build_index()
+        # Read-only splits are indexed at every start
+        try:
+            with open(self.index_file + '.part', 'w') as f:
+                json.dump(index, f)
+            os.replace(self.index_file + '.part', self.index_file)
+        except OSError:
+            pass
+        return index
+
+    # ------------------------------ Reading ------------------------------
+
+    def crop_offset(self, shape:list):
+        """(y, x, height, width) of the crop of a window, or None."""
+        if self.crop_size is None:
+            return None
+        height, width = self.crop_size
+        if self.random_crop:
+            return random.randint(0, shape[0] - height), random.randint(0, shape[1] - width), height, width
+        return (shape[0] - height) // 2, (shape[1] - width) // 2, height, width
+
+    def read_frame(self, modality:str, path:str, crop:tuple=None) -> np.ndarray:
+        """Decoded frame (BGR for blur and gt), cropped. Frames of image codecs go through the cache."""
+        if path.endswith('.npy'):
+            # Only the rows of the crop are read from the memory map (and the page cache)
+            frame = np.load(path, mmap_mode='r')
+            if crop is not None:
+                y, x, height, width = crop
+                frame = frame[y:y + height, x:x + width]
+            frame = np.array(frame)
+        else:
+            frame = self._cache.get(path)
+            if frame is None:
+                flags = cv2.IMREAD_COLOR if modality in MODALITIES_COLOR else cv2.IMREAD_UNCHANGED
+                frame = read_image(path, flags)
+                self._cache.put(path, frame)
+            if crop is not None:
+                y, x, height, width = crop
+                frame = frame[y:y + height, x:x + width]
+        return frame
+
+    def load_tables(self, recording:str) -> dict:
+        """Camera data of a recording: {modality: (frame stamps, values)}, read once per process."""
+        tables = self._tables.get(recording)
+        if tables is None:
+            tables = {}
+            for modality in self.modalities:
+                if modality in TABLE_MODALITIES:
+                    data = pd.read_csv(os.path.join(self.modality_dir(modality), '{}.csv'.format(recording)), sep=',')
+                    tables[modality] = (data['frame-stamp'].to_numpy(), data.drop(columns='frame-stamp').to_numpy(np.float32))
+            self._tables[recording] = tables
+        return tables
+
+    def read_table(self, recording:str, modality:str, start:int, crop:tuple=None) -> dict:
+        stamps, values = self.load_tables(recording)[modality]
+        end = start + self.window - 1
+        if modality == 'imu':
+            # The first stamp is the start of the exposure of the first frame (-middle_frame_num / num_frames)
+            before = -stamps[0]
+            rows = (stamps >= start - before - 1e-6) & (stamps <= end + 1 - before + 1e-6)
+            return {'imu': values[rows], 'imu_stamps': stamps[rows]}
+        # Intrinsics and poses of the middle (sharp) frames: integer stamps
+        rows = np.searchsorted(stamps, np.arange(start, end + 1) - 1e-6)
+        assert np.allclose(stamps[rows], np.arange(start, end + 1)), f"Missing {modality} rows of {recording}"
+        table = values[rows]
+        if modality == 'intrinsics' and crop is not None:
+            table = table.copy()
+            table[:, 2] -= crop[1]
+            table[:, 3] -= crop[0]
+        return {modality: table}
+
+    # ------------------------------ Workers ------------------------------
+
+    def _reset_workers(self):
+        self._cache = FrameCache(self.cache_mb * 2**20)
+        self._pool = None
+        self._pid = os.getpid()
+
+    def _executor(self):
+        # Threads do not survive a fork (e.g. DataLoader workers): each process starts its own pool and cache
+        if self._pid != os.getpid():
+            self._reset_workers()
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_cache=None, _pool=None, _pid=None, _tables={})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_workers()
+
+    def cache_info(self) -> dict:
+        return {'hits': self._cache.hits, 'misses': self._cache.misses, 'mb': self._cache.bytes / 2**20}
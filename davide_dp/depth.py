@@ -5,12 +5,14 @@ import os, glob, sys, torch, shutil, random, math, time, cv2
 import torch.backends.cudnn as cudnn
 import argparse
 from tqdm import tqdm
-import cupy as cp
 
-from davide_dp.XVFI import denorm255_np, RGBframes_np2Tensor
-from davide_dp.configs import read_config
-from davide_dp.utils.progress_db import is_step_complete, log_step_event, update_summary_for_video
+from davide_dp.pipeline import PipelineContext
+from davide_dp.utils.progress_db import record_step_event
+from davide_dp.utils.metrics import StepMetrics
+from davide_dp.utils import tracing
 from davide_dp.utils import  read_depth_bin, read_conf_bin, save_depth_16bits, save_conf_8bits
+from davide_dp.utils.codecs import codec_for
+from davide_dp.utils.pyramid import pyramid_levels, level_folder, subsample
 
 
 def parse_args(argv):
@@ -23,40 +25,32 @@ def parse_args(argv):
 
 
 
-def main(argv=None):
-    # Parse arguments and read config
-    args = parse_args(argv)
-    config = read_config(args.config)
-    idx = args.id
-
-    # Get root directory and video list
-    root_dir = config['DAVIDE-raw']['ROOT']
-    data_annotations_path = config['DATA-GEN-PARAMS']['annotations']
-    annotations = pd.read_csv(data_annotations_path)
-    video_list = annotations['recording'].values.tolist()
-    input_video_dir = os.path.join(root_dir, video_list[idx])
+def run_step(ctx:PipelineContext, video_name:str):
+    """Step 4: resize and export the depth and confidence maps of a video."""
+    config = ctx.config
+    input_video_dir = ctx.video_dir(video_name, root='DAVIDE-raw')
     print('Input video dir: ', input_video_dir)
 
     # Check if step 1 is done
-    if not is_step_complete(dp_step='step_1', videos=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log']):
-        raise ValueError(f"Step 1 is not done yet for video {video_list[idx]}. Check dp log.")
+    ctx.require_steps(video_name, ['step_1'])
 
     # Input and output paths
     input_depth_dir = os.path.join(input_video_dir, config['DAVIDE-raw']['depth_folder'])
     input_conf_dir = os.path.join(input_video_dir, config['DAVIDE-raw']['confidence_folder'])
-    output_depth_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['depth_folder'])
-    output_conf_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['confidence_folder'])
-    rgb_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['rgb_folder'])
-    os.makedirs(output_depth_dir, exist_ok=True)
-    os.makedirs(output_conf_dir, exist_ok=True)
-
-    # Read first frame in rgb_dir to get image size
-    first_frame = cv2.imread(os.path.join(rgb_dir, os.listdir(rgb_dir)[0]))
-    H, W, _ = first_frame.shape
+    output_depth_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['depth_folder'])
+    output_conf_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['confidence_folder'])
+    # Downscaled outputs of the resolution pyramid
+    levels = pyramid_levels(config)
+    output_dirs = [level_folder(folder, level) for level in [1] + levels for folder in [output_depth_dir, output_conf_dir]]
+    for output_dir in output_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Image size and frame names of the rgb frames (png frames of step 1 or the raw video)
+    rgb_source = ctx.rgb_source(video_name)
+    H, W, _ = rgb_source.shape
 
     # Get frames names
-    frames_name = os.listdir(rgb_dir)
-    frames_name.sort()
+    frames_name = [rgb_source.frame_name(i) for i in range(len(rgb_source))]
 
     # Get depth and confidence files
     depth_frames = os.listdir(input_depth_dir)
@@ -77,20 +71,37 @@ def main(argv=None):
     depth_frames = depth_frames[:N]
     conf_frames = conf_frames[:N]
     frames_name = frames_name[:N]
+
+    # Codecs of the exported frames
+    depth_codec = codec_for(config, 'depth')
+    conf_codec = codec_for(config, 'confidence')
     
-    for batchIdx, (depth_frame, conf_frame, file_name) in tqdm(enumerate(zip(depth_frames, conf_frames, frames_name))):
-        if (batchIdx % num_frames) == middle_frame_num:
-            # Read depth and confidence frames
-            depth = read_depth_bin(os.path.join(input_depth_dir, depth_frame), img_shape=(H, W))
-            conf = read_conf_bin(os.path.join(input_conf_dir, conf_frame), img_shape=(H, W))
-            # Save depth and confidence frames
-            save_depth_16bits(depth, os.path.join(output_depth_dir, file_name))
-            save_conf_8bits(conf, os.path.join(output_conf_dir, file_name))
+    with StepMetrics(video_name, 'step_4', ctx.db_path, output_dirs=output_dirs) as metrics:
+        for batchIdx, (depth_frame, conf_frame, file_name) in tqdm(enumerate(zip(depth_frames, conf_frames, frames_name))):
+            if (batchIdx % num_frames) == middle_frame_num:
+                # Read depth and confidence frames
+                depth = read_depth_bin(os.path.join(input_depth_dir, depth_frame), img_shape=(H, W))
+                conf = read_conf_bin(os.path.join(input_conf_dir, conf_frame), img_shape=(H, W))
+                # Save depth and confidence frames
+                with tracing.span('encode', frame=file_name):
+                    save_depth_16bits(depth, os.path.join(output_depth_dir, file_name), depth_codec)
+                    save_conf_8bits(conf, os.path.join(output_conf_dir, file_name), conf_codec)
+                    for level in levels:
+                        save_depth_16bits(subsample(depth, level), os.path.join(level_folder(output_depth_dir, level), file_name), depth_codec)
+                        save_conf_8bits(subsample(conf, level), os.path.join(level_folder(output_conf_dir, level), file_name), conf_codec)
+                metrics.frames_in += 2
+                metrics.frames_out += 2
 
     # Update dp log
-    log_step_event(video_name=video_list[idx], dp_step='step_4', new_status=1, db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    update_summary_for_video(video_name=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    print(f"Step 4 completed for video {video_list[idx]}.")
+    record_step_event(video_name=video_name, dp_step='step_4', new_status=1, db_path=ctx.db_path)
+    print(f"Step 4 completed for video {video_name}.")
+
+
+def main(argv=None):
+    # Parse arguments and create pipeline context
+    args = parse_args(argv)
+    ctx = PipelineContext(args.config)
+    run_step(ctx, ctx.video_name(args.id))
 
 
 if __name__ == '__main__':
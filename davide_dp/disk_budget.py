@@ -0,0 +1,310 @@
+import os
+import sys
+import shutil
+import tarfile
+import argparse
+
+from davide_dp.configs import read_config
+from davide_dp.utils.ids import parse_id_list
+from davide_dp.utils.metrics import directory_size
+from davide_dp.utils.pyramid import pyramid_levels, level_folder
+from davide_dp.utils.progress_db import DP_STEPS, get_step_status, get_queue_status, get_step_output_bytes, \
+    record_eviction, record_restore, get_evictions
+
+
+# Intermediates of each video in DAVIDE-tmp: {artifact: (step that writes it, steps that read it)}.
+# Artifacts are named after their folder in the DAVIDE-tmp section of the config. The readers are
+# the steps whose module or driver script reads the folder (e.g. the sample VFI video of
+# run_06_sample-videos.sh is encoded from rgb-VFI). Step 8 copies the annotated frames to DAVIDE,
+# so it does not need the intermediates afterwards.
+ARTIFACTS = {
+    'rgb_folder': ('step_1', ['step_2', 'step_4']),
+    'VFI_folder': ('step_2', ['step_3', 'step_6']),
+    'blur_folder': ('step_3', ['step_6', 'step_7', 'step_8']),
+    'sharp_folder': ('step_3', ['step_6', 'step_7', 'step_8']),
+    'depth_folder': ('step_4', ['step_6', 'step_8']),
+    'confidence_folder': ('step_4', ['step_8']),
+    'mono_depth_sharp': ('step_7', ['step_8']),
+    'mono_depth_blur': ('step_7', ['step_8']),
+}
+# Intermediates written at each level of the resolution pyramid (<artifact>_x<level>)
+PYRAMID_ARTIFACTS = ['blur_folder', 'sharp_folder', 'depth_folder', 'confidence_folder']
+
+
+def config_artifacts(config:dict) -> dict:
+    """
+    ARTIFACTS and the folders of the pyramid levels of the config (e.g. blur_folder_x2),
+    which have the same writer and readers as their full-resolution folder.
+    """
+    artifacts = dict(ARTIFACTS)
+    for level in pyramid_levels(config):
+        for artifact in PYRAMID_ARTIFACTS:
+            artifacts[level_folder(artifact, level)] = ARTIFACTS[artifact]
+    return artifacts
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Keeps the generated data of the pipeline within the disk budget')
+    parser.add_argument("command", type=str, choices=['status', 'evict', 'restore'],
+                        help='status: print disk usage and intermediates, evict: remove consumed intermediates, restore: restore evicted intermediates from their archive')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--clips", type=str, default=None, help='[evict, restore] Video ids. E.g. 0-92 or 0,2,5-7. Default: all videos')
+    parser.add_argument("--artifacts", type=str, nargs='+', default=None,
+                        help='[restore] Intermediates to restore: {} or a pyramid level of {} (e.g. blur_folder_x2). Default: all'.format(
+                            ', '.join(ARTIFACTS), ', '.join(PYRAMID_ARTIFACTS)))
+    parser.add_argument("--mono_depth", action='store_true', help='Step 8 exports mono depth (keeps the mono depth folders until step 8 is done)')
+    parser.add_argument("--dry_run", action='store_true', help='[evict] Print the intermediates that would be evicted')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+class DiskUsage:
+    """
+    Size of directory trees. Directories whose modification time did not change
+    since the last call are not listed again, so repeated calls on the workspace
+    only rescan the folders that are being written or removed. Files that grow in
+    place are counted with their size when their directory last changed.
+    """
+
+    def __init__(self):
+        # path: (mtime, bytes of the files in the directory, subdirectories)
+        self._dirs = {}
+
+    def size(self, path:str) -> int:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._dirs.pop(path, None)
+            return 0
+        cached = self._dirs.get(path)
+        if cached is None or cached[0] != mtime:
+            files, subdirs = 0, []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            files += entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        continue
+            cached = (mtime, files, subdirs)
+            self._dirs[path] = cached
+        return cached[1] + sum(self.size(subdir) for subdir in cached[2])
+
+
+class DiskBudget:
+    """
+    Bounded disk footprint of the generated data (DAVIDE-tmp and DAVIDE).
+
+    An intermediate of a video is evicted as soon as all the steps of the run
+    (DISK-BUDGET.steps) that read it are complete in the dp log. It is deleted, or
+    moved to a tar archive if DISK-BUDGET.archive_dir is set, and the eviction is
+    recorded in the dp log. Steps in DISK-BUDGET.throttle_steps (the steps that
+    write the large intermediates) are only claimable while their expected output
+    fits in the quota, so downstream steps can consume and free the intermediates.
+
+    Usage:
+        budget = DiskBudget(config)
+        budget.evict()
+        steps = budget.claimable(['step_1', 'step_2', 'step_3'])
+    """
+
+    def __init__(self, config:dict, mono_depth:bool=False):
+        self.config = config
+        settings = config['DISK-BUDGET']
+        self.db_path = config['DATA-GEN-PARAMS']['dp_log']
+        self.steps = ['step_{}'.format(i) for i in parse_id_list(str(settings['steps']))]
+        self.throttle_steps = ['step_{}'.format(i) for i in parse_id_list(str(settings['throttle_steps']))]
+        for dp_step in self.steps + self.throttle_steps:
+            assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+        self.quota = settings['quota_gb'] * 2**30
+        self.reserve = settings['reserve_gb'] * 2**30
+        self.archive_dir = settings.get('archive_dir')
+        self.compression = settings.get('archive_compression') or 'none'
+        assert self.compression in ['none', 'gz', 'xz'], "archive_compression must be one of none, gz, xz"
+        self.mono_depth = mono_depth
+        self.artifacts = config_artifacts(config)
+        self.usage = DiskUsage()
+
+    # ------------------------------ Intermediates ------------------------------
+
+    def artifact_dir(self, video_name:str, artifact:str) -> str:
+        tmp_config = self.config['DAVIDE-tmp']
+        base, _, level = artifact.rpartition('_x')
+        if artifact.startswith('mono_depth_'):
+            folder = '{}_{}'.format(tmp_config['mono_depth_folder'], artifact[len('mono_depth_'):])
+        elif base in PYRAMID_ARTIFACTS and level.isdigit():
+            folder = level_folder(tmp_config[base], int(level))
+        else:
+            folder = tmp_config[artifact]
+        return os.path.join(tmp_config['ROOT'], video_name, folder)
+
+    def readers(self, artifact:str) -> list:
+        """Steps of the run that read an intermediate."""
+        readers = [dp_step for dp_step in self.artifacts[artifact][1] if dp_step in self.steps]
+        if artifact.startswith('mono_depth_') and not self.mono_depth:
+            readers = [dp_step for dp_step in readers if dp_step != 'step_8']
+        return readers
+
+    def evictable(self, videos:list=None) -> list:
+        """(video_name, artifact) of the intermediates whose readers are all complete."""
+        status = get_step_status(self.db_path, videos=videos)
+        candidates = []
+        for video_name, steps in sorted(status.items()):
+            for artifact, (writer, _) in self.artifacts.items():
+                readers = self.readers(artifact)
+                # Intermediates that no step of the run reads are outputs: they are kept
+                if not readers or not steps[writer] or not all(steps[dp_step] for dp_step in readers):
+                    continue
+                if os.path.isdir(self.artifact_dir(video_name, artifact)):
+                    candidates.append((video_name, artifact))
+        return candidates
+
+    def evict(self, videos:list=None, dry_run:bool=False) -> int:
+        """Evict all consumed intermediates. Returns the number of bytes freed."""
+        freed = 0
+        for video_name, artifact in self.evictable(videos):
+            if dry_run:
+                size = directory_size(self.artifact_dir(video_name, artifact))
+                print('Would evict {} of {} ({:.2f} GB)'.format(artifact, video_name, size / 2**30))
+            else:
+                size = self.evict_artifact(video_name, artifact)
+            freed += size
+        return freed
+
+    def evict_artifact(self, video_name:str, artifact:str) -> int:
+        """Remove (or archive) an intermediate of a video. Returns the number of bytes freed."""
+        path = self.artifact_dir(video_name, artifact)
+        # The rename is atomic: if several workers evict at the same time, one of them wins
+        evicting = '{}.evicting-{}'.format(path, os.getpid())
+        try:
+            os.rename(path, evicting)
+        except FileNotFoundError:
+            return 0
+        size = directory_size(evicting)
+        archive = None
+        try:
+            if self.archive_dir:
+                archive = os.path.join(self.archive_dir, video_name, '{}.tar{}'.format(
+                    artifact, '' if self.compression == 'none' else '.' + self.compression))
+                os.makedirs(os.path.dirname(archive), exist_ok=True)
+                mode = 'w' if self.compression == 'none' else 'w:' + self.compression
+                with tarfile.open(archive + '.part', mode) as tar:
+                    tar.add(evicting, arcname=os.path.basename(path))
+                os.replace(archive + '.part', archive)
+        except BaseException:
+            os.rename(evicting, path)
+            raise
+        shutil.rmtree(evicting)
+        record_eviction(video_name, artifact, size, archive, self.db_path)
+        print('Evicted {} of {} ({:.2f} GB){}'.format(artifact, video_name, size / 2**30, ' to ' + archive if archive else ''))
+        return size
+
+    def restore(self, video_name:str, artifact:str) -> bool:
+        """Restore an evicted intermediate from its archive. Returns False if it was deleted without archive."""
+        eviction = get_evictions(self.db_path, videos=[video_name]).get(video_name, {}).get(artifact)
+        if eviction is None:
+            return True
+        path = self.artifact_dir(video_name, artifact)
+        if not os.path.isdir(path):
+            archive = eviction['archive']
+            if not archive or not os.path.isfile(archive):
+                print('Cannot restore {} of {}: it was evicted without archive.'.format(artifact, video_name))
+                return False
+            restoring = '{}.restoring-{}'.format(path, os.getpid())
+            with tarfile.open(archive) as tar:
+                # Archives written by evict_artifact hold a single folder
+                tar.extractall(restoring, **({'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}))
+            os.rename(os.path.join(restoring, os.path.basename(path)), path)
+            os.rmdir(restoring)
+            print('Restored {} of {} from {}'.format(artifact, video_name, archive))
+        # Folders written again (e.g. by a re-run of their step) only need the record updated
+        record_restore(video_name, artifact, self.db_path)
+        return True
+
+    def restore_inputs(self, video_name:str, dp_step:str) -> bool:
+        """Restore the evicted intermediates that a step reads before running it."""
+        evicted = get_evictions(self.db_path, videos=[video_name]).get(video_name, {})
+        restored = True
+        for artifact in evicted:
+            # Levels removed from the config since the eviction are not read anymore
+            if artifact in self.artifacts and dp_step in self.artifacts[artifact][1]:
+                restored &= self.restore(video_name, artifact)
+        return restored
+
+    # ------------------------------ Quota ------------------------------
+
+    def used_bytes(self) -> int:
+        """Disk usage of the generated data."""
+        return sum(self.usage.size(self.config[root]['ROOT']) for root in ['DAVIDE-tmp', 'DAVIDE'])
+
+    def expected_bytes(self) -> dict:
+        """Expected output of each throttled step: the median of its recorded runs, or reserve_gb."""
+        recorded = get_step_output_bytes(self.db_path, steps=self.throttle_steps)
+        return {dp_step: recorded.get(dp_step, self.reserve) for dp_step in self.throttle_steps}
+
+    def claimable(self, steps:list) -> list:
+        """Steps whose tasks can be claimed without exceeding the quota."""
+        if not any(dp_step in self.throttle_steps for dp_step in steps):
+            return list(steps)
+        expected = self.expected_bytes()
+        status = get_queue_status(self.db_path, mono_depth=self.mono_depth)
+        # Running tasks of throttled steps may still write their whole output
+        committed = self.used_bytes() + sum(counts['running'] * expected[dp_step]
+                                            for dp_step, counts in status.items() if dp_step in expected)
+        return [dp_step for dp_step in steps if dp_step not in expected or committed + expected[dp_step] <= self.quota]
+
+
+def print_status(budget:DiskBudget):
+    used = budget.used_bytes()
+    print('Generated data: {:.1f} GB of {:.1f} GB quota ({:.0%})'.format(used / 2**30, budget.quota / 2**30, used / budget.quota))
+    for dp_step, size in budget.expected_bytes().items():
+        print('  expected output of {}: {:.1f} GB{}'.format(dp_step, size / 2**30, ' -> throttled' if dp_step not in budget.claimable([dp_step]) else ''))
+
+    evictable = budget.evictable()
+    evictions = get_evictions(budget.db_path)
+    videos = sorted(get_step_status(budget.db_path))
+    print('{:<20} {:>8} {:>10} {:>10} {:>10} {:>12}'.format('artifact', 'present', 'size (GB)', 'evictable', 'evicted', 'freed (GB)'))
+    for artifact in budget.artifacts:
+        present = [video_name for video_name in videos if os.path.isdir(budget.artifact_dir(video_name, artifact))]
+        size = sum(budget.usage.size(budget.artifact_dir(video_name, artifact)) for video_name in present)
+        evicted = [evictions[video_name][artifact] for video_name in evictions if artifact in evictions[video_name]]
+        print('{:<20} {:>8} {:>10.1f} {:>10} {:>10} {:>12.1f}'.format(
+            artifact, len(present), size / 2**30, sum(a == artifact for _, a in evictable),
+            len(evicted), sum(eviction['bytes'] or 0 for eviction in evicted) / 2**30))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = read_config(args.config)
+    budget = DiskBudget(config, args.mono_depth)
+    videos = None
+    if args.clips is not None:
+        import pandas as pd
+
+        video_list = pd.read_csv(config['DATA-GEN-PARAMS']['annotations'])['recording'].values.tolist()
+        videos = [video_list[clip_id] for clip_id in parse_id_list(args.clips)]
+
+    if args.command == 'evict':
+        freed = budget.evict(videos, dry_run=args.dry_run)
+        print('{} {:.2f} GB.'.format('Would free' if args.dry_run else 'Freed', freed / 2**30))
+    elif args.command == 'restore':
+        artifacts = list(budget.artifacts) if args.artifacts is None else args.artifacts
+        for artifact in artifacts:
+            assert artifact in budget.artifacts, f"Artifact must be one of {list(budget.artifacts)}"
+        evictions = get_evictions(budget.db_path, videos=videos)
+        failed = 0
+        for video_name in sorted(evictions):
+            for artifact in evictions[video_name]:
+                if artifact in artifacts:
+                    failed += not budget.restore(video_name, artifact)
+        return 1 if failed else 0
+    else:
+        print_status(budget)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
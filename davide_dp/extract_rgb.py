@@ -0,0 +1,129 @@
+import os
+import sys
+import glob
+import shutil
+import argparse
+import collections
+import concurrent.futures
+import cv2
+from tqdm import tqdm
+
+from davide_dp.pipeline import PipelineContext
+from davide_dp.utils.progress_db import record_step_event
+from davide_dp.utils.metrics import StepMetrics
+from davide_dp.utils.video_source import VideoFrameSource
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Extracts the rgb frames of video id')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--id", type=int, required=True, help='Video id')
+    parser.add_argument("--no_png", action='store_true', help='Do not write png frames (overrides RGB-EXTRACTION.write_png)')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def write_frames(source, output_dir:str, workers:int=4, compression:int=1) -> int:
+    """Write the frames of a source (pix_fmt 'bgr24') as png files. Returns the number of frames written.
+
+    A video is split into keyframe-aligned segments that are decoded and written
+    concurrently, one ffmpeg process per worker. Frame names use the global frame
+    index, so the output is identical to a sequential run. Other sources are read
+    sequentially and encoded on a thread pool.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+
+    def write(path, frame):
+        if not cv2.imwrite(path, frame, params):
+            raise IOError(f"Could not write {path}")
+
+    pbar = tqdm(total=len(source))
+    if isinstance(source, VideoFrameSource) and workers > 1:
+        segments = source.segments(workers)
+        print('Decoding {} segments: {}'.format(len(segments), ', '.join('{}-{}'.format(start, stop - 1) for start, stop in segments)))
+
+        def write_segment(segment):
+            written = 0
+            for index, frame in source.frames(*segment):
+                write(os.path.join(output_dir, source.frame_name(index)), frame)
+                written += 1
+                pbar.update(1)
+            if written != segment[1] - segment[0]:
+                raise RuntimeError('Segment {}-{} of {}: {} frames decoded'.format(segment[0], segment[1] - 1, source.path, written))
+            return written
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            written = sum(executor.map(write_segment, segments))
+        pbar.close()
+        return written
+
+    written = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Bounded number of frames in flight, so that decoding does not run ahead of encoding
+        pending = collections.deque()
+        for index, frame in source.frames():
+            pending.append(executor.submit(write, os.path.join(output_dir, source.frame_name(index)), frame))
+            if len(pending) >= 2 * workers:
+                pending.popleft().result()
+                written += 1
+                pbar.update(1)
+        for future in pending:
+            future.result()
+            written += 1
+            pbar.update(1)
+    pbar.close()
+    return written
+
+
+def write_frame_folder(source, output_dir:str, workers:int=4, compression:int=1) -> int:
+    """
+    write_frames to a temporary folder that replaces `output_dir` once all the
+    frames are written. An interrupted write never leaves png frames in
+    `output_dir`, which open_frame_source would take for a complete set.
+    """
+    # Leftovers of interrupted writes
+    for partial_dir in glob.glob(glob.escape(output_dir) + '.partial-*'):
+        shutil.rmtree(partial_dir, ignore_errors=True)
+    partial_dir = '{}.partial-{}'.format(output_dir, os.getpid())
+    written = write_frames(source, partial_dir, workers, compression)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(partial_dir, output_dir)
+    return written
+
+
+def run_step(ctx:PipelineContext, video_name:str, write_png:bool=None):
+    """Step 1: extract the rgb frames of a video."""
+    config = ctx.config
+    extraction = config['RGB-EXTRACTION']
+    write_png = extraction['write_png'] if write_png is None else write_png
+
+    # Input and output paths
+    video_file = os.path.join(ctx.video_dir(video_name, root='DAVIDE-raw'), config['DAVIDE-raw']['video'])
+    output_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['rgb_folder'])
+    os.makedirs(output_dir, exist_ok=True)
+
+    with StepMetrics(video_name, 'step_1', ctx.db_path, output_dirs=output_dir) as metrics:
+        source = VideoFrameSource(video_file, pix_fmt='bgr24')
+        print('{}: {} frames, {}x{} at {:.2f} fps'.format(video_file, len(source), source.width, source.height, source.fps))
+        metrics.frames_in = len(source)
+        if write_png:
+            metrics.frames_out = write_frame_folder(source, output_dir, extraction['workers'], extraction['png_compression'])
+        else:
+            print('Png frames not written: the following steps decode {}.'.format(video_file))
+
+    # Update dp log
+    record_step_event(video_name=video_name, dp_step='step_1', new_status=1, db_path=ctx.db_path)
+    print(f"Step 1 completed for video {video_name}.")
+
+
+def main(argv=None):
+    # Parse arguments and create pipeline context
+    args = parse_args(argv)
+    ctx = PipelineContext(args.config)
+    run_step(ctx, ctx.video_name(args.id), write_png=False if args.no_png else None)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
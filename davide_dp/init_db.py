@@ -4,7 +4,7 @@ import argparse
 import pandas as pd
 
 from davide_dp.utils import create_tables, initialize_summary_from_raw_list
-from configs.utils import read_config
+from davide_dp.configs import read_config
 
 
 def arg_parser():
@@ -0,0 +1,239 @@
+import os
+import sys
+import heapq
+import shlex
+import shutil
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from davide_dp.configs import read_config
+from davide_dp.utils.ids import parse_id_list
+from davide_dp.utils.progress_db import get_step_status
+from davide_dp.scheduler import step_command
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Packs videos into jobs of balanced estimated cost and emits the submission files')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--step", type=int, required=True, help='Step to plan')
+    parser.add_argument("--jobs", type=int, required=True, help='Number of jobs')
+    parser.add_argument("--clips", type=str, default=None, help='Video ids. E.g. 0-92 or 0,2,5-7. Default: all videos')
+    parser.add_argument("--include_complete", action='store_true', help='Also plan videos whose step is already complete in the dp log')
+    parser.add_argument("--calibrate", action='store_true', help='Estimate per-frame cost from the metrics recorded in the dp log')
+    parser.add_argument("--mono_depth", action='store_true', help='Export mono depth in step 8')
+    parser.add_argument("--out_dir", type=str, default='logs/plans', help='Directory for job files')
+    parser.add_argument("--backend", type=str, default='slurm', choices=['slurm', 'local'], help='Emit SLURM job files or run the jobs locally')
+    parser.add_argument("--local_workers", type=int, default=1, help='Concurrent jobs with the local backend')
+    parser.add_argument("--dry_run", action='store_true', help='Print the plan without writing or running jobs')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+# ------------------------------ Frame counts ------------------------------
+
+def probe_frame_count(video_file:str) -> int:
+    """Number of video frames of a capture with ffprobe (packet count, no decoding)."""
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+         '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', video_file],
+        capture_output=True, text=True, check=True).stdout
+    return int(output.strip().split(',')[0])
+
+
+def count_raw_frames(config:dict, video_name:str) -> int:
+    """Number of raw frames of a capture: depth folder listing or ffprobe on vid.mov."""
+    video_dir = os.path.join(config['DAVIDE-raw']['ROOT'], video_name)
+    depth_dir = os.path.join(video_dir, config['DAVIDE-raw']['depth_folder'])
+    if os.path.isdir(depth_dir):
+        return len(os.listdir(depth_dir))
+    video_file = os.path.join(video_dir, 'vid.mov')
+    if os.path.exists(video_file) and shutil.which('ffprobe') is not None:
+        return probe_frame_count(video_file)
+    raise FileNotFoundError(f"Cannot count frames of {video_name}: no depth folder or vid.mov in {video_dir}.")
+
+
+def load_frame_index(config:dict, video_list:list) -> pd.Series:
+    """Raw frame count of each video. Counts are cached in the frame index file."""
+    index_file = config['PLANNER']['frame_index']
+    index = pd.Series(dtype=np.int64)
+    if os.path.exists(index_file):
+        index = pd.read_csv(index_file).set_index('recording')['frames']
+
+    missing = [video for video in video_list if video not in index.index]
+    if missing:
+        print('Counting frames of {} videos ...'.format(len(missing)))
+        counts = pd.Series({video: count_raw_frames(config, video) for video in missing}, dtype=np.int64)
+        index = pd.concat([index, counts])
+        os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+        index.rename_axis('recording').rename('frames').to_csv(index_file)
+        print('Frame index saved to {}'.format(index_file))
+    return index.loc[video_list]
+
+
+# ------------------------------ Cost model ------------------------------
+
+def calibrate_cost(config:dict, dp_step:str, frames:pd.Series) -> dict:
+    """Per-frame cost and overhead of a step fitted to the recorded wall times."""
+    from davide_dp.report import load_metrics
+
+    metrics = load_metrics(config['DATA-GEN-PARAMS']['dp_log'])
+    metrics = metrics[(metrics['step'] == dp_step) & metrics['wall_time'].notna()]
+    metrics = metrics[metrics['video_name'].isin(frames.index)]
+    if len(metrics) < 2:
+        print('Not enough metrics to calibrate {}. Using configured cost.'.format(dp_step))
+        return config['PLANNER']['cost'][dp_step]
+
+    x = frames.loc[metrics['video_name']].values.astype(np.float64)
+    y = metrics['wall_time'].values
+    s_per_frame, overhead_s = np.polyfit(x, y, 1)
+    cost = {'s_per_frame': max(float(s_per_frame), 0.0), 'overhead_s': max(float(overhead_s), 0.0)}
+    print('Calibrated {} from {} runs: {:.3f} s/frame + {:.0f} s'.format(dp_step, len(metrics), cost['s_per_frame'], cost['overhead_s']))
+    return cost
+
+
+def estimate_cost(frames:pd.Series, cost:dict) -> pd.Series:
+    """Estimated wall time in seconds of each video."""
+    return cost['overhead_s'] + frames.astype(np.float64) * cost['s_per_frame']
+
+
+def pack_jobs(costs:pd.Series, num_jobs:int) -> list:
+    """Longest-processing-time-first packing of videos into jobs.
+    Returns a list of (estimated seconds, [video ids]) sorted by job index."""
+    heap = [(0.0, job, []) for job in range(num_jobs)]
+    for video, cost in costs.sort_values(ascending=False).items():
+        load, job, videos = heapq.heappop(heap)
+        videos.append(video)
+        heapq.heappush(heap, (load + cost, job, videos))
+    jobs = sorted(heap, key=lambda item: item[1])
+    return [(load, videos) for load, _, videos in jobs if videos]
+
+
+def format_time(seconds:float) -> str:
+    minutes = int(np.ceil(seconds / 60))
+    return '{:02d}:{:02d}:00'.format(minutes // 60, minutes % 60)
+
+
+# ------------------------------ Job files ------------------------------
+
+def job_script(dp_step:str, job_id:int, clip_ids:list, time_limit:float, config:dict, config_file:str,
+               log_dir:str, mono_depth:bool, backend:str) -> str:
+    """Bash job script that runs a step for a list of videos sequentially."""
+    # SLURM jobs activate their environment in the preamble, local jobs with conda run
+    conda_env = None if backend == 'slurm' else (config['SCHEDULER'].get('conda_envs') or {}).get(dp_step)
+    command = step_command(dp_step, '$CLIP_ID', os.path.abspath(config_file), mono_depth, conda_env)
+    command = ' '.join('"$CLIP_ID"' if part == '$CLIP_ID' else shlex.quote(part) for part in command)
+    log_file = os.path.join(os.path.abspath(log_dir), 'job_{:02d}.txt'.format(job_id))
+
+    lines = ['#!/bin/bash']
+    if backend == 'slurm':
+        resources = config['SCHEDULER']['resources'][dp_step]
+        slurm = config['PLANNER']['slurm'][dp_step]
+        lines += [
+            '#SBATCH --job-name=DAVIDE-{}-{:02d}'.format(dp_step, job_id),
+            '#SBATCH --output={}'.format(log_file),
+            '#SBATCH --error={}'.format(log_file),
+            '#SBATCH --partition={}'.format(slurm['partition']),
+            '#SBATCH --time={}'.format(format_time(time_limit)),
+            '#SBATCH --ntasks=1',
+            '#SBATCH --cpus-per-task={}'.format(resources['cpus']),
+            '#SBATCH --mem={}G'.format(int(np.ceil(resources['mem_gb']))),
+        ]
+        if resources['gpus']:
+            lines.append('#SBATCH --gres={}:{}'.format(slurm.get('gres', 'gpu'), resources['gpus']))
+        lines += ['', slurm.get('preamble', '').strip()]
+    lines += [
+        '',
+        'cd {}'.format(shlex.quote(REPO_ROOT)),
+        'STATUS=0',
+        'for CLIP_ID in {}; do'.format(' '.join(str(clip_id) for clip_id in clip_ids)),
+        '  {} || STATUS=1'.format(command),
+        'done',
+        'exit $STATUS',
+        '',
+    ]
+    return '\n'.join(lines)
+
+
+def run_local(job_files:list, log_dir:str, workers:int) -> bool:
+    """Local execution backend: runs the job files with bash on a pool of workers."""
+    def run(job_file):
+        log_file = os.path.join(log_dir, os.path.splitext(os.path.basename(job_file))[0] + '.txt')
+        with open(log_file, 'w') as log:
+            returncode = subprocess.run(['bash', job_file], stdout=log, stderr=subprocess.STDOUT).returncode
+        print('{} finished with exit code {}'.format(job_file, returncode))
+        return returncode
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        returncodes = list(executor.map(run, job_files))
+    return all(returncode == 0 for returncode in returncodes)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = read_config(args.config)
+    dp_step = 'step_{}'.format(args.step)
+
+    annotations = pd.read_csv(config['DATA-GEN-PARAMS']['annotations'])
+    video_list = annotations['recording'].values.tolist()
+    clip_ids = parse_id_list(args.clips) if args.clips is not None else list(range(len(video_list)))
+
+    # Skip complete videos
+    if not args.include_complete:
+        status = get_step_status(config['DATA-GEN-PARAMS']['dp_log'], videos=[video_list[i] for i in clip_ids], steps=[dp_step])
+        clip_ids = [i for i in clip_ids if not status.get(video_list[i], {}).get(dp_step, False)]
+    if not clip_ids:
+        print('All videos have {} complete.'.format(dp_step))
+        return 0
+
+    # Cost model
+    frames = load_frame_index(config, [video_list[i] for i in clip_ids])
+    frames.index = clip_ids
+    if args.calibrate:
+        all_frames = load_frame_index(config, video_list)
+        cost = calibrate_cost(config, dp_step, all_frames)
+    else:
+        cost = config['PLANNER']['cost'][dp_step]
+    costs = estimate_cost(frames, cost)
+
+    # Packing
+    jobs = pack_jobs(costs, min(args.jobs, len(clip_ids)))
+    margin = config['PLANNER']['time_margin']
+    min_time = 60 * config['PLANNER']['min_time_min']
+    print('{} videos in {} jobs. Total estimated time: {:.1f} h, makespan: {:.1f} h'.format(
+        len(clip_ids), len(jobs), costs.sum() / 3600, max(load for load, _ in jobs) / 3600))
+    for job_id, (load, job_clips) in enumerate(jobs):
+        print('  job {:02d}: {:>6.2f} h, videos {}'.format(job_id, load / 3600, ','.join(str(i) for i in job_clips)))
+    if args.dry_run:
+        return 0
+
+    # Job files
+    out_dir = os.path.join(args.out_dir, dp_step)
+    os.makedirs(out_dir, exist_ok=True)
+    job_files = []
+    for job_id, (load, job_clips) in enumerate(jobs):
+        script = job_script(dp_step, job_id, job_clips, max(margin * load, min_time), config, args.config,
+                            out_dir, args.mono_depth, args.backend)
+        job_file = os.path.join(out_dir, 'job_{:02d}.sh'.format(job_id))
+        with open(job_file, 'w') as f:
+            f.write(script)
+        job_files.append(job_file)
+
+    if args.backend == 'local':
+        return 0 if run_local(job_files, out_dir, args.local_workers) else 1
+
+    submit_file = os.path.join(out_dir, 'submit.sh')
+    with open(submit_file, 'w') as f:
+        f.write('#!/bin/bash\n' + ''.join('sbatch {}\n'.format(shlex.quote(os.path.abspath(job_file))) for job_file in job_files))
+    print('Job files written to {}. Submit them with: bash {}'.format(out_dir, submit_file))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,113 +4,199 @@ import numpy as np
 import os, sys
 import torch
 import argparse
+import cv2
 from tqdm import tqdm
 from PIL import Image
 from transformers import AutoImageProcessor, AutoModelForDepthEstimation
 
-from davide_dp.configs import read_config
+from davide_dp.pipeline import PipelineContext
+from davide_dp.utils import tracing
+from davide_dp.utils.codecs import codec_for, list_images, read_image
 from davide_dp.utils import (
     is_step_complete,
-    log_step_event,
-    update_summary_for_video
+    record_step_event,
+    parse_id_list,
+    StepMetrics,
 )
+from davide_dp.utils.cpu_inference import CPU_OPTIMIZATIONS, CPUDepthModel, set_num_threads, verify_accuracy
+
+
+RGB_DIRS = ['sharp', 'blur']
 
 
 def parse_args(argv):
-    parser = argparse.ArgumentParser(description='Generates blurry and sharp rgb frames for video id')
+    parser = argparse.ArgumentParser(description='Computes monocular depth from blurry and sharp rgb frames for video ids')
     parser.add_argument("--config", type=str, default='./configs/config.yaml', help='Path to config file')
-    parser.add_argument("--rgb_dir", type=str, required=True, choices=['blur', 'sharp'], help='Input rgb frames directory. Options: blur, sharp')
-    parser.add_argument("--id", type=int, required=True, help='Video id')
+    parser.add_argument("--rgb_dir", type=str, nargs='+', required=True, choices=RGB_DIRS, help='Input rgb frames directories. Options: blur, sharp')
+    parser.add_argument("--id", type=str, required=True, help='Video id(s). E.g. 3, 0-92 or 0,2,5-7')
+    parser.add_argument("--skip_complete", action='store_true', help='Skip videos with step 7 already completed')
+    parser.add_argument("--optimization", type=str, default=None, choices=CPU_OPTIMIZATIONS, help='CPU optimization of the depth model. Default: MONO-DEPTH.optimization in config')
+    parser.add_argument("--num_threads", type=int, default=None, help='Intra-op CPU threads. Default: MONO-DEPTH.num_threads in config')
+    parser.add_argument("--verify_frames", type=int, default=None, help='Number of frames to check the optimized model against the reference model. Default: MONO-DEPTH.verify_frames in config')
 
     args = parser.parse_args(argv)
     return args
 
 
-def main(argv=None):
-    # Parse arguments and read config
-    args = parse_args(argv)
-    config = read_config(args.config)
-    idx = args.id
-    rgb_dir = args.rgb_dir
-    checkpoint = config['MONO-DEPTH']['checkpoint']
-
-    # Get root directory and video list
-    root_dir = config['DAVIDE-tmp']['ROOT']
-    data_annotations_path = config['DATA-GEN-PARAMS']['annotations']
-    annotations = pd.read_csv(data_annotations_path)
-    video_list = annotations['recording'].values.tolist()
-    input_video_dir = os.path.join(root_dir, video_list[idx])
-    print('Input video dir: ', input_video_dir)
-
-    # Check if step 3 is done
-    if not is_step_complete(dp_step='step_3', videos=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log']):
-        raise ValueError(f"Step 3 is not done yet for video {video_list[idx]}. Check dp log.")
-
+def load_model(checkpoint:str):
+    """Load image processor and depth estimation model from checkpoint."""
+    image_processor = AutoImageProcessor.from_pretrained(checkpoint)
+    model = AutoModelForDepthEstimation.from_pretrained(checkpoint)
+    model.eval()
+    return image_processor, model
+
+
+def predict_depth(image:Image.Image, image_processor, model) -> np.ndarray:
+    """Predict 8-bit normalized depth for a single PIL image."""
+    # Preprocess image
+    pixel_values = image_processor(image, return_tensors="pt").pixel_values
+
+    # Predict depth
+    with torch.no_grad():
+        outputs = model(pixel_values)
+        predicted_depth = outputs if isinstance(outputs, torch.Tensor) else outputs.predicted_depth
+
+    # Interpolate to original size
+    prediction = torch.nn.functional.interpolate(
+        predicted_depth.unsqueeze(1),
+        size=image.size[::-1],
+        mode="bicubic",
+        align_corners=False,
+    ).squeeze()
+    output = prediction.numpy()
+
+    formatted = (output * 255 / np.max(output)).astype("uint8")
+    return formatted
+
+
+def read_rgb(path:str) -> Image.Image:
+    """RGB frame of any image codec as a PIL image."""
+    return Image.fromarray(np.ascontiguousarray(read_image(path, cv2.IMREAD_COLOR)[..., ::-1]))
+
+
+def optimize_model(model, image_processor, mono_config:dict, sample_dir:str, optimization:str, verify_frames:int):
+    """Optimize depth model for CPU inference and check its accuracy on a sample of frames."""
+    optimized = CPUDepthModel(model, optimization=optimization, cache_dir=mono_config['cache_dir'],
+                              tag=mono_config['checkpoint'])
+    if not verify_frames:
+        return optimized
+
+    # Uniform sample of frames
+    frames_name = list_images(sample_dir)
+    sample_ids = np.unique(np.linspace(0, len(frames_name) - 1, verify_frames).astype(int))
+    images = [read_rgb(os.path.join(sample_dir, frames_name[i])) for i in sample_ids]
+
+    print('Checking {} model against reference model on {} frames ...'.format(optimization, len(images)))
+    report = verify_accuracy(model, optimized, image_processor, images, mono_config['max_deviation'])
+    print('Depth deviation: mean {:.4f}, max {:.4f} (max accepted: {:.4f})'.format(
+        report['mean_deviation'], report['max_deviation'], mono_config['max_deviation']))
+    print('Time per frame: reference {:.3f} s, optimized {:.3f} s'.format(
+        report['reference_s_per_frame'], report['optimized_s_per_frame']))
+    if not report['accepted']:
+        raise ValueError(f"Optimized model ({optimization}) exceeds the maximum depth deviation. Use a different optimization or increase MONO-DEPTH.max_deviation.")
+    return optimized
+
+
+def process_video(config:dict, video_name:str, rgb_dir:str, image_processor, model, metrics:StepMetrics=None):
+    """Compute monocular depth for all frames of one rgb folder of a video."""
     # Input and output paths
+    input_video_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_name)
     input_dir = os.path.join(input_video_dir, config['DAVIDE-tmp']['{}_folder'.format(rgb_dir)])
-    output_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], '{}_{}'.format(config['DAVIDE-tmp']['mono_depth_folder'], rgb_dir))
+    output_dir = os.path.join(input_video_dir, '{}_{}'.format(config['DAVIDE-tmp']['mono_depth_folder'], rgb_dir))
     os.makedirs(output_dir, exist_ok=True)
-
+    print('Input dir: ', input_dir)
+    if metrics is not None:
+        metrics.output_dirs.append(output_dir)
 
     # Get frames names
-    frames_name = os.listdir(input_dir)
-    frames_name.sort()
-    
-
-    ############# Check missing frames ##############
-    # ready_frames = os.listdir(output_dir)
-    # # Convert lists to sets
-    # frames_name_set = set(frames_name)
-    # ready_frames_set = set(ready_frames)
-
-    # # Get the frames that are not ready
-    # not_ready_frames = frames_name_set - ready_frames_set
-    # not_ready_frames = list(not_ready_frames)
+    frames_name = list_images(input_dir)
+    codec = codec_for(config, 'mono_depth')
 
-    # if not not_ready_frames:
-    #     return exit(0)
-    #################################################
-
-    # Get image processor and model
-    image_processor = AutoImageProcessor.from_pretrained(checkpoint)
-    model = AutoModelForDepthEstimation.from_pretrained(checkpoint)
-    
-    # for file_name in tqdm(not_ready_frames):
-    for file_name in tqdm(frames_name):
+    for file_name in tqdm(frames_name, desc='{} ({})'.format(video_name, rgb_dir)):
         # Read input frame
-        input_path = os.path.join(input_dir, file_name)
-        image = Image.open(input_path)
-
-        # Preprocess image
-        pixel_values = image_processor(image, return_tensors="pt").pixel_values
+        with tracing.span('decode', frame=file_name):
+            image = read_rgb(os.path.join(input_dir, file_name))
 
         # Predict depth
-        with torch.no_grad():
-            outputs = model(pixel_values)
-            predicted_depth = outputs.predicted_depth
-
-        # Interpolate to original size
-        prediction = torch.nn.functional.interpolate(
-            predicted_depth.unsqueeze(1),
-            size=image.size[::-1],
-            mode="bicubic",
-            align_corners=False,
-        ).squeeze()
-        output = prediction.numpy()
-
-        formatted = (output * 255 / np.max(output)).astype("uint8")
-        depth = Image.fromarray(formatted)
+        with tracing.span('inference', frame=file_name):
+            depth = predict_depth(image, image_processor, model)
 
         # Save depth frame
-        output_path = os.path.join(output_dir, file_name)
-        depth.save(output_path)
+        with tracing.span('encode', frame=file_name):
+            codec.write(os.path.join(output_dir, file_name), depth)
+        if metrics is not None:
+            metrics.frames_in += 1
+            metrics.frames_out += 1
+
+
+def get_model(ctx:PipelineContext, sample_dir:str, optimization:str, verify_frames:int):
+    """Image processor and depth model optimized for CPU inference, loaded once per process."""
+    mono_config = ctx.config['MONO-DEPTH']
+    image_processor, model = ctx.cached('mono_depth_model', lambda: load_model(mono_config['checkpoint']))
+    if optimization == 'none':
+        return image_processor, model
+    optimized = ctx.cached(('mono_depth_model', optimization),
+                           lambda: optimize_model(model, image_processor, mono_config, sample_dir, optimization, verify_frames))
+    return image_processor, optimized
+
+
+def run_step(ctx:PipelineContext, video_name:str, rgb_dirs:list=RGB_DIRS, optimization:str=None, verify_frames:int=None):
+    """Step 7: compute monocular depth of the sharp and/or blurry frames of a video."""
+    config = ctx.config
+    mono_config = config['MONO-DEPTH']
+    optimization = optimization or mono_config['optimization']
+    verify_frames = verify_frames if verify_frames is not None else mono_config['verify_frames']
+    rgb_dirs = list(dict.fromkeys(rgb_dirs))
+
+    # Check if step 3 is done
+    ctx.require_steps(video_name, ['step_3'])
+
+    # The optimized model is checked on frames of the first video
+    sample_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['{}_folder'.format(rgb_dirs[0])])
+    image_processor, model = get_model(ctx, sample_dir, optimization, verify_frames)
+
+    with StepMetrics(video_name, 'step_7', ctx.db_path) as metrics:
+        for rgb_dir in rgb_dirs:
+            process_video(config, video_name, rgb_dir, image_processor, model, metrics)
 
     # Update dp log
-    log_step_event(video_name=video_list[idx], dp_step='step_7', new_status=1, db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    update_summary_for_video(video_name=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    print(f"Step 7 completed for video {video_list[idx]}.")
+    record_step_event(video_name=video_name, dp_step='step_7', new_status=1, db_path=ctx.db_path)
+    print(f"Step 7 completed for video {video_name}.")
+
+
+def main(argv=None):
+    # Parse arguments and create pipeline context
+    args = parse_args(argv)
+    ctx = PipelineContext(args.config)
+    ids = parse_id_list(args.id)
+    db_path = ctx.db_path
+
+    mono_config = ctx.config['MONO-DEPTH']
+    num_threads = args.num_threads if args.num_threads is not None else mono_config['num_threads']
+    set_num_threads(num_threads)
+
+    failed = []
+    for idx in ids:
+        video_name = ctx.video_name(idx)
+        print('--'*30)
+        print('Video {}: {}'.format(idx, video_name))
+
+        if args.skip_complete and is_step_complete(dp_step='step_7', videos=video_name, db_path=db_path):
+            print(f"Step 7 already completed for video {video_name}. Skipping.")
+            continue
+
+        # Check if step 3 is done
+        if not is_step_complete(dp_step='step_3', videos=video_name, db_path=db_path):
+            print(f"Step 3 is not done yet for video {video_name}. Check dp log.")
+            failed.append(video_name)
+            continue
+
+        # The model is loaded once for all videos
+        run_step(ctx, video_name, args.rgb_dir, args.optimization, args.verify_frames)
 
+    if failed:
+        raise ValueError(f"Step 7 could not run for videos: {failed}. Check dp log.")
 
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
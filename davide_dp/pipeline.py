@@ -0,0 +1,70 @@
+import os
+import pandas as pd
+
+from davide_dp.configs import read_config
+from davide_dp.utils.progress_db import get_step_status
+from davide_dp.utils.video_source import open_frame_source
+
+
+class PipelineContext:
+    """Shared state of the steps run in one process.
+
+    The config, the annotations and the loaded models (CRF, mono depth model)
+    are read once and reused by all steps and videos.
+
+    Usage:
+        ctx = PipelineContext('davide_dp/configs/config.yaml')
+        rgb_blur.run_step(ctx, ctx.video_name(3), gpu=0)
+    """
+
+    def __init__(self, config_file:str):
+        self.config_file = config_file
+        self.config = read_config(config_file)
+        self._annotations = None
+        self._cache = {}
+
+    @property
+    def db_path(self) -> str:
+        return self.config['DATA-GEN-PARAMS']['dp_log']
+
+    @property
+    def annotations(self) -> pd.DataFrame:
+        if self._annotations is None:
+            self._annotations = pd.read_csv(self.config['DATA-GEN-PARAMS']['annotations'])
+        return self._annotations
+
+    @property
+    def video_list(self) -> list:
+        return self.annotations['recording'].values.tolist()
+
+    def video_name(self, clip_id:int) -> str:
+        return self.video_list[clip_id]
+
+    def video_dir(self, video_name:str, root:str='DAVIDE-tmp') -> str:
+        """Directory of a video in the raw ('DAVIDE-raw') or temporary ('DAVIDE-tmp') data."""
+        return os.path.join(self.config[root]['ROOT'], video_name)
+
+    def rgb_source(self, video_name:str, pix_fmt:str='rgb24'):
+        """RGB frames of a video: the png frames of step 1 if they were written, otherwise decoded from the raw video."""
+        rgb_dir = os.path.join(self.video_dir(video_name), self.config['DAVIDE-tmp']['rgb_folder'])
+        video_file = os.path.join(self.video_dir(video_name, root='DAVIDE-raw'), self.config['DAVIDE-raw']['video'])
+        return open_frame_source(rgb_dir, video_file, pix_fmt)
+
+    def require_steps(self, video_name:str, steps:list):
+        """Raise ValueError if any of the steps is not complete for the video."""
+        status = get_step_status(self.db_path, videos=[video_name], steps=steps).get(video_name, {})
+        for dp_step in steps:
+            if not status.get(dp_step, False):
+                raise ValueError(f"Step {dp_step.split('_')[1]} is not done yet for video {video_name}. Check dp log.")
+
+    def cached(self, key, factory):
+        """Return the object cached under `key`, creating it with `factory()` on first use."""
+        if key not in self._cache:
+            self._cache[key] = factory()
+        return self._cache[key]
+
+    def crf_inv(self, device):
+        """Inverse camera response function on the given device."""
+        import torch
+
+        return self.cached(('crf_inv', str(device)), lambda: torch.load(self.config['CRF_calibration']['crf_file']).to(device))
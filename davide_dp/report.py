@@ -0,0 +1,85 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+from davide_dp.configs import read_config
+from davide_dp.utils.progress_db import METRICS_TABLE, connect_db
+
+
+GROUP_KEYS = ['step', 'tag', 'split']
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Reports performance metrics of the data processing steps')
+    parser.add_argument("--config", type=str, default='davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--by", type=str, nargs='+', default=['step'], choices=GROUP_KEYS, help='Columns to group metrics by')
+    parser.add_argument("--all_runs", action='store_true', help='Aggregate all runs instead of the latest run of each video and step')
+    parser.add_argument("--include_failed", action='store_true', help='Include runs that finished with errors')
+    parser.add_argument("--csv", type=str, default=None, help='Save report to csv file')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def load_metrics(db_path:str, latest:bool=True, include_failed:bool=False) -> pd.DataFrame:
+    """Load 'end' events of the metrics table."""
+    conn = connect_db(db_path)
+    try:
+        metrics = pd.read_sql_query(f"SELECT * FROM {METRICS_TABLE} WHERE event = 'end' ORDER BY id", conn)
+    finally:
+        conn.close()
+    if not include_failed:
+        metrics = metrics[metrics['status'] == 1]
+    if latest:
+        metrics = metrics.drop_duplicates(subset=['video_name', 'step'], keep='last')
+    return metrics
+
+
+def aggregate(metrics:pd.DataFrame, annotations:pd.DataFrame, by:list) -> pd.DataFrame:
+    """Aggregate step metrics per group (step, tag and/or split)."""
+    annotations = annotations[['recording', 'tag', 'split']].rename(columns={'recording': 'video_name'})
+    metrics = metrics.merge(annotations, on='video_name', how='left')
+
+    report = metrics.groupby(by).agg(
+        runs=('video_name', 'count'),
+        wall_mean_s=('wall_time', 'mean'),
+        wall_p95_s=('wall_time', lambda x: np.nanpercentile(x, 95) if x.notna().any() else np.nan),
+        wall_max_s=('wall_time', 'max'),
+        wall_total_h=('wall_time', lambda x: x.sum() / 3600),
+        cpu_mean_s=('cpu_time', 'mean'),
+        peak_rss_max_mb=('peak_rss_mb', 'max'),
+        frames_in=('frames_in', 'sum'),
+        frames_out=('frames_out', 'sum'),
+        written_gb=('bytes_written', lambda x: x.sum() / 2**30),
+    )
+    # Throughput over all runs of the group
+    wall_total = metrics.groupby(by)['wall_time'].sum()
+    report['fps_out'] = report['frames_out'] / wall_total.replace(0, np.nan)
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = read_config(args.config)
+    db_path = config['DATA-GEN-PARAMS']['dp_log']
+    annotations = pd.read_csv(config['DATA-GEN-PARAMS']['annotations'])
+
+    metrics = load_metrics(db_path, latest=not args.all_runs, include_failed=args.include_failed)
+    if metrics.empty:
+        print('No metrics recorded in {}.'.format(db_path))
+        return
+
+    report = aggregate(metrics, annotations, args.by)
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:.2f}'.format):
+        print(report)
+
+    if args.csv is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.csv)), exist_ok=True)
+        report.to_csv(args.csv)
+        print('Report saved to {}'.format(args.csv))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -5,30 +5,45 @@ import os, glob, sys, torch, shutil, random, math, time, cv2
 # import torch.backends.cudnn as cudnn
 import argparse
 from tqdm import tqdm
-import cupy as cp
 
-from davide_dp.XVFI import denorm255_np, RGBframes_np2Tensor
-from davide_dp.configs import read_config
+from davide_dp.pipeline import PipelineContext
+from davide_dp.utils import tracing
+from davide_dp.utils.codecs import DEFAULT_CODEC, codec_for
+from davide_dp.utils.pyramid import pyramid_levels, level_folder
 from davide_dp.utils import (
-    is_step_complete,
-    log_step_event,
-    update_summary_for_video,
+    record_step_event,
+    StepMetrics,
     imsaveTensor,
     VideoDataset,
 )
 
 
+# Precision of the irradiance accumulation of the blurry frames
+PRECISIONS = ['fp32', 'fp16', 'fixed']
+# Largest entry of the fixed-point CRF table (int16)
+FIXED_MAX = 2**15 - 1
+
+
 def parse_args(argv):
     parser = argparse.ArgumentParser(description='Generates blurry and sharp rgb frames for video id')
     parser.add_argument("--config", type=str, default='./configs/config.yaml', help='Path to config file')
     parser.add_argument("--id", type=int, required=True, help='Video id')
     parser.add_argument("--gpu", type=int, default=0, help='gpu index')
+    parser.add_argument("--precision", type=str, default=None, choices=PRECISIONS, help='Irradiance accumulation precision. Default: BLUR-SYNTHESIS.precision in config')
+    parser.add_argument("--batch_frames", type=int, default=None, help='Frames per batch. Default: BLUR-SYNTHESIS.batch_frames in config')
+    parser.add_argument("--verify", action='store_true', help='Compare the precision against fp32 on the 8-bit outputs of the clip, without writing frames')
+    parser.add_argument("--verify_windows", type=int, default=None, help='Number of blurry frames to compare (default: all)')
+    parser.add_argument("--max_diff", type=int, default=1, help='Maximum accepted 8-bit difference of the verification')
 
     args = parser.parse_args(argv)
     return args
 
 
 def apply_crf(frame_linear, crf_inv, device: torch.device):
+    if device.type == 'cpu':
+        return apply_crf_cpu(frame_linear, crf_inv)
+    import cupy as cp
+
     C, H, W = frame_linear.shape
     with cp.cuda.Device(device.index):
         x_r = cp.asarray(crf_inv[:, 0])
@@ -58,6 +73,19 @@ def apply_crf(frame_linear, crf_inv, device: torch.device):
     return frame
 
 
+def apply_crf_cpu(frame_linear, crf_inv):
+    """apply_crf with NumPy, for runs without GPU."""
+    crf_inv = crf_inv.cpu().numpy()
+    y = np.arange(0, 256, 1)
+    xp = frame_linear.cpu().numpy()
+    yp = np.stack([np.interp(xp[c], crf_inv[:, c], y) for c in range(xp.shape[0])], axis=0)
+
+    frame = torch.as_tensor(yp).sub_(0.5).clamp_(0, 255)
+    frame = (frame / 255.0 - 0.5) * 2
+
+    return frame
+
+
 def apply_crf_inv(frames, crf_inv, device: torch.device):
     B, C, H, W = frames.shape
     #verify crf_inv in device
@@ -76,87 +104,280 @@ def apply_crf_inv(frames, crf_inv, device: torch.device):
     return frames_linear
     
 
-def save_frames(blurry, sharp, blurry_dir, sharp_dir, filename):
+class IrradianceAccumulator:
+    """
+    Sum of the irradiance of the frames of a blurry window.
+
+    fp32 is the original computation: int64 indices, float32 irradiance frames.
+    fp16 and fixed look the frames up with int32 indices in a half-precision or
+    int16 CRF table, halving the bytes of the irradiance frames, and sum each batch
+    in float32 or, for fixed, exactly in int32. The fixed-point table is scaled so
+    that its largest entry is FIXED_MAX: the only error is the rounding of the table.
+
+    Usage:
+        accumulator = IrradianceAccumulator(crf_inv, 'fixed', window_frames=32)
+        accumulator.add(frames)         # once per batch of the window
+        blurry = accumulator.mean()     # (C, H, W) float32 irradiance
+    """
+
+    def __init__(self, crf_inv, precision:str, window_frames:int):
+        assert precision in PRECISIONS, f"Precision must be one of {PRECISIONS}"
+        self.crf_inv = crf_inv
+        self.precision = precision
+        self.window_frames = window_frames
+        self.scale = 1.0
+        if precision == 'fixed':
+            assert window_frames * FIXED_MAX < 2**31, "Too many frames per window for an int32 accumulator"
+            self.scale = FIXED_MAX / crf_inv.max().item()
+            self.table = torch.round(crf_inv * self.scale).to(torch.int16)
+        elif precision == 'fp16':
+            self.table = crf_inv.half()
+        else:
+            self.table = crf_inv
+        self.flat_table = self.table.reshape(-1)
+        self.channels = torch.arange(crf_inv.shape[1], dtype=torch.int32, device=crf_inv.device)
+        self.sum = None
+
+    def reset(self):
+        self.sum = None
+
+    def add(self, frames):
+        """Add a batch of frames (B, C, H, W) in [-1, 1] on the device of the CRF."""
+        B, C, H, W = frames.shape
+        if self.precision == 'fp32':
+            frames_linear = apply_crf_inv(frames, self.crf_inv, frames.device)
+            batch_sum = B / self.window_frames * torch.mean(frames_linear, dim=0, keepdim=False)
+        else:
+            # Same quantization to 8-bit levels as apply_crf_inv
+            levels = frames.permute(0,2,3,1).mul(0.5).add_(0.5).mul_(255).add_(0.5).clamp_(0, 255).int()
+            # Index of (level, channel) in the flattened [256, C] table
+            index = levels.mul_(C).add_(self.channels).reshape(-1)
+            frames_linear = self.flat_table.index_select(0, index).reshape(B, H, W, C)
+            batch_sum = frames_linear.sum(dim=0, dtype=torch.int32 if self.precision == 'fixed' else torch.float32)
+        if self.sum is None:
+            self.sum = batch_sum
+        else:
+            self.sum += batch_sum
+
+    def mean(self):
+        """Mean irradiance of the window (C, H, W) in float32."""
+        if self.precision == 'fp32':
+            return self.sum
+        return self.sum.permute(2,0,1).float().div_(self.scale * self.window_frames).contiguous()
+
+    def error_bound(self) -> float:
+        """
+        Bound of the difference with fp32 of the blurry frames, in 8-bit levels
+        before rounding: the largest rounding error of the table times the
+        steepest slope of the CRF (levels per unit of irradiance). Assumes a
+        monotone CRF: flat or decreasing steps of the inverse CRF (e.g. at the
+        clipped ends of an estimated curve) are ignored, as the bound does not
+        hold between those levels.
+        """
+        crf_inv = self.crf_inv.double()
+        error = (self.table.double() / self.scale - crf_inv).abs().max()
+        steps = crf_inv[1:] - crf_inv[:-1]
+        return (error / steps[steps > 0].min()).item()
+
+
+def downscale_linear(frame_linear, level:int):
+    """Area downscaling of an irradiance frame (C, H, W) by an integer factor."""
+    return torch.nn.functional.avg_pool2d(frame_linear[None], level)[0]
+
+
+def to_uint8(frame) -> np.ndarray:
+    """8-bit frame as written by imsaveTensor."""
+    frame = frame.detach().cpu().numpy()
+    return (((frame + 1.0) / 2.0).clip(0.0, 1.0) * 255.0).astype(np.uint8)
+
+
+def save_frames(blurry, sharp, blurry_dir, sharp_dir, filename, codecs=(DEFAULT_CODEC, DEFAULT_CODEC)):
     blurry_path = os.path.join(blurry_dir, filename)
     sharp_path = os.path.join(sharp_dir, filename)
-    imsaveTensor(blurry_path, blurry)
-    imsaveTensor(sharp_path, sharp)
+    imsaveTensor(blurry_path, blurry, codecs[0])
+    imsaveTensor(sharp_path, sharp, codecs[1])
 
 
-def main(argv=None):
-    args = parse_args(argv)
-    config = read_config(args.config)
-    idx = args.id
+def get_device(gpu:int=0) -> torch.device:
+    device = torch.device(
+        'cuda:' + str(gpu) if torch.cuda.is_available() else 'cpu')  # will be used as "x.to(device)"
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)  # change allocation of current GPU
+        # caution!!!! if not "torch.cuda.set_device()":
+        # RuntimeError: grid_sampler(): expected input and grid to be on same device, but input is on cuda:1 and grid is on cuda:0
+        print('Available devices: ', torch.cuda.device_count())
+        print('Current cuda device: ', torch.cuda.current_device())
+        print('Current cuda device name: ', torch.cuda.get_device_name(device))
+    if gpu is not None and torch.cuda.is_available():
+        print("Use GPU: {} is used".format(gpu))
+        # cudnn.benchmark = True
+    else:
+        print('No GPU available: running on CPU')
+    return device
+
+
+def get_dataloader(config:dict, input_video_dir:str, batch_frames:int=None):
+    """Dataset and data loader of the interpolated frames of a video."""
+    blur_config = config.get('BLUR-SYNTHESIS') or {}
+    batch_frames = batch_frames or blur_config.get('batch_frames') or config['DATA-GEN-PARAMS']['sr_factor']
+    video_dataset = VideoDataset(input_video_dir, config)
+    dataloader = torch.utils.data.DataLoader(video_dataset, batch_size=batch_frames, drop_last=True, shuffle=False, num_workers=3)
+    return video_dataset, dataloader
 
-    # Get root directory
-    root_dir = config['DAVIDE-tmp']['ROOT']
-    # Get video list
-    data_annotations_path = config['DATA-GEN-PARAMS']['annotations']
-    annotations = pd.read_csv(data_annotations_path)
-    video_list = annotations['recording'].values.tolist()
+
+def blur_window(config:dict):
+    """Interpolated frames of a blurry frame, and position of its sharp frame in them."""
+    multiple = config['DATA-GEN-PARAMS']['sr_factor']
+    num_frames = config['DATA-GEN-PARAMS']['num_frames']
+    middle_frame_num = num_frames // 2 if num_frames % 2 == 0 else num_frames // 2 + 1
+    return num_frames * multiple, middle_frame_num * multiple
+
+
+def blur_windows(dataloader, frames_name:list, accumulators:list, window_frames:int, sharp_pos:int, device:torch.device, metrics:StepMetrics=None):
+    """
+    Accumulate the batches of the data loader into blurry windows of `window_frames`
+    frames (the batch size must divide it). Yields (filename, sharp) at the end of
+    each window, with the accumulators holding the window.
+    """
+    batch_size = dataloader.batch_size
+    assert window_frames % batch_size == 0, f"Batch size ({batch_size}) must divide the frames of a blurry window ({window_frames})"
+    # While tracing, GPU stages are synchronized so that their time is attributed to them
+    sync = torch.cuda.synchronize if device.type == 'cuda' else None
+    sharp, filename = None, None
+    for batchIdx, (frames, framesIds) in tqdm(enumerate(tracing.traced(dataloader, 'load'))):
+        # Position of the batch in the window
+        t = batchIdx * batch_size % window_frames
+
+        with tracing.span('to_device', sync=sync):
+            frames = frames.to(device)
+        if metrics is not None:
+            metrics.frames_in += frames.shape[0]
+        # get irradiance values and sum them
+        with tracing.span('reduce', sync=sync):
+            for accumulator in accumulators:
+                if t == 0:
+                    accumulator.reset()
+                accumulator.add(frames)
+
+        if t <= sharp_pos < t + batch_size:
+            sharp = frames[sharp_pos - t]
+            # CHANGED: replaced .numpy() with .item():
+            filename = frames_name[framesIds[sharp_pos - t].item()].split("_")[0] + ".png"
+        if t + batch_size == window_frames:
+            yield filename, sharp
+
+
+def run_step(ctx:PipelineContext, video_name:str, gpu:int=0, precision:str=None, batch_frames:int=None):
+    """Step 3: synthesize blurry and sharp frames of a video from its interpolated frames."""
+    config = ctx.config
+    blur_config = config.get('BLUR-SYNTHESIS') or {}
+    precision = precision or blur_config.get('precision') or 'fp32'
 
     # Check if step 2 is done
-    if not is_step_complete(dp_step='step_2', videos=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log']):
-        raise ValueError(f"Step 2 is not done yet for video {video_list[idx]}. Check dp log.")
+    ctx.require_steps(video_name, ['step_2'])
 
     # Input and output video paths
-    input_video_dir = os.path.join(root_dir, video_list[idx], config['DAVIDE-tmp']['VFI_folder'])
+    input_video_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['VFI_folder'])
     print('Input video dir: ', input_video_dir)
-    blurry_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['blur_folder'])
-    sharp_dir = os.path.join(config['DAVIDE-tmp']['ROOT'], video_list[idx], config['DAVIDE-tmp']['sharp_folder'])
-    os.makedirs(blurry_dir, exist_ok=True)
-    os.makedirs(sharp_dir, exist_ok=True)
+    blurry_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['blur_folder'])
+    sharp_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['sharp_folder'])
+    # Downscaled outputs of the resolution pyramid
+    levels = pyramid_levels(config)
+    output_dirs = [level_folder(folder, level) for level in [1] + levels for folder in [blurry_dir, sharp_dir]]
+    for output_dir in output_dirs:
+        os.makedirs(output_dir, exist_ok=True)
     
     # GPU devices
-    device = torch.device(
-        'cuda:' + str(args.gpu) if torch.cuda.is_available() else 'cpu')  # will be used as "x.to(device)"
-    torch.cuda.set_device(device)  # change allocation of current GPU
-    # caution!!!! if not "torch.cuda.set_device()":
-    # RuntimeError: grid_sampler(): expected input and grid to be on same device, but input is on cuda:1 and grid is on cuda:0
-    print('Available devices: ', torch.cuda.device_count())
-    print('Current cuda device: ', torch.cuda.current_device())
-    print('Current cuda device name: ', torch.cuda.get_device_name(device))
-    if args.gpu is not None and torch.cuda.is_available():
-        print("Use GPU: {} is used".format(args.gpu))
-        # cudnn.benchmark = True
+    device = get_device(gpu)
     
-    # Read CRF
-    crf_inv = torch.load(config['CRF_calibration']['crf_file']).to(device)
+    # Read CRF (loaded once per process)
+    crf_inv = ctx.crf_inv(device)
     
     # Data loader
-    video_dataset = VideoDataset(input_video_dir, config)
-    multiple = config['DATA-GEN-PARAMS']['sr_factor']
-    dataloader = torch.utils.data.DataLoader(video_dataset, batch_size=multiple, drop_last=True, shuffle=False, num_workers=3)
+    video_dataset, dataloader = get_dataloader(config, input_video_dir, batch_frames)
+    window_frames, sharp_pos = blur_window(config)
+    accumulator = IrradianceAccumulator(crf_inv, precision, window_frames)
+    if precision != 'fp32':
+        print('Irradiance accumulation: {} (bound of the difference with fp32: {:.3f} 8-bit levels)'.format(precision, accumulator.error_bound()))
 
-    num_frames = config['DATA-GEN-PARAMS']['num_frames']
-    middle_frame_num = num_frames // 2 if num_frames % 2 == 0 else num_frames // 2 + 1
-    blurry, sharp, filename = None, None, None
+    codecs = (codec_for(config, 'blur'), codec_for(config, 'sharp'))
     frames_name = [os.path.basename(x) for x in video_dataset.frames_path]
-    with torch.no_grad():
-        for batchIdx, (frames, framesIds) in tqdm(enumerate(dataloader)):
+    sync = torch.cuda.synchronize if device.type == 'cuda' else None
+    with torch.no_grad(), StepMetrics(video_name, 'step_3', ctx.db_path, output_dirs=output_dirs) as metrics:
+        for filename, sharp in blur_windows(dataloader, frames_name, [accumulator], window_frames, sharp_pos, device, metrics):
+            blurry_linear = accumulator.mean()
+            with tracing.span('crf', sync=sync):
+                blurry = apply_crf(blurry_linear, crf_inv, device)
+            with tracing.span('encode', frame=filename):
+                save_frames(blurry, sharp, blurry_dir, sharp_dir, filename, codecs)
+            metrics.frames_out += 1
 
-            frames = frames.to(device)
-            # get irradiance values
-            frames_linear = apply_crf_inv(frames, crf_inv, device)
-
-            if (batchIdx % num_frames) == 0:
-                blurry = 1/num_frames * torch.mean(frames_linear, dim=0, keepdim=False)
-            else:
-                blurry += 1/num_frames * torch.mean(frames_linear, dim=0, keepdim=False)
-            
-            if (batchIdx % num_frames) == middle_frame_num:
-                sharp = frames[0]
-                # CHANGED: replaced .numpy() with .item():
-                filename = frames_name[framesIds[0].item()].split("_")[0] + ".png"
-            if (batchIdx % num_frames) == num_frames - 1:
-                blurry = apply_crf(blurry, crf_inv, device)
-                save_frames(blurry, sharp, blurry_dir, sharp_dir, filename)
+            # Pyramid levels are downscaled in the linear domain, the sharp frame
+            # like the blurry one, so that each level is the blur of the sharp level
+            if levels:
+                with tracing.span('pyramid', sync=sync):
+                    sharp_linear = apply_crf_inv(sharp[None], crf_inv, device)[0]
+                    # apply_crf shifts the frames by half a level and imsaveTensor truncates: the
+                    # sharp levels are shifted back and rounded, so flat regions keep their level
+                    downscaled = [(level, apply_crf(downscale_linear(blurry_linear, level), crf_inv, device),
+                                   apply_crf(downscale_linear(sharp_linear, level), crf_inv, device).add_(2 / 255))
+                                  for level in levels]
+                for level, blurry_level, sharp_level in downscaled:
+                    with tracing.span('encode', frame=filename, level=level):
+                        save_frames(blurry_level, sharp_level, level_folder(blurry_dir, level), level_folder(sharp_dir, level), filename, codecs)
     
     # Update dp log
-    log_step_event(video_name=video_list[idx], dp_step='step_3', new_status=1, db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    update_summary_for_video(video_name=video_list[idx], db_path=config['DATA-GEN-PARAMS']['dp_log'])
-    print(f"Step 3 completed for video {video_list[idx]}.")
+    record_step_event(video_name=video_name, dp_step='step_3', new_status=1, db_path=ctx.db_path)
+    print(f"Step 3 completed for video {video_name}.")
+
+
+def verify_precision(ctx:PipelineContext, video_name:str, precision:str, gpu:int=0, batch_frames:int=None, windows:int=None) -> dict:
+    """
+    Compare the blurry frames of a precision with fp32 on a video, as 8-bit
+    frames. No frame is written. Returns the largest difference, the fraction of
+    differing pixels and the error bound of the precision.
+    """
+    config = ctx.config
+    ctx.require_steps(video_name, ['step_2'])
+    input_video_dir = os.path.join(ctx.video_dir(video_name), config['DAVIDE-tmp']['VFI_folder'])
+    device = get_device(gpu)
+    crf_inv = ctx.crf_inv(device)
+    video_dataset, dataloader = get_dataloader(config, input_video_dir, batch_frames)
+    window_frames, sharp_pos = blur_window(config)
+    reference = IrradianceAccumulator(crf_inv, 'fp32', window_frames)
+    reduced = IrradianceAccumulator(crf_inv, precision, window_frames)
+
+    frames_name = [os.path.basename(x) for x in video_dataset.frames_path]
+    report = {'precision': precision, 'windows': 0, 'max_diff': 0, 'diff_pixels': 0, 'pixels': 0,
+              'error_bound': reduced.error_bound()}
+    with torch.no_grad():
+        for filename, _ in blur_windows(dataloader, frames_name, [reference, reduced], window_frames, sharp_pos, device):
+            blurry_ref = to_uint8(apply_crf(reference.mean(), crf_inv, device))
+            blurry = to_uint8(apply_crf(reduced.mean(), crf_inv, device))
+            diff = np.abs(blurry.astype(np.int16) - blurry_ref)
+            report['windows'] += 1
+            report['max_diff'] = max(report['max_diff'], int(diff.max()))
+            report['diff_pixels'] += int(np.count_nonzero(diff))
+            report['pixels'] += diff.size
+            if windows is not None and report['windows'] >= windows:
+                break
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ctx = PipelineContext(args.config)
+    video_name = ctx.video_name(args.id)
+    if not args.verify:
+        run_step(ctx, video_name, gpu=args.gpu, precision=args.precision, batch_frames=args.batch_frames)
+        return 0
+
+    precision = args.precision or (ctx.config.get('BLUR-SYNTHESIS') or {}).get('precision') or 'fp32'
+    report = verify_precision(ctx, video_name, precision, gpu=args.gpu, batch_frames=args.batch_frames, windows=args.verify_windows)
+    print('{} vs fp32 on {} blurry frames of {}: max difference {} levels, {:.4%} of the values differ (bound before rounding: {:.3f} levels)'.format(
+        precision, report['windows'], video_name, report['max_diff'], report['diff_pixels'] / max(report['pixels'], 1), report['error_bound']))
+    return 1 if report['max_diff'] > args.max_diff else 0
 
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main(sys.argv[1:]))
\ No newline at end of file
@@ -0,0 +1,303 @@
+import os
+import sys
+import argparse
+import time
+import contextlib
+import multiprocessing
+from queue import Empty
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from davide_dp.pipeline import PipelineContext
+from davide_dp.utils.ffmpeg_io import FFmpegWriter
+from davide_dp.utils.color_depth import colorize_depth_16bits
+from davide_dp.utils.codecs import list_images, read_image
+from davide_dp.utils.pyramid import pyramid_levels, level_folder
+from davide_dp.utils.metrics import available_cpus
+from davide_dp.utils import animate_imu, animate_poses
+
+
+FPS = 20
+# Frames of each source rendered ahead of the composition by the render processes
+QUEUE_FRAMES = 4
+ENCODER_ARGS = ['-c:v', 'libx264', '-crf', '12', '-pix_fmt', 'yuv420p', '-f', 'matroska']
+
+# Sample videos (keys of DAVIDE-tmp.sample_videos): tile size (width, height), grid of sources, labels
+LAYOUTS = {
+    'sample_blur_sharp': {'tile': (960, 720), 'grid': [['blur', 'sharp']], 'labels': False},
+    'sample_rgb_depth': {'tile': (960, 720), 'grid': [['sharp', 'depth']], 'labels': False},
+    'sample_sync_summary': {'tile': (720, 540), 'grid': [['blur', 'sharp', 'depth'], ['imu_acc', 'imu_rr', 'poses']], 'labels': True},
+}
+
+LABELS = {
+    'blur': 'Blur',
+    'sharp': 'Sharp',
+    'depth': 'Depth',
+    'imu_acc': 'Acceleration',
+    'imu_rr': 'Gyroscope',
+    'poses': 'Camera Poses',
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Composes the sample videos of a video id in a single pass over the sources')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--id", type=int, required=True, help='Video id')
+    parser.add_argument("--layouts", type=str, nargs='+', choices=list(LAYOUTS), default=list(LAYOUTS), help='Sample videos to compose')
+    parser.add_argument("--workers", type=int, default=None,
+                        help='Processes rendering the sources in parallel. Default: CPUs of the allocation. 1: single pass in this process')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def image_frames(folder:str):
+    """RGB frames of a folder of images, in name order."""
+    for name in list_images(folder):
+        yield cv2.cvtColor(read_image(os.path.join(folder, name), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+
+
+def depth_frames(folder:str):
+    """Colored frames of a folder of 16-bit depth images, in name order."""
+    for name in list_images(folder):
+        yield colorize_depth_16bits(read_image(os.path.join(folder, name), cv2.IMREAD_ANYDEPTH))
+
+
+def preview_folder(folder:str, levels:list, width:int) -> str:
+    """Smallest pyramid level of a folder whose frames are at least `width` wide (the folder itself if none)."""
+    for level in sorted(levels, reverse=True):
+        level_dir = level_folder(folder, level)
+        names = list_images(level_dir) if os.path.isdir(level_dir) else []
+        if names and read_image(os.path.join(level_dir, names[0])).shape[1] >= width:
+            return level_dir
+    return folder
+
+
+def frame_sources(ctx:PipelineContext, video_name:str) -> dict:
+    """Factories of the frame generators of each source. Sources are only read if a layout uses them."""
+    config = ctx.config['DAVIDE-tmp']
+    video_dir = ctx.video_dir(video_name)
+    interval = ctx.config['DATA-GEN-PARAMS']['num_frames']
+    imu_file = os.path.join(video_dir, config['imu_data'])
+    # Frames are read from the smallest pyramid level that is not upscaled in the tiles
+    levels = pyramid_levels(ctx.config)
+    width = max(layout['tile'][0] for layout in LAYOUTS.values())
+
+    def folder(name):
+        return preview_folder(os.path.join(video_dir, config[name]), levels, width)
+
+    def poses():
+        poses, intrinsics, factor = animate_poses.read_poses(os.path.join(video_dir, config['camera_poses']),
+                                                             os.path.join(video_dir, config['camera_intrinsics']))
+        return animate_poses.render_frames(poses, intrinsics, factor)
+
+    return {
+        'blur': lambda: image_frames(folder('blur_folder')),
+        'sharp': lambda: image_frames(folder('sharp_folder')),
+        'depth': lambda: depth_frames(folder('depth_folder')),
+        'imu_acc': lambda: animate_imu.render_frames(animate_imu.read_imu(imu_file, interval), 'acc', interval),
+        'imu_rr': lambda: animate_imu.render_frames(animate_imu.read_imu(imu_file, interval), 'rr', interval),
+        'poses': poses,
+    }
+
+
+class Layout:
+    """Grid of equally sized tiles written to one video."""
+
+    def __init__(self, path:str, tile:tuple, grid:list, labels:bool):
+        self.path = path
+        self.tile = tile
+        self.grid = grid
+        self.sources = {source for row in grid for source in row}
+        width, height = tile
+        self.canvas = np.zeros((height * len(grid), width * len(grid[0]), 3), dtype=np.uint8)
+
+        output_args = list(ENCODER_ARGS)
+        if labels:
+            # Labels are drawn by the encoder, as in the ffmpeg filter graph of the tiles
+            filters = ["drawtext=text='{}':fontcolor=yellow:fontsize=28:x={}:y={}".format(LABELS[source], 5 + c * width, 5 + r * height)
+                       for r, row in enumerate(grid) for c, source in enumerate(row)]
+            output_args = ['-vf', ','.join(filters)] + output_args
+        self.writer = FFmpegWriter(path, self.canvas.shape[1], self.canvas.shape[0], FPS, output_args=output_args)
+
+    def write(self, tile):
+        """Compose the tiles returned by tile(source, size) and write the frame."""
+        width, height = self.tile
+        for r, row in enumerate(self.grid):
+            for c, source in enumerate(row):
+                self.canvas[r * height:(r + 1) * height, c * width:(c + 1) * width] = tile(source, self.tile)
+        self.writer.write(self.canvas)
+
+
+def layout_sizes(layouts:list) -> dict:
+    """Tile sizes of each source used by the layouts."""
+    sizes = {}
+    for name in layouts:
+        for row in LAYOUTS[name]['grid']:
+            for source in row:
+                sizes.setdefault(source, set()).add(LAYOUTS[name]['tile'])
+    return sizes
+
+
+def scaled_frames(frames, sizes:list):
+    """Frames of a source scaled once to each tile size: {size: tile}."""
+    for frame in frames:
+        yield {size: frame if frame.shape[1::-1] == size else cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+               for size in sizes}
+
+
+def render_sources(config_file:str, video_name:str, sizes:dict, queues:dict):
+    """
+    Render the frames of some sources, scaled to their tile sizes, in lockstep
+    into a bounded queue per source: ('frame', tiles) items, then ('done', timing)
+    or ('error', message). Runs in a render process of compose.
+    """
+    cv2.setNumThreads(1)
+    start = time.time()
+    try:
+        factories = frame_sources(PipelineContext(config_file), video_name)
+        streams = {source: scaled_frames(factories[source](), sorted(sizes[source])) for source in queues}
+    except Exception as error:
+        for queue in queues.values():
+            queue.put(('error', repr(error)))
+        return
+    frames = dict.fromkeys(streams, 0)
+    while streams:
+        for source in list(streams):
+            try:
+                item = ('frame', next(streams[source]))
+                frames[source] += 1
+            except StopIteration:
+                item = ('done', {'frames': frames[source], 'seconds': time.time() - start})
+                del streams[source]
+            except Exception as error:
+                item = ('error', repr(error))
+                del streams[source]
+            queues[source].put(item)
+
+
+def streamed_frames(queue, process, timing:dict, source:str):
+    """Frames of a source rendered by render_sources in `process`."""
+    while True:
+        try:
+            kind, payload = queue.get(timeout=1)
+        except Empty:
+            if process.is_alive():
+                continue
+            # Items put before the process exited are still readable
+            try:
+                kind, payload = queue.get(timeout=1)
+            except Empty:
+                raise RuntimeError('render process exited with code {}'.format(process.exitcode))
+        if kind == 'error':
+            raise RuntimeError(payload)
+        if kind == 'done':
+            timing[('source', source)] = payload
+            return
+        yield payload
+
+
+def compose(ctx:PipelineContext, video_name:str, layouts:list=list(LAYOUTS), workers:int=1) -> bool:
+    """
+    Compose sample videos of a video in a single pass. Each source frame is read
+    (or rendered) once, scaled once per tile size and written to every layout
+    that uses it. Sources that end before the others hold their last frame, and
+    a layout ends with its longest source.
+
+    With workers > 1 the sources are rendered by up to `workers` processes and
+    streamed through bounded queues (QUEUE_FRAMES frames per source), so nothing
+    is written besides the videos. A failed source only skips the layouts that
+    use it. Returns True if all layouts were written.
+    """
+    config = ctx.config['DAVIDE-tmp']
+    samples_dir = os.path.join(ctx.video_dir(video_name), config['sample_videos']['folder'])
+    os.makedirs(samples_dir, exist_ok=True)
+    sizes = layout_sizes(layouts)
+    timing, failed = {}, {}
+
+    processes = []
+    try:
+        if workers <= 1:
+            factories = frame_sources(ctx, video_name)
+            streams = {source: scaled_frames(factories[source](), sorted(tile_sizes)) for source, tile_sizes in sizes.items()}
+        else:
+            # Sources are shared round-robin by the render processes
+            groups = [sorted(sizes)[i::workers] for i in range(min(workers, len(sizes)))]
+            streams = {}
+            for group in groups:
+                queues = {source: multiprocessing.Queue(QUEUE_FRAMES) for source in group}
+                process = multiprocessing.Process(target=render_sources, args=(ctx.config_file, video_name, sizes, queues), daemon=True)
+                process.start()
+                processes.append(process)
+                streams.update({source: streamed_frames(queue, process, timing, source) for source, queue in queues.items()})
+
+        with contextlib.ExitStack() as stack:
+            active = {}
+            for name in layouts:
+                layout = Layout(os.path.join(samples_dir, config['sample_videos'][name]), **LAYOUTS[name])
+                stack.enter_context(layout.writer)
+                active[name] = layout
+            layout_start = time.time()
+            current, ended = {}, set()
+
+            pbar = tqdm(desc='Composing sample videos')
+            while active:
+                # Next frame of every source, also of the sources of failed layouts, so their processes finish
+                for source in sorted(set(streams) - ended):
+                    try:
+                        current[source] = next(streams[source])
+                    except StopIteration:
+                        ended.add(source)
+                        if source not in current:
+                            failed[('source', source)] = 'no frames'
+                    except Exception as error:
+                        print('source {} FAILED: {!r}'.format(source, error))
+                        ended.add(source)
+                        failed[('source', source)] = error
+
+                for name, layout in list(active.items()):
+                    if any(('source', source) in failed for source in layout.sources):
+                        # Stop the encoder and remove the partial video
+                        layout.writer.__exit__(RuntimeError, None, None)
+                        if os.path.isfile(layout.path):
+                            os.remove(layout.path)
+                        failed[('layout', name)] = 'source failed'
+                        del active[name]
+                    elif layout.sources <= ended:
+                        layout.writer.close()
+                        timing[('layout', name)] = {'frames': layout.writer.frames, 'seconds': time.time() - layout_start}
+                        print('{} frames written to {}'.format(layout.writer.frames, layout.path))
+                        del active[name]
+                    else:
+                        layout.write(lambda source, size: current[source][size])
+                pbar.update(1)
+            pbar.close()
+    finally:
+        for process in processes:
+            # Render processes of sources that nobody reads anymore
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    print('--'*30)
+    print('{:<8} {:<20} {:>8} {:>10}'.format('job', 'name', 'frames', 'time [s]'))
+    for (kind, name), t in timing.items():
+        print('{:<8} {:<20} {:>8} {:>10.1f}'.format(kind, name, t['frames'], t['seconds']))
+    for (kind, name), error in failed.items():
+        print('{:<8} {:<20} FAILED: {}'.format(kind, name, error))
+    return not failed
+
+
+def main(argv=None):
+    # Parse arguments and create pipeline context
+    args = parse_args(argv)
+    ctx = PipelineContext(args.config)
+    video_name = ctx.video_name(args.id)
+    workers = args.workers or available_cpus()
+    return 0 if compose(ctx, video_name, args.layouts, workers) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,244 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+
+from davide_dp.configs import read_config
+from davide_dp.utils.ids import parse_id_list
+from davide_dp.utils.progress_db import DP_STEPS, get_step_status, step_dependencies
+
+
+# Shell driver of each step
+STEP_SCRIPTS = {
+    'step_1': 'scripts/run_01_extract_rgb.sh',
+    'step_2': 'scripts/run_02_VFI.sh',
+    'step_3': 'scripts/run_03_rgb_blur.sh',
+    'step_4': 'scripts/run_04_depth.sh',
+    'step_5': 'scripts/run_05_camera_data.sh',
+    'step_6': 'scripts/run_06_sample-videos.sh',
+    'step_7': 'scripts/run_07_mono_depth.sh',
+    'step_8': 'scripts/run_08_data_selection.sh',
+}
+
+POLL_INTERVAL = 1.0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Runs the data processing steps for many videos on a local worker pool')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--clips", type=str, default=None, help='Video ids. E.g. 0-92 or 0,2,5-7. Default: all videos')
+    parser.add_argument("--steps", type=str, default='1-5,7,8', help='Steps to run. E.g. 1-5,7,8. Step 8 exports mono depth if step 7 is included')
+    parser.add_argument("--cpus", type=int, default=None, help='CPU slots. Default: number of CPUs')
+    parser.add_argument("--gpus", type=str, default=None, help='Comma-separated GPU indices. Default: CUDA_VISIBLE_DEVICES or all GPUs listed by nvidia-smi')
+    parser.add_argument("--mem_gb", type=float, default=None, help='Memory budget in GB. Default: physical memory')
+    parser.add_argument("--log_dir", type=str, default='logs/scheduler', help='Directory for task logs')
+    parser.add_argument("--dry_run", action='store_true', help='Print the task graph without running it')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def detect_gpus() -> list:
+    """List visible GPU indices."""
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible is not None:
+        return [gpu for gpu in visible.split(',') if gpu.strip()]
+    if shutil.which('nvidia-smi') is None:
+        return []
+    output = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True).stdout
+    return [str(i) for i, line in enumerate(output.splitlines()) if line.startswith('GPU')]
+
+
+def detect_mem_gb() -> float:
+    """Physical memory in GB."""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2**30
+
+
+class Task:
+    """One step of one video."""
+
+    def __init__(self, clip_id:int, video_name:str, dp_step:str, dependencies:list, resources:dict):
+        self.clip_id = clip_id
+        self.video_name = video_name
+        self.dp_step = dp_step
+        self.dependencies = dependencies
+        self.cpus = resources.get('cpus', 1)
+        self.gpus = resources.get('gpus', 0)
+        self.mem_gb = resources.get('mem_gb', 0)
+        self.state = 'pending'
+        self.process = None
+        self.gpu_ids = []
+        self.start_time = None
+        self.log_file = None
+
+    def __repr__(self):
+        return '{}[{}]'.format(self.dp_step, self.video_name)
+
+
+def step_command(dp_step:str, clip_id:int, config_file:str, mono_depth:bool=False, conda_env:str=None) -> list:
+    """Command that runs one step for one video with its shell driver."""
+    command = ['bash', STEP_SCRIPTS[dp_step], str(clip_id), '--config', config_file]
+    if dp_step == 'step_8' and mono_depth:
+        command.append('--mono_depth')
+    if conda_env:
+        command = ['conda', 'run', '--no-capture-output', '-n', conda_env] + command
+    return command
+
+
+def build_tasks(config:dict, clip_ids:list, steps:list, video_list:list) -> dict:
+    """Build the video x step task graph, skipping steps already complete in the dp log."""
+    mono_depth = 'step_7' in steps
+    status = get_step_status(config['DATA-GEN-PARAMS']['dp_log'], videos=[video_list[i] for i in clip_ids])
+    resources = config['SCHEDULER']['resources']
+
+    tasks = {}
+    for clip_id in clip_ids:
+        video_name = video_list[clip_id]
+        video_status = status.get(video_name, {step: False for step in DP_STEPS})
+        for dp_step in steps:
+            if video_status[dp_step]:
+                continue
+            dependencies = [dep for dep in step_dependencies(dp_step, mono_depth) if not video_status[dep]]
+            tasks[(video_name, dp_step)] = Task(clip_id, video_name, dp_step, dependencies, resources[dp_step])
+
+    # Tasks whose dependencies are neither complete nor scheduled cannot run
+    for task in tasks.values():
+        missing = [dep for dep in task.dependencies if (task.video_name, dep) not in tasks]
+        if missing:
+            task.state = 'blocked'
+            print('{} is blocked: {} not complete and not scheduled.'.format(task, ', '.join(missing)))
+    block_dependents(tasks)
+    return tasks
+
+
+def block_dependents(tasks:dict):
+    """Block pending tasks that depend on blocked or failed tasks."""
+    changed = True
+    while changed:
+        changed = False
+        for task in tasks.values():
+            if task.state != 'pending':
+                continue
+            for dep in task.dependencies:
+                if tasks[(task.video_name, dep)].state in ['blocked', 'failed']:
+                    task.state = 'blocked'
+                    print('{} is blocked: {} did not run.'.format(task, dep))
+                    changed = True
+                    break
+
+
+class LocalScheduler:
+    """Runs ready tasks on a local pool of CPU slots, GPUs and memory."""
+
+    def __init__(self, tasks:dict, config_file:str, config:dict, cpus:int, gpus:list, mem_gb:float, log_dir:str, mono_depth:bool=False):
+        self.tasks = tasks
+        self.config_file = config_file
+        self.conda_envs = config['SCHEDULER'].get('conda_envs') or {}
+        self.mono_depth = mono_depth
+        self.free_cpus = cpus
+        self.free_gpus = list(gpus)
+        self.free_mem_gb = mem_gb
+        self.log_dir = log_dir
+
+        for task in tasks.values():
+            if task.state == 'pending' and (task.cpus > cpus or task.gpus > len(gpus) or task.mem_gb > mem_gb):
+                raise ValueError('{} needs {} CPUs, {} GPUs and {} GB, but the pool has {} CPUs, {} GPUs and {} GB.'.format(
+                    task, task.cpus, task.gpus, task.mem_gb, cpus, len(gpus), mem_gb))
+
+    def _ready(self, task:Task) -> bool:
+        if task.state != 'pending':
+            return False
+        return all(self.tasks[(task.video_name, dep)].state == 'done' for dep in task.dependencies)
+
+    def _fits(self, task:Task) -> bool:
+        return task.cpus <= self.free_cpus and task.gpus <= len(self.free_gpus) and task.mem_gb <= self.free_mem_gb
+
+    def _launch(self, task:Task):
+        task.gpu_ids = [self.free_gpus.pop(0) for _ in range(task.gpus)]
+        self.free_cpus -= task.cpus
+        self.free_mem_gb -= task.mem_gb
+
+        env = os.environ.copy()
+        env['CUDA_VISIBLE_DEVICES'] = ','.join(task.gpu_ids)
+        env['OMP_NUM_THREADS'] = str(task.cpus)
+        command = step_command(task.dp_step, task.clip_id, self.config_file, self.mono_depth, self.conda_envs.get(task.dp_step))
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        task.log_file = open(os.path.join(self.log_dir, '{}_{}.txt'.format(task.video_name, task.dp_step)), 'w')
+        task.process = subprocess.Popen(command, stdout=task.log_file, stderr=subprocess.STDOUT, env=env)
+        task.start_time = time.time()
+        task.state = 'running'
+        print('[{}] started {} (GPUs: {})'.format(time.strftime('%H:%M:%S'), task, ','.join(task.gpu_ids) or '-'))
+
+    def _release(self, task:Task):
+        self.free_gpus.extend(task.gpu_ids)
+        self.free_cpus += task.cpus
+        self.free_mem_gb += task.mem_gb
+        task.log_file.close()
+
+    def run(self) -> bool:
+        """Run all tasks. Returns True if all of them succeeded."""
+        # Earlier steps first, as they unlock more work
+        order = sorted(self.tasks.values(), key=lambda task: (DP_STEPS.index(task.dp_step), task.clip_id))
+        while any(task.state in ['pending', 'running'] for task in order):
+            # Collect finished tasks
+            for task in order:
+                if task.state != 'running' or task.process.poll() is None:
+                    continue
+                self._release(task)
+                elapsed = time.time() - task.start_time
+                if task.process.returncode == 0:
+                    task.state = 'done'
+                    print('[{}] finished {} in {:.0f} s'.format(time.strftime('%H:%M:%S'), task, elapsed))
+                else:
+                    task.state = 'failed'
+                    print('[{}] FAILED {} after {:.0f} s (exit code {}). See {}'.format(
+                        time.strftime('%H:%M:%S'), task, elapsed, task.process.returncode, task.log_file.name))
+                    block_dependents(self.tasks)
+
+            # Launch ready tasks that fit in the free resources
+            for task in order:
+                if self._ready(task) and self._fits(task):
+                    self._launch(task)
+
+            if not any(task.state == 'running' for task in order) and any(task.state == 'pending' for task in order):
+                raise RuntimeError('No task can be started. Check the task dependencies.')
+            time.sleep(POLL_INTERVAL)
+
+        states = [task.state for task in order]
+        print('--'*30)
+        print('Done: {}, failed: {}, blocked: {}'.format(states.count('done'), states.count('failed'), states.count('blocked')))
+        return all(state == 'done' for state in states)
+
+
+def main(argv=None):
+    import pandas as pd
+
+    args = parse_args(argv)
+    config = read_config(args.config)
+
+    annotations = pd.read_csv(config['DATA-GEN-PARAMS']['annotations'])
+    video_list = annotations['recording'].values.tolist()
+    clip_ids = parse_id_list(args.clips) if args.clips is not None else list(range(len(video_list)))
+    steps = ['step_{}'.format(i) for i in parse_id_list(args.steps)]
+
+    tasks = build_tasks(config, clip_ids, steps, video_list)
+    print('{} tasks to run for {} videos.'.format(sum(task.state == 'pending' for task in tasks.values()), len(clip_ids)))
+    if args.dry_run:
+        for task in tasks.values():
+            print('{:>8} {} <- {}'.format(task.state, task, ', '.join(task.dependencies) or '-'))
+        return 0
+
+    cpus = args.cpus or os.cpu_count()
+    gpus = args.gpus.split(',') if args.gpus is not None else detect_gpus()
+    mem_gb = args.mem_gb or detect_mem_gb()
+    print('Worker pool: {} CPUs, {} GPUs, {:.0f} GB'.format(cpus, len(gpus), mem_gb))
+
+    scheduler = LocalScheduler(tasks, args.config, config, cpus, gpus, mem_gb, args.log_dir, mono_depth='step_7' in steps)
+    return 0 if scheduler.run() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,8 @@
 import sys
-import pandas as pd
 import argparse
 
-from davide_dp.utils import log_step_event, update_summary_for_video, NUMBER_OF_STEPS
+from davide_dp.utils import record_step_event, record_step_metrics, NUMBER_OF_STEPS
+from davide_dp.utils.metrics import count_files, directory_size
 
 
 def arg_parser(argv):
@@ -10,6 +10,8 @@ def arg_parser(argv):
     parser.add_argument("--dp_log", type=str, required=True, help='Path to data processing log file')
     parser.add_argument("--recording", type=str, required=True, help='recording name')
     parser.add_argument("--step", type=int, required=True, help='step number')
+    parser.add_argument("--wall_time", type=float, default=None, help='Wall time of the step in seconds (recorded in the metrics table)')
+    parser.add_argument("--output_dir", type=str, default=None, help='Output directory of the step. Its number of files and size are recorded in the metrics table')
     args = parser.parse_args(argv)
     return args
 
@@ -26,8 +28,13 @@ def main(argv):
     assert new_status in [0, 1], "New status must be either 0 or 1."
     dp_step = f'step_{step}'
 
-    log_step_event(recording, dp_step, new_status, dp_log)
-    update_summary_for_video(recording, dp_log)
+    if args.wall_time is not None or args.output_dir is not None:
+        metrics = {'wall_time': args.wall_time}
+        if args.output_dir is not None:
+            metrics['frames_out'] = count_files(args.output_dir)
+            metrics['bytes_written'] = directory_size(args.output_dir)
+        record_step_metrics(recording, dp_step, 'end', dp_log, status=new_status, **metrics)
+    record_step_event(recording, dp_step, new_status, dp_log)
     print(f"Updated {dp_step} status to {new_status} for recording {recording} in {dp_log}")
 
 
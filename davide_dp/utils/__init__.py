@@ -1,5 +1,36 @@
-from .utils import *
-from .color_depth import get_color_map
+import importlib
+
+# Light modules (standard library only) are imported eagerly
+from .ids import parse_id_list
 # from utils.update_dp_log import update as update_log_step
 # from utils.update_dp_log import check_step as check_log_step
-from .progress_db import *
\ No newline at end of file
+from .progress_db import *
+from .metrics import StepMetrics
+
+# Modules that depend on torch, cv2, skimage or matplotlib are imported
+# at first access of one of their names (PEP 562), so that lightweight
+# commands (update_db, config export, status checks) start fast.
+_LAZY_MODULES = {
+    '.utils': [
+        'IMG_EXTENSIONS', 'FIG_EXTENSIONS', 'is_image_file', 'get_image_path_list',
+        'load_depth_bin', 'load_conf_bin', 'read_depth_bin', 'read_conf_bin',
+        'save_depth_16bits', 'read_depth_16bits', 'save_conf_8bits', 'read_txt_data',
+        'imread', 'read_log', 'imread2Tensor', 'imsaveTensor', 'imsave',
+        'read_video_paths', 'VideoDataset', 'CameraIntrinsics',
+    ],
+    '.color_depth': ['get_color_map'],
+}
+_LAZY_ATTRS = {name: module for module, names in _LAZY_MODULES.items() for name in names}
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -8,6 +8,9 @@ import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 
+from davide_dp.utils.ffmpeg_io import FFmpegWriter
+from davide_dp.utils.raster import LineRasterizer, composite
+
 
 mpl.rcParams["font.family"] = "serif"
 mpl.rcParams["font.size"] = "22"
@@ -27,12 +30,14 @@ def _parse_args(argv):
     parser.add_argument("--fps", type=int, default=20, help='Frames per second')
     parser.add_argument("--save", type=str, required=True, help='Path to save animation')
     parser.add_argument("--interval", type=int, default=4, help='Interval between time steps')
+    parser.add_argument("--renderer", type=str, choices=['raster', 'matplotlib'], default='raster',
+                        help='raster: draws the new line segments of each frame on a static background. matplotlib: redraws the figure (FuncAnimation)')
     args = parser.parse_args(argv)
     return args
 
 
-def animate(imu_data, comp, fps, save, interval):
-    """Animate imu data."""
+def plot_figure(imu_data, comp):
+    """Figure with the axes, labels and legend of the animation. Returns the figure, axes and the x, y, z lines."""
     # Create figure
     fig = plt.figure(figsize=FIG_SIZE, dpi=DPI)
     ax = fig.add_subplot(111)
@@ -62,6 +67,13 @@ def animate(imu_data, comp, fps, save, interval):
     ax.legend(loc='upper right')
 
     ax.grid(True)
+    return fig, ax, (lx, ly, lz)
+
+
+def animate_matplotlib(imu_data, comp, fps, save, interval):
+    """Animate imu data redrawing the figure at every frame."""
+    fig, ax, (lx, ly, lz) = plot_figure(imu_data, comp)
+
     # Update function
     def update(i):
         lx.set_data(1/ FS * np.arange(0, i*interval), imu_data[comp + 'x'][:i*interval])
@@ -79,6 +91,84 @@ def animate(imu_data, comp, fps, save, interval):
     pbar.close()
 
 
+def render_frames(imu_data, comp, interval):
+    """
+    Frames of the imu animation as RGB uint8 arrays, equivalent to animate_matplotlib.
+
+    The axes, labels and grid are rendered once with matplotlib. Each frame only
+    rasterizes the line segments added since the previous frame into the
+    framebuffer; the legend is composited on top as in the figure. Where lines
+    cross, the most recent segment is on top instead of the z line.
+    """
+    fig, ax, lines = plot_figure(imu_data, comp)
+    height = fig.canvas.get_width_height()[1]
+    fig.canvas.draw()
+
+    # Static background without the legend
+    legend = ax.get_legend()
+    x0, y0, x1, y1 = legend.get_window_extent().extents
+    top, left = max(int(np.floor(height - y1)) - 1, 0), max(int(np.floor(x0)) - 1, 0)
+    bottom, right = int(np.ceil(height - y0)) + 1, int(np.ceil(x1)) + 1
+    legend.set_visible(False)
+    fig.canvas.draw()
+    background = np.asarray(fig.canvas.buffer_rgba())[..., :3].copy()
+
+    # Legend as a transparent overlay
+    for artist in fig.get_children() + ax.get_children():
+        artist.set_visible(False)
+    fig.set_visible(True)
+    ax.set_visible(True)
+    ax.axison = False
+    legend.set_visible(True)
+    fig.canvas.draw()
+    overlay = np.asarray(fig.canvas.buffer_rgba())[top:bottom, left:right].copy()
+
+    # Data in pixel coordinates (y downwards)
+    x0, y0, x1, y1 = ax.bbox.extents
+    clip = (x0, height - y1, x1, height - y0)
+    t = 1 / FS * np.arange(len(imu_data))
+    points, rasterizers = [], []
+    for line, axis in zip(lines, 'xyz'):
+        xy = ax.transData.transform(np.stack([t, imu_data[comp + axis].values], axis=-1))
+        xy[:, 1] = height - xy[:, 1]
+        points.append(xy)
+        color = np.array(mpl.colors.to_rgb(line.get_color())) * 255
+        rasterizers.append(LineRasterizer(background.shape, color, line.get_linewidth() * DPI / 72, clip))
+    plt.close(fig)
+
+    framebuffer = background
+    drawn = 0
+    for i in range(len(imu_data) // interval):
+        # Frame i shows the first i*interval samples: segments [drawn, i*interval - 1)
+        segments = max(i * interval - 1, 0)
+        for xy, rasterizer in zip(points, rasterizers):
+            rasterizer.draw(framebuffer, xy[drawn:segments], xy[drawn + 1:segments + 1])
+        drawn = segments
+        yield composite(framebuffer, overlay, (top, left))
+
+
+def animate(imu_data, comp, fps, save, interval, renderer='raster'):
+    """Animate imu data."""
+    if renderer == 'matplotlib':
+        return animate_matplotlib(imu_data, comp, fps, save, interval)
+
+    width, height = int(FIG_SIZE[0] * DPI), int(FIG_SIZE[1] * DPI)
+    n = len(imu_data) // interval
+    print('--'*40)
+    print('Saving animation to {} ...'.format(save))
+    with FFmpegWriter(save, width, height, fps, output_args=['-c:v', 'libx264', '-pix_fmt', 'yuv420p']) as writer:
+        for frame in tqdm(render_frames(imu_data, comp, interval), total=n):
+            writer.write(frame)
+
+
+def read_imu(imu_file:str, interval:int) -> pd.DataFrame:
+    """Read imu data, trimmed to a multiple of the interval."""
+    print('Reading imu data from {} ...'.format(imu_file))
+    imu_data = pd.read_csv(imu_file, sep=',')
+    tN = len(imu_data) // interval * interval
+    return imu_data.iloc[:tN]
+
+
 def main(argv=None):
     args = _parse_args(argv)
     imu_file = args.imu_file
@@ -88,11 +178,8 @@ def main(argv=None):
     interval = args.interval
 
     # Read imu data
-    print('Reading imu data from {} ...'.format(imu_file))
-    imu_data = pd.read_csv(imu_file, sep=',')
-    tN = len(imu_data) // interval * interval
-    imu_data = imu_data.iloc[:tN]
-    animate(imu_data, comp, fps, save, interval)
+    imu_data = read_imu(imu_file, interval)
+    animate(imu_data, comp, fps, save, interval, args.renderer)
 
 
 if __name__ == '__main__':
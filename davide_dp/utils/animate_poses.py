@@ -8,11 +8,11 @@ import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 
-import pytransform3d.transformations as pt
 import pytransform3d.trajectories as ptr
-import pytransform3d.camera as pc
 
 from .utils import CameraIntrinsics
+from .ffmpeg_io import FFmpegWriter
+from .raster import LineRasterizer
 
 mpl.rcParams["font.family"] = "serif"
 mpl.rcParams["font.size"] = "22"
@@ -33,27 +33,18 @@ def _parse_args(argv):
     parser.add_argument("--intrinsics_file", type=str, required=True, help='Path to intrinsics file')
     parser.add_argument("--fps", type=int, default=20, help='Frames per second')
     parser.add_argument("--save", type=str, required=True, help='Path to save animation')
+    parser.add_argument("--renderer", type=str, choices=['raster', 'matplotlib'], default='raster',
+                        help='raster: projects the scene in NumPy and draws only what changes. matplotlib: updates persistent 3D artists')
     args = parser.parse_args(argv)
     return args
 
 
-def animate(poses: np.ndarray, intrinsics:CameraIntrinsics, fps:int, factor:int, save:str):
-    """Animate camera poses."""
-    # Create figure
+def setup_axes(poses:np.ndarray):
+    """3D axes of the animation with fixed limits, labels and view."""
     fig = plt.figure(figsize=FIG_SIZE, dpi=DPI)
-    ax = fig.add_subplot(111)
-    # ax.grid(True)
-    cam2world0 = pt.transform_from_pq(poses[0])
-    print('cam2world0: ', cam2world0)
-    ax = pt.plot_transform(A2B=cam2world0,
-                           s=0.3)
-    # ax.xaxis._axinfo['label']['space_factor'] = 4.8
-    # ax.yaxis._axinfo['label']['space_factor'] = 4.8
-    # ax.zaxis._axinfo['label']['space_factor'] = 4.8
-
-    # Get intrinsics matrix
-    intrinsics_matrix = intrinsics.to_matrix()
-    
+    ax = fig.add_subplot(111, projection='3d')
+    ax.grid(True)
+
     # Axis limits
     pos_min = poses[:, :3].min(axis=0)
     pos_max = poses[:, :3].max(axis=0)
@@ -63,28 +54,64 @@ def animate(poses: np.ndarray, intrinsics:CameraIntrinsics, fps:int, factor:int,
     print("min pos y: {:.2f}, max pos y: {:.2f}".format(pos_min[1], pos_max[1]))
     print("min pos z: {:.2f}, max pos z: {:.2f}".format(pos_min[2], pos_max[2]))
 
+    ax.set_xlim((center[0] - max_half_extent, center[0] + max_half_extent))
+    ax.set_ylim((center[1] - max_half_extent, center[1] + max_half_extent))
+    ax.set_zlim((center[2] - max_half_extent, center[2] + max_half_extent))
+    ax.set_xlabel(r'$x$ (m)', labelpad=20)
+    ax.set_ylabel(r'$y$ (m)', labelpad=20)
+    ax.set_zlabel(r'$z$ (m)', labelpad=20)
+    ax.view_init(vertical_axis='x', azim=-135 ) #, elev=30)
+    return fig, ax
+
+
+def camera_lines(M:np.ndarray, cam2world:np.ndarray, virtual_image_distance:float, sensor_size:tuple) -> list:
+    """Polylines of the camera frustum and its top triangle in world coordinates,
+    as drawn by pytransform3d.camera.plot_camera."""
+    camera_center = cam2world[:3, 3]
+    focal_length = np.mean(np.diag(M[:2, :2]))
+    sensor_corners = np.array([[0, 0, focal_length],
+                               [0, sensor_size[1], focal_length],
+                               [sensor_size[0], sensor_size[1], focal_length],
+                               [sensor_size[0], 0, focal_length]], dtype=np.float64)
+    sensor_corners[:, 0] -= M[0, 2]
+    sensor_corners[:, 1] -= M[1, 2]
+    sensor_corners = sensor_corners @ cam2world[:3, :3].T + camera_center
+    corners = virtual_image_distance / focal_length * (sensor_corners - camera_center) + camera_center
+
+    up = corners[0] - corners[1]
+    frustum = np.stack([camera_center, corners[0], corners[1], corners[2], corners[3], corners[0],
+                        camera_center, corners[1], corners[2], camera_center, corners[3]])
+    top = np.stack([corners[0] + 0.1 * up, 0.5 * (corners[0] + corners[3]) + 0.5 * up,
+                    corners[3] + 0.1 * up, corners[0] + 0.1 * up])
+    return [frustum, top]
+
+
+def frame_lines(A2B:np.ndarray, s:float=1.0) -> list:
+    """Segments of the x, y and z axes of a frame, as drawn by pytransform3d."""
+    return [np.stack([A2B[:3, 3], A2B[:3, 3] + s * A2B[:3, d]]) for d in range(3)]
+
+
+def animate_matplotlib(poses:np.ndarray, intrinsics:CameraIntrinsics, fps:int, factor:int, save:str):
+    """Animate camera poses with persistent matplotlib artists."""
+    fig, ax = setup_axes(poses)
+    intrinsics_matrix = intrinsics.to_matrix()
+    cam2worlds = ptr.transforms_from_pqs(poses)
+
+    # Artists are created once and updated in place
+    trajectory = ax.plot([], [], [], color='tab:blue')[0]
+    key_frame = [ax.plot(*line.T, color=color, visible=False)[0]
+                 for line, color in zip(frame_lines(cam2worlds[0]), ['r', 'g', 'b'])]
+    camera = [ax.plot([], [], [], color='tab:orange')[0] for _ in range(2)]
+    title = ax.set_title('', y=-0.1)
+
     # Update function
     def update(i):
-        ax.cla()
-        ax.grid(True)
-        # Plot camera
-        cam2world = pt.transform_from_pq(poses[i])
-        # virtual_distance to pixel units
-
-        pc.plot_camera(ax=ax, M=intrinsics_matrix, cam2world=cam2world,
-                              virtual_image_distance=0.3, sensor_size=IMG_SIZE, color='tab:orange')
-        # Plot trajectory
-        ptr.plot_trajectory(ax=ax, P=poses[:i+1], n_frames=np.minimum(1, i//4), show_direction=False, color='tab:blue')
-
-        ax.set_title(r"Time: {:.2f} s".format(i * factor / FS), y=-0.1)
-
-        ax.set_xlim((center[0] - max_half_extent, center[0] + max_half_extent))
-        ax.set_ylim((center[1] - max_half_extent, center[1] + max_half_extent))
-        ax.set_zlim((center[2] - max_half_extent, center[2] + max_half_extent))
-        ax.set_xlabel(r'$x$ (m)', labelpad=20)
-        ax.set_ylabel(r'$y$ (m)', labelpad=20)
-        ax.set_zlabel(r'$z$ (m)', labelpad=20)
-        ax.view_init(vertical_axis='x', azim=-135 ) #, elev=30)
+        trajectory.set_data_3d(poses[:i+1, 0], poses[:i+1, 1], poses[:i+1, 2])
+        for line in key_frame:
+            line.set_visible(i >= 4)
+        for line, points in zip(camera, camera_lines(intrinsics_matrix, cam2worlds[i], 0.3, IMG_SIZE)):
+            line.set_data_3d(points[:, 0], points[:, 1], points[:, 2])
+        title.set_text(r"Time: {:.2f} s".format(i * factor / FS))
 
     # Save animation
     ani = animation.FuncAnimation(fig, update, frames=len(poses), interval=int(1000/FS), save_count=len(poses))
@@ -97,19 +124,92 @@ def animate(poses: np.ndarray, intrinsics:CameraIntrinsics, fps:int, factor:int,
     pbar.close()
 
 
-def main(argv=None):
-    args = _parse_args(argv)
-    poses_file = args.poses_file
-    fps = args.fps
-    save = args.save
-    intrinsics_file = args.intrinsics_file
+def render_frames(poses:np.ndarray, intrinsics:CameraIntrinsics, factor:int):
+    """
+    Frames of the poses animation as RGB uint8 arrays, equivalent to animate_matplotlib.
+
+    The view is fixed, so the axes are rendered once with matplotlib and the
+    scene is projected with the axes projection matrix in NumPy. The trajectory
+    grows by one segment per frame; only the camera and the title are redrawn.
+    """
+    fig, ax = setup_axes(poses)
+    title = ax.set_title(r"Time: {:.2f} s".format((len(poses) - 1) * factor / FS), y=-0.1)
+    width, height = fig.canvas.get_width_height()
+    fig.canvas.draw()
+
+    # Static background and the band of the title
+    x0, y0, x1, y1 = title.get_window_extent().extents
+    top, bottom = max(int(np.floor(height - y1)) - 2, 0), min(int(np.ceil(height - y0)) + 2, height)
+    title.set_animated(True)
+    title.set_text('')
+    fig.canvas.draw()
+    background = np.asarray(fig.canvas.buffer_rgba())[..., :3].copy()
+    band = fig.canvas.copy_from_bbox(mpl.transforms.Bbox.from_extents(0, height - bottom, width, height - top))
+
+    # World to pixel coordinates (y downwards) with the fixed view
+    proj = ax.get_proj()
+
+    def project(points):
+        xyzw = np.column_stack([points, np.ones(len(points))]) @ proj.T
+        xy = ax.transData.transform(xyzw[:, :2] / xyzw[:, 3:])
+        xy[:, 1] = height - xy[:, 1]
+        return xy
+
+    clip = (0, 0, width, height)
+    linewidth = mpl.rcParams['lines.linewidth'] * DPI / 72
+    rgb = lambda color: np.array(mpl.colors.to_rgb(color)) * 255
+    intrinsics_matrix = intrinsics.to_matrix()
+    cam2worlds = ptr.transforms_from_pqs(poses)
+    path = project(poses[:, :3])
+    key_frame = [project(line) for line in frame_lines(cam2worlds[0])]
+
+    framebuffer = background
+    trajectory = LineRasterizer(background.shape, rgb('tab:blue'), linewidth, clip)
+    for i in range(len(poses)):
+        if i > 0:
+            trajectory.draw(framebuffer, path[i - 1:i], path[i:i + 1])
+        frame = framebuffer.copy()
+        if i >= 4:
+            for line, color in zip(key_frame, ['r', 'g', 'b']):
+                LineRasterizer(frame.shape, rgb(color), linewidth, clip).draw(frame, line[:-1], line[1:])
+        camera = LineRasterizer(frame.shape, rgb('tab:orange'), linewidth, clip)
+        for points in camera_lines(intrinsics_matrix, cam2worlds[i], 0.3, IMG_SIZE):
+            points = project(points)
+            camera.draw(frame, points[:-1], points[1:])
+
+        # Title: pixels changed by the text in the title band
+        fig.canvas.restore_region(band)
+        title.set_text(r"Time: {:.2f} s".format(i * factor / FS))
+        ax.draw_artist(title)
+        text = np.asarray(fig.canvas.buffer_rgba())[top:bottom, :, :3]
+        changed = np.any(text != background[top:bottom], axis=-1)
+        frame[top:bottom][changed] = text[changed]
+        yield frame
+    plt.close(fig)
+
+
+def animate(poses:np.ndarray, intrinsics:CameraIntrinsics, fps:int, factor:int, save:str, renderer:str='raster'):
+    """Animate camera poses."""
+    if renderer == 'matplotlib':
+        return animate_matplotlib(poses, intrinsics, fps, factor, save)
+
+    width, height = int(FIG_SIZE[0] * DPI), int(FIG_SIZE[1] * DPI)
+    print('--'*40)
+    print('Saving animation to {} ...'.format(save))
+    with FFmpegWriter(save, width, height, fps, output_args=['-c:v', 'libx264', '-pix_fmt', 'yuv420p']) as writer:
+        for frame in tqdm(render_frames(poses, intrinsics, factor), total=len(poses)):
+            writer.write(frame)
+
 
+def read_poses(poses_file:str, intrinsics_file:str) -> tuple:
+    """Read camera poses (one per integer frame stamp) and average intrinsics.
+    Returns the poses, the intrinsics and the inverse of the frame-stamp step."""
     # Read camera poses
     print('Reading camera poses from {} ...'.format(poses_file))
     poses = pd.read_csv(poses_file, sep=',')
 
     # Read intrinsics
-    print('Reading intrinsics from {} ...'.format(args.intrinsics_file))
+    print('Reading intrinsics from {} ...'.format(intrinsics_file))
     intrinsics_data = pd.read_csv(intrinsics_file, sep=',')
     
     # set frame-stamp as index
@@ -133,9 +233,15 @@ def main(argv=None):
     # Create camera intrinsics
     intrinsics = CameraIntrinsics(**intrinsics_data)
     intrinsics.average()
+    return poses, intrinsics, factor
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    poses, intrinsics, factor = read_poses(args.poses_file, args.intrinsics_file)
 
     # Animate
-    animate(poses, intrinsics, fps, factor, save)
+    animate(poses, intrinsics, args.fps, factor, args.save, args.renderer)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,113 @@
+import os
+import cv2
+import numpy as np
+
+
+# File extension of each codec. Readers detect the codec from the extension.
+CODECS = {
+    'png': '.png',      # zlib, `level` 0-9 (OpenCV default: 1)
+    'webp': '.webp',    # lossless WebP, 8-bit color images only
+    'tiff': '.tiff',    # `compression`: none (fastest), lzw or deflate
+    'npy': '.npy',      # raw array, memory-mappable
+}
+EXTENSIONS = {extension: codec for codec, extension in CODECS.items()}
+
+# Modalities written by the pipeline (keys of the IMAGE-CODECS config section)
+MODALITIES = ['blur', 'sharp', 'depth', 'confidence', 'mono_depth']
+# Modalities stored as color images (the others are single-channel)
+MODALITIES_COLOR = ['blur', 'sharp']
+
+TIFF_COMPRESSION = {'none': 1, 'lzw': 5, 'deflate': 8}
+
+
+class ImageCodec:
+    """
+    Writer of the frames of one modality. Images are in OpenCV channel order
+    (BGR) for all codecs, so `read_image` returns them as `cv2.imread` would.
+
+    Usage:
+        codec = ImageCodec('png', level=3)
+        path = codec.write('blurry/00000012.png', image)  # -> blurry/00000012.png
+        codec = ImageCodec('npy')
+        path = codec.write('blurry/00000012.png', image)  # -> blurry/00000012.npy
+    """
+
+    def __init__(self, codec:str='png', level:int=None, compression:str='none'):
+        assert codec in CODECS, f"Codec must be one of {list(CODECS)}"
+        assert compression in TIFF_COMPRESSION, f"TIFF compression must be one of {list(TIFF_COMPRESSION)}"
+        self.codec = codec
+        self.extension = CODECS[codec]
+        self.params = []
+        if codec == 'png' and level is not None:
+            assert 0 <= level <= 9, "PNG compression level must be in 0-9"
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, int(level)]
+        elif codec == 'webp':
+            # Quality above 100 selects lossless compression
+            self.params = [cv2.IMWRITE_WEBP_QUALITY, 101]
+        elif codec == 'tiff':
+            self.params = [cv2.IMWRITE_TIFF_COMPRESSION, TIFF_COMPRESSION[compression]]
+
+    def __repr__(self):
+        return 'ImageCodec({}{})'.format(self.codec, ', {}'.format(self.params[1]) if self.params else '')
+
+    def file_name(self, name:str) -> str:
+        """File name of a frame written with this codec (the extension of `name` is replaced)."""
+        return os.path.splitext(name)[0] + self.extension
+
+    def write(self, path:str, image:np.ndarray) -> str:
+        """Write an image and return its path (with the extension of the codec)."""
+        path = self.file_name(path)
+        if self.codec == 'npy':
+            np.save(path, np.ascontiguousarray(image))
+            return path
+        if self.codec == 'webp':
+            # WebP stores single-channel images as color images
+            assert image.dtype == np.uint8 and image.ndim == 3, f"WebP only stores 8-bit color images, got {image.dtype} {image.shape}"
+        if not cv2.imwrite(path, image, self.params):
+            raise RuntimeError('Failed writing {}'.format(path))
+        return path
+
+
+DEFAULT_CODEC = ImageCodec('png')
+
+
+def codec_for(config:dict, modality:str) -> ImageCodec:
+    """Codec of a modality in the IMAGE-CODECS section of the config (png with OpenCV defaults if not set)."""
+    assert modality in MODALITIES, f"Modality must be one of {MODALITIES}"
+    settings = (config.get('IMAGE-CODECS') or {}).get(modality) or {}
+    codec = ImageCodec(settings.get('codec', 'png'), settings.get('level'), settings.get('compression') or 'none')
+    assert modality in MODALITIES_COLOR or codec.codec != 'webp', f"WebP only stores color frames, not {modality}"
+    return codec
+
+
+def is_image(path:str) -> bool:
+    return os.path.splitext(path)[1].lower() in EXTENSIONS
+
+
+def read_image(path:str, flags:int=cv2.IMREAD_UNCHANGED) -> np.ndarray:
+    """
+    Read an image written with any codec. With the default flags images keep
+    their bit depth and channels; other cv2.IMREAD_* flags (COLOR, GRAYSCALE,
+    ANYDEPTH) are also applied to npy frames.
+    """
+    if os.path.splitext(path)[1].lower() != '.npy':
+        image = cv2.imread(path, flags)
+        if image is None:
+            raise FileNotFoundError('Cannot read image {}'.format(path))
+        return image
+    image = np.load(path)
+    if flags == cv2.IMREAD_UNCHANGED:
+        return image
+    if flags & cv2.IMREAD_ANYDEPTH == 0 and image.dtype != np.uint8:
+        image = (image >> 8).astype(np.uint8) if image.dtype == np.uint16 else image.astype(np.uint8)
+    if flags & cv2.IMREAD_COLOR and image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    elif not flags & cv2.IMREAD_COLOR and image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def list_images(folder:str) -> list:
+    """Sorted file names of the frames of a folder, whatever their codec."""
+    return sorted(name for name in os.listdir(folder) if is_image(name))
+
@@ -1,19 +1,26 @@
 import os
 import sys
+import cv2
 import matplotlib as mpl
 import matplotlib.cm as cm
 import numpy as np
 import argparse
+from functools import lru_cache
 from tqdm import tqdm
 
 
-from .utils import imsave, read_depth_16bits
+from .utils import imsave
+from .ffmpeg_io import FFmpegWriter
+from .codecs import list_images, read_image
 
 
 def _parse_args(argv):
     parser = argparse.ArgumentParser(description='Converts depth frames to color')
     parser.add_argument("--input_dir", type=str, required=True, help='Path to depth frames directory')
-    parser.add_argument("--output_dir", type=str, required=True, help='Path to output directory')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output_dir", type=str, help='Path to output directory of colored frames (png)')
+    output.add_argument("--output_video", type=str, help='Path to output video. Frames are piped to ffmpeg')
+    parser.add_argument("--fps", type=int, default=20, help='Frames per second of the output video')
     args = parser.parse_args(argv)
     return args
 
@@ -22,7 +29,7 @@ def get_color_map(depth):
     """Get color map for depth images."""
 
     # Color map
-    cmap = cm.get_cmap('inferno')
+    cmap = mpl.colormaps['inferno']
     depth = depth
     # print("depth range: ", np.min(depth), np.max(depth))
     # Normalize color map
@@ -37,26 +44,48 @@ def get_color_map(depth):
     return rgb
 
 
+@lru_cache(maxsize=1)
+def depth_lut() -> np.ndarray:
+    """Colors of all 16-bit depth values (millimetres), shape (65536, 3) uint8.
+    Entry d equals get_color_map(d / 1000), including 0 (no depth)."""
+    depth = np.arange(65536, dtype=np.float32)[None] / 1000
+    lut = get_color_map(depth)[0]
+    lut.flags.writeable = False
+    return lut
+
+
+def colorize_depth_16bits(depth:np.ndarray) -> np.ndarray:
+    """Color map of a 16-bit depth frame (millimetres, as saved by save_depth_16bits)."""
+    assert depth.dtype == np.uint16, f"Expected uint16 depth, got {depth.dtype}"
+    return depth_lut()[depth]
+
+
 def main(argv=None):
     args = _parse_args(argv)
     input_dir = args.input_dir
-    output_dir = args.output_dir
-
-    # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
 
     # List depth frames
-    depth_frames = os.listdir(input_dir)
-    depth_frames.sort()
+    depth_frames = list_images(input_dir)
 
     # Convert depth frames to color
+    writer = None
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
     for frame in tqdm(depth_frames):
-        # Read depth frame
-        depth = read_depth_16bits(os.path.join(input_dir, frame))
+        # Read depth frame (16 bits, mm)
+        depth = read_image(os.path.join(input_dir, frame), cv2.IMREAD_ANYDEPTH)
         # Get color map
-        rgb = get_color_map(depth)
-        # Save color map
-        imsave(os.path.join(output_dir, frame), rgb)
+        rgb = colorize_depth_16bits(depth)
+        if args.output_dir is not None:
+            # Save color map
+            imsave(os.path.join(args.output_dir, os.path.splitext(frame)[0] + '.png'), rgb)
+            continue
+        if writer is None:
+            writer = FFmpegWriter(args.output_video, rgb.shape[1], rgb.shape[0], args.fps).open()
+        writer.write(rgb)
+    if writer is not None:
+        writer.close()
+        print('Depth video saved to {}'.format(args.output_video))
 
 
 if __name__ == '__main__':
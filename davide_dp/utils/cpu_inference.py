@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import numpy as np
+import torch
+
+
+# Available CPU optimizations for the depth estimation model
+#   none:     eager fp32 model
+#   int8:     dynamic int8 quantization of linear layers
+#   jit:      frozen TorchScript graph (cached on disk)
+#   jit-int8: frozen TorchScript graph of the int8 model (cached on disk)
+#   compile:  torch.compile (inductor kernels cached on disk)
+CPU_OPTIMIZATIONS = ['none', 'int8', 'jit', 'jit-int8', 'compile']
+
+
+def set_num_threads(num_threads:int):
+    """Set explicit intra-op (and inter-op) thread counts. 0 keeps torch defaults."""
+    if not num_threads:
+        return
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Inter-op threads can only be set before any parallel work has started
+        pass
+
+
+class _PredictedDepth(torch.nn.Module):
+    """Wraps a depth estimation model so that it returns the predicted depth tensor only."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values, return_dict=False)[0]
+
+
+class CPUDepthModel:
+    """Depth estimation model optimized for CPU inference.
+
+    Calling the object with preprocessed ``pixel_values`` returns the predicted depth
+    tensor, as ``model(pixel_values).predicted_depth`` does for the eager model.
+    TorchScript graphs are traced once per input shape and cached in ``cache_dir``.
+    """
+
+    def __init__(self, model, optimization:str='none', cache_dir:str=None, tag:str='model'):
+        assert optimization in CPU_OPTIMIZATIONS, f"Optimization must be one of {CPU_OPTIMIZATIONS}"
+        self.optimization = optimization
+        self.cache_dir = cache_dir
+        self.tag = re.sub(r'[^A-Za-z0-9_.-]+', '_', tag)
+        self._graphs = {}
+
+        module = _PredictedDepth(model.eval())
+        if optimization in ['int8', 'jit-int8']:
+            module = torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+        if optimization == 'compile':
+            if cache_dir is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)
+            module = torch.compile(module)
+        self.module = module
+
+    def _graph_path(self, shape):
+        name = '{}_{}_{}_torch{}.pt'.format(self.tag, self.optimization, 'x'.join(str(s) for s in shape), torch.__version__)
+        return os.path.join(self.cache_dir, name)
+
+    def _get_graph(self, pixel_values):
+        shape = tuple(pixel_values.shape)
+        if shape in self._graphs:
+            return self._graphs[shape]
+
+        path = self._graph_path(shape) if self.cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            print('Loading cached TorchScript graph from {} ...'.format(path))
+            graph = torch.jit.load(path)
+        else:
+            print('Tracing TorchScript graph for input shape {} ...'.format(shape))
+            with torch.no_grad():
+                graph = torch.jit.trace(self.module, pixel_values)
+                graph = torch.jit.freeze(graph.eval())
+            if path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                torch.jit.save(graph, path)
+                print('TorchScript graph cached to {}'.format(path))
+        self._graphs[shape] = graph
+        return graph
+
+    def __call__(self, pixel_values):
+        with torch.no_grad():
+            if self.optimization in ['jit', 'jit-int8']:
+                return self._get_graph(pixel_values)(pixel_values)
+            return self.module(pixel_values)
+
+
+def verify_accuracy(reference, optimized, image_processor, images:list, max_deviation:float) -> dict:
+    """Measure depth deviation of an optimized model against the reference model.
+
+    Parameters
+    ----------
+    reference: callable
+        Reference eager model.
+    optimized: CPUDepthModel
+        Optimized model.
+    image_processor: transformers image processor
+        Preprocessor used for both models.
+    images: list
+        Sample of PIL images.
+    max_deviation: float
+        Maximum accepted mean relative deviation of the predicted depth.
+
+    Returns
+    -------
+    dict
+        Mean and max relative deviation, reference and optimized time per frame,
+        and whether the optimized model is accepted.
+    """
+
+    # Warm-up (tracing, compilation or loading of cached graphs)
+    optimized(image_processor(images[0], return_tensors="pt").pixel_values)
+
+    deviations = []
+    time_ref, time_opt = 0.0, 0.0
+    for image in images:
+        pixel_values = image_processor(image, return_tensors="pt").pixel_values
+        with torch.no_grad():
+            t0 = time.perf_counter()
+            depth_ref = reference(pixel_values).predicted_depth
+            t1 = time.perf_counter()
+            depth_opt = optimized(pixel_values)
+            t2 = time.perf_counter()
+        time_ref += t1 - t0
+        time_opt += t2 - t1
+        deviation = torch.mean(torch.abs(depth_opt - depth_ref)) / torch.mean(torch.abs(depth_ref))
+        deviations.append(deviation.item())
+
+    report = {
+        'frames': len(images),
+        'mean_deviation': float(np.mean(deviations)),
+        'max_deviation': float(np.max(deviations)),
+        'reference_s_per_frame': time_ref / len(images),
+        'optimized_s_per_frame': time_opt / len(images),
+    }
+    report['accepted'] = report['max_deviation'] <= max_deviation
+    return report
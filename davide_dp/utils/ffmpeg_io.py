@@ -0,0 +1,74 @@
+import subprocess
+import tempfile
+import numpy as np
+
+
+class FFmpegWriter:
+    """Writes raw frames to a video file through an ffmpeg pipe.
+
+    Frames are uint8 arrays of shape (height, width, 3) for pix_fmt 'rgb24'
+    or (height, width) for 'gray'. The default output matches the sample
+    videos of step 6 (libx264, yuv420p).
+
+    Usage:
+        with FFmpegWriter('out.mp4', width=960, height=720, fps=20) as writer:
+            for frame in frames:
+                writer.write(frame)
+    """
+
+    def __init__(self, path:str, width:int, height:int, fps:float=20, pix_fmt:str='rgb24',
+                 output_args:list=('-c:v', 'libx264', '-crf', '5', '-pix_fmt', 'yuv420p')):
+        self.path = path
+        self.shape = (height, width, 3) if pix_fmt == 'rgb24' else (height, width)
+        self.dtype = np.uint16 if pix_fmt.startswith('gray16') else np.uint8
+        self.command = ['ffmpeg', '-y', '-loglevel', 'error',
+                        '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', '{}x{}'.format(width, height),
+                        '-framerate', str(fps), '-i', 'pipe:',
+                        *output_args, path]
+        self.frames = 0
+        self._stderr = None
+        self._process = None
+
+    def open(self):
+        # stderr goes to a file: a pipe that is not read could block ffmpeg
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stderr=self._stderr)
+        return self
+
+    def write(self, frame:np.ndarray):
+        assert frame.shape == self.shape, f"Frame shape {frame.shape} does not match {self.shape}"
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame, dtype=self.dtype).tobytes())
+        except BrokenPipeError:
+            self.close()
+        self.frames += 1
+
+    def close(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        if not process.stdin.closed:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = process.wait()
+        self._stderr.seek(0)
+        error = self._stderr.read().decode(errors='replace').strip()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError('ffmpeg failed writing {} (exit code {}):\n{}'.format(self.path, returncode, error))
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._process is not None:
+            # Stop ffmpeg without finalizing the video
+            self._process.kill()
+            self._process.wait()
+            self._stderr.close()
+            self._process = None
+        return False
@@ -0,0 +1,27 @@
+def parse_id_list(spec) -> list:
+    """Parse a list of video ids.
+
+    Parameters
+    ----------
+    spec: str or int
+        Single id (``3``), inclusive range (``0-9``) or comma-separated
+        combination of both (``0,2,5-7``).
+
+    Returns
+    -------
+    list
+        Sorted list of unique video ids.
+    """
+
+    ids = set()
+    for item in str(spec).split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            start, end = item.split('-', 1)
+            ids.update(range(int(start), int(end) + 1))
+        else:
+            ids.add(int(item))
+    assert ids, 'No video ids found in {}'.format(spec)
+    return sorted(ids)
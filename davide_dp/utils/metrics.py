@@ -0,0 +1,152 @@
+import os
+import time
+import socket
+import resource
+
+from .progress_db import record_step_metrics
+from . import tracing
+
+
+def directory_size(paths, since:float=None) -> int:
+    """Total size in bytes of all files below the given paths.
+    If `since` is given, only files modified after that time are counted."""
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in names)
+    total = 0
+    for file in files:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+        if since is None or stat.st_mtime >= since:
+            total += stat.st_size
+    return total
+
+
+def count_files(path:str) -> int:
+    """Number of files in a directory (0 if it does not exist)."""
+    if not os.path.isdir(path):
+        return 0
+    return len(os.listdir(path))
+
+
+def _children_rss_mb() -> float:
+    """Lifetime peak resident set size of the finished children in MB."""
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def _self_rss_mb() -> float:
+    """Peak resident set size of this process in MB: VmHWM on Linux, the lifetime ru_maxrss elsewhere."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss() -> float:
+    """
+    Start measuring the peak RSS of a run. On Linux the peak of this process
+    (VmHWM) is reset to its current RSS through /proc/self/clear_refs. Returns
+    the peak of the children finished so far, to pass to peak_rss_mb.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+    return _children_rss_mb()
+
+
+def peak_rss_mb(children_before:float=None) -> float:
+    """
+    Peak resident set size in MB of this process since reset_peak_rss, and of
+    its children finished since then. The peak of the children cannot be reset:
+    it is only counted when it exceeds `children_before`, the value returned by
+    reset_peak_rss. Without /proc (or the reset), the peak of this process is
+    its lifetime maximum, which includes earlier runs in the same process.
+    """
+    children_rss = _children_rss_mb()
+    if children_before is not None and children_rss <= children_before:
+        children_rss = 0
+    return max(_self_rss_mb(), children_rss)
+
+
+def cpu_time() -> float:
+    """User and system CPU time of this process and its finished children in seconds."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (all CPUs where the affinity is not available)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class StepMetrics:
+    """Records start and end events with performance metrics of a step run.
+
+    Usage:
+        with StepMetrics(video_name, 'step_3', db_path, output_dirs=[blurry_dir, sharp_dir]) as metrics:
+            ...
+            metrics.frames_in += 1
+            metrics.frames_out += 2
+
+    Wall time, CPU time, peak RSS of the run and bytes written to ``output_dirs`` (files or
+    folders modified during the run) are measured automatically. The end event has
+    status 1 if the block finished without errors and 0 otherwise. If DAVIDE_TRACE
+    is set, the spans of the run are written to a Chrome trace file (see
+    utils/tracing.py).
+    """
+
+    def __init__(self, video_name:str, dp_step:str, db_path:str, output_dirs=()):
+        self.video_name = video_name
+        self.dp_step = dp_step
+        self.db_path = db_path
+        self.output_dirs = [output_dirs] if isinstance(output_dirs, str) else list(output_dirs)
+        self.frames_in = 0
+        self.frames_out = 0
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+
+    def __enter__(self):
+        self._trace = tracing.start_run(self.video_name, self.dp_step)
+        self._span = tracing.span(self.dp_step, cat='step', video=self.video_name).__enter__()
+        record_step_metrics(self.video_name, self.dp_step, 'start', self.db_path, host=self.host, pid=self.pid)
+        self._start = time.time()
+        self._cpu0 = cpu_time()
+        # Peak RSS of this run only, not of earlier runs in the same process
+        self._children_rss0 = reset_peak_rss()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        metrics = {
+            'wall_time': time.perf_counter() - self._t0,
+            'cpu_time': cpu_time() - self._cpu0,
+            'peak_rss_mb': peak_rss_mb(self._children_rss0),
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            # Whole seconds, as some file systems store coarse modification times
+            'bytes_written': directory_size(self.output_dirs, since=int(self._start)),
+        }
+        record_step_metrics(self.video_name, self.dp_step, 'end', self.db_path,
+                            status=int(exc_type is None), host=self.host, pid=self.pid, **metrics)
+        print('{} metrics for {}: {:.1f} s wall, {:.1f} s CPU, {:.0f} MB peak RSS, {} frames in, {} frames out, {:.1f} MB written'.format(
+            self.dp_step, self.video_name, metrics['wall_time'], metrics['cpu_time'], metrics['peak_rss_mb'],
+            metrics['frames_in'], metrics['frames_out'], metrics['bytes_written'] / 2**20))
+        self._span.__exit__(exc_type, exc_value, traceback)
+        tracing.finish_run(self._trace)
+        return False
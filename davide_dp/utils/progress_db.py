@@ -1,17 +1,101 @@
 import sqlite3
 import os
+import time
+import random
+
+from . import tracing
 
 NUMBER_OF_STEPS = 8
 DP_STEPS = [f'step_{i}' for i in range(1, NUMBER_OF_STEPS + 1)]
 
+# Steps that must be complete before running each step.
+# Step 8 also requires step 7 when monocular depth is exported.
+STEP_DEPENDENCIES = {
+    'step_1': [],
+    'step_2': ['step_1'],
+    'step_3': ['step_2'],
+    'step_4': ['step_1'],
+    'step_5': ['step_1'],
+    'step_6': ['step_1', 'step_2', 'step_3', 'step_4', 'step_5'],
+    'step_7': ['step_3'],
+    'step_8': ['step_1', 'step_2', 'step_3', 'step_4', 'step_5'],
+}
+
+EVENTS_TABLE = 'DAVIDE_DataSynthesis_events'
+SUMMARY_TABLE = 'DAVIDE_DataSynthesis_summary'
+METRICS_TABLE = 'DAVIDE_DataSynthesis_metrics'
+METRICS_FIELDS = ['wall_time', 'cpu_time', 'peak_rss_mb', 'frames_in', 'frames_out', 'bytes_written']
+QUEUE_TABLE = 'DAVIDE_DataSynthesis_queue'
+QUEUE_STATES = ['pending', 'running', 'done', 'failed']
+EVICTIONS_TABLE = 'DAVIDE_DataSynthesis_evictions'
+
+# Concurrency settings. Many SLURM array tasks write to the same database file,
+# so every transaction waits for the lock (busy timeout) and is retried with
+# exponential backoff if the database is still locked.
+BUSY_TIMEOUT = 30.0
+MAX_RETRIES = 8
+BACKOFF_BASE = 0.05
+BACKOFF_MAX = 5.0
+# WAL allows readers to proceed while a writer commits. Set DAVIDE_DP_JOURNAL_MODE=DELETE
+# if the database lives on a file system without shared-memory support (e.g. NFS).
+JOURNAL_MODE = os.environ.get('DAVIDE_DP_JOURNAL_MODE', 'WAL')
+
+
+def connect_db(db_path):
+    """Open a connection in autocommit mode with busy timeout."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+    return conn
+
+
+def _is_locked(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def run_transaction(db_path, func, write=True):
+    """
+    Run `func(cursor)` inside a single transaction and return its result.
+    Write transactions take the database lock up front (BEGIN IMMEDIATE). If the
+    database is locked, the whole transaction is retried with exponential backoff.
+    """
+    delay = BACKOFF_BASE
+    for attempt in range(MAX_RETRIES):
+        conn = connect_db(db_path)
+        try:
+            with tracing.span('db_write' if write else 'db_read', cat='db', attempt=attempt):
+                conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+                result = func(conn.cursor())
+                conn.execute('COMMIT')
+            return result
+        except sqlite3.OperationalError as error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if not _is_locked(error) or attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(delay * (1.0 + random.random()))
+            delay = min(2 * delay, BACKOFF_MAX)
+        finally:
+            conn.close()
+
+
+def step_dependencies(dp_step, mono_depth=False) -> list:
+    """Return the steps that must be complete before running `dp_step`."""
+    assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+    dependencies = list(STEP_DEPENDENCIES[dp_step])
+    if dp_step == 'step_8' and mono_depth:
+        dependencies.append('step_7')
+    return dependencies
+
 
 def create_tables(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cursor = conn.cursor()
-    
+    cursor.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+
     # Table 1: event / history of changes
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS DAVIDE_DataSynthesis_events (
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         video_name TEXT NOT NULL,
         step INTEGER NOT NULL,
@@ -19,20 +103,98 @@ def create_tables(db_path):
         changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
-    
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_events_video_step_status
+        ON {EVENTS_TABLE} (video_name, step, status)
+    """)
+
     # Table 2: summary of each video's current status
     table = f"""
-    CREATE TABLE IF NOT EXISTS DAVIDE_DataSynthesis_summary (
+    CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
         video_name TEXT PRIMARY KEY
     """
     for step in DP_STEPS:
         table += f", {step} INTEGER DEFAULT 0"
     table += ")"
     cursor.execute(table)
-    conn.commit()
+
+    # Table 3: performance metrics of each step run
+    _create_metrics_table(cursor)
+
+    # Table 4: work queue of (video, step) tasks
+    _create_queue_table(cursor)
+
+    # Table 5: intermediates evicted by the disk budget
+    _create_evictions_table(cursor)
     conn.close()
 
 
+def _create_metrics_table(cursor):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {METRICS_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        video_name TEXT NOT NULL,
+        step TEXT NOT NULL,
+        event TEXT NOT NULL,
+        status INTEGER,
+        wall_time REAL,
+        cpu_time REAL,
+        peak_rss_mb REAL,
+        frames_in INTEGER,
+        frames_out INTEGER,
+        bytes_written INTEGER,
+        host TEXT,
+        pid INTEGER,
+        recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_metrics_step_video
+        ON {METRICS_TABLE} (step, video_name)
+    """)
+
+
+def _create_queue_table(cursor):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        video_name TEXT NOT NULL,
+        clip_id INTEGER NOT NULL,
+        step TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        worker TEXT,
+        lease_expires REAL,
+        last_error TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (video_name, step)
+    )
+    """)
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_queue_state_step
+        ON {QUEUE_TABLE} (state, step)
+    """)
+
+
+def _create_evictions_table(cursor):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {EVICTIONS_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        video_name TEXT NOT NULL,
+        artifact TEXT NOT NULL,
+        bytes INTEGER,
+        archive TEXT,
+        evicted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        restored_at TIMESTAMP
+    )
+    """)
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_evictions_video_artifact
+        ON {EVICTIONS_TABLE} (video_name, artifact)
+    """)
+
+
 def initialize_summary_from_raw_list(raw_list:list, db_path:str):
     """
     Read a list of video names (one per line) from `file_path`.
@@ -42,20 +204,50 @@ def initialize_summary_from_raw_list(raw_list:list, db_path:str):
     assert isinstance(raw_list, list), "raw_list must be a list of video names."
     assert isinstance(db_path, str), "db_path must be a string."
     assert os.path.exists(db_path), f"Database path {db_path} does not exist."
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
 
-    for video_name in raw_list:            
+    def insert(cursor):
         # Insert a row if not existing. By using INSERT OR IGNORE,
         # we won't overwrite existing rows.
-        cursor.execute("""
-            INSERT OR IGNORE INTO DAVIDE_DataSynthesis_summary (
+        cursor.executemany(f"""
+            INSERT OR IGNORE INTO {SUMMARY_TABLE} (
                 video_name
             ) VALUES (?)
-        """, (video_name,))
-    
-    conn.commit()
-    conn.close()
+        """, [(video_name,) for video_name in raw_list])
+
+    run_transaction(db_path, insert)
+
+
+def _insert_event(cursor, video_name, dp_step, new_status):
+    cursor.execute(f"""
+        INSERT INTO {EVENTS_TABLE} (video_name, step, status)
+        VALUES (?, ?, ?)
+    """, (video_name, dp_step, new_status))
+
+
+def _update_summary(cursor, video_name, steps=DP_STEPS):
+    # Create summary row if missing
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO {SUMMARY_TABLE} (video_name)
+        VALUES (?)
+    """, (video_name,))
+
+    # A step is complete if there is *any* event for it with status=1.
+    # One indexed query for all steps of the video.
+    cursor.execute(f"""
+        SELECT step, MAX(status = 1)
+          FROM {EVENTS_TABLE}
+         WHERE video_name = ?
+         GROUP BY step
+    """, (video_name,))
+    completed = {step: bool(done) for step, done in cursor.fetchall()}
+
+    assignments = ', '.join(f"{step} = ?" for step in steps)
+    values = [1 if completed.get(step, False) else 0 for step in steps]
+    cursor.execute(f"""
+        UPDATE {SUMMARY_TABLE}
+           SET {assignments}
+         WHERE video_name = ?
+    """, (*values, video_name))
 
 
 def log_step_event(video_name, dp_step, new_status, db_path):
@@ -63,17 +255,7 @@ def log_step_event(video_name, dp_step, new_status, db_path):
     Log a new event that step_number (and optionally substep_id) for a video
     has changed to new_status (0 or 1).
     """
-    import sqlite3
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO DAVIDE_DataSynthesis_events (video_name, step, status)
-        VALUES (?, ?, ?)
-    """, (video_name, dp_step, new_status))
-    
-    conn.commit()
-    conn.close()
+    run_transaction(db_path, lambda cursor: _insert_event(cursor, video_name, dp_step, new_status))
 
 
 def update_summary_for_video(video_name, db_path):
@@ -81,39 +263,69 @@ def update_summary_for_video(video_name, db_path):
     Recompute the current status of steps 1..8 for the given video
     by looking at the latest events in DAVIDE_DataSynthesis_events.
     """
-    import sqlite3
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # 1. Check if we have a row in summary. If not, create one.
-    cursor.execute("""
-        INSERT OR IGNORE INTO DAVIDE_DataSynthesis_summary (video_name)
-        VALUES (?)
-    """, (video_name,))
-    
-    # For each step, we can look at the latest event or just see if there's any event with status=1.
-    # EXACT logic depends on your use-case. We'll do a simplified approach:
-    for step in DP_STEPS:
-        # Check if there's *any* event for this step with status=1
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM DAVIDE_DataSynthesis_events
-            WHERE video_name = ? AND step = ? AND status = 1
-        """, (video_name, step))
-        
-        count = cursor.fetchone()[0]
-        # If there's at least one record with status=1, we consider the step "complete"
-        step_complete = 1 if count > 0 else 0
-        
-        # Update the summary
+    run_transaction(db_path, lambda cursor: _update_summary(cursor, video_name))
+
+
+def record_step_event(video_name, dp_step, new_status, db_path):
+    """
+    Log a new step event and update the summary of the video in a single transaction.
+    """
+    assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+
+    def record(cursor):
+        _insert_event(cursor, video_name, dp_step, new_status)
+        _update_summary(cursor, video_name, steps=[dp_step])
+
+    run_transaction(db_path, record)
+
+
+def record_step_metrics(video_name, dp_step, event, db_path, status=None, host=None, pid=None, **metrics):
+    """
+    Record a 'start' or 'end' event of a step run with its performance metrics
+    (see METRICS_FIELDS) in the metrics table.
+    """
+    assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+    assert event in ['start', 'end'], "Event must be either 'start' or 'end'."
+    for field in metrics:
+        assert field in METRICS_FIELDS, f"Metric must be one of {METRICS_FIELDS}"
+    columns = ['video_name', 'step', 'event', 'status', 'host', 'pid'] + list(metrics)
+    values = [video_name, dp_step, event, status, host, pid] + list(metrics.values())
+
+    def record(cursor):
+        # Logs created before the metrics table existed get it on first use
+        _create_metrics_table(cursor)
         cursor.execute(f"""
-            UPDATE DAVIDE_DataSynthesis_summary
-               SET {step} = ?
-             WHERE video_name = ?
-        """, (step_complete, video_name))
-    
-    conn.commit()
-    conn.close()
+            INSERT INTO {METRICS_TABLE} ({', '.join(columns)})
+            VALUES ({', '.join('?' for _ in columns)})
+        """, values)
+
+    run_transaction(db_path, record)
+
+
+def get_step_status(db_path, videos=None, steps=None) -> dict:
+    """
+    Bulk query of the summary table.
+    Returns a dictionary {video_name: {step: bool}} for the requested videos
+    (all videos by default) and steps (all steps by default). Videos without
+    a row in the summary table are omitted.
+    """
+    steps = DP_STEPS if steps is None else list(steps)
+    for step in steps:
+        assert step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+    if isinstance(videos, str):
+        videos = [videos]
+
+    def query(cursor):
+        cursor.execute(f"SELECT video_name, {', '.join(steps)} FROM {SUMMARY_TABLE}")
+        return cursor.fetchall()
+
+    rows = run_transaction(db_path, query, write=False)
+    wanted = None if videos is None else set(videos)
+    status = {}
+    for video_name, *values in rows:
+        if wanted is None or video_name in wanted:
+            status[video_name] = {step: bool(value) for step, value in zip(steps, values)}
+    return status
 
 
 def is_step_complete(dp_step, db_path, videos):
@@ -122,33 +334,233 @@ def is_step_complete(dp_step, db_path, videos):
     in the summary table for the given video_name. Otherwise, returns False.
     """
     assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
 
     if isinstance(videos, str):
         videos = [videos]
+    status = get_step_status(db_path, videos=videos, steps=[dp_step])
+
     results = []
-    
     for video in videos:
-        query = f"""
-            SELECT {dp_step}
-            FROM DAVIDE_DataSynthesis_summary
-            WHERE video_name = ?
-        """
-        cursor.execute(query, (video,))
-        row = cursor.fetchone()
-        
         # If no row is found for this video, return False (not in table).
-        if row is None:
+        if video not in status:
             print(f"No row found for video {video}.")
             return False
-        
-        # row is a tuple like (step_value,)
-        step_value = row[0]
+
+        step_value = status[video][dp_step]
         if not step_value:
             print(f"Step {dp_step} is not complete for video {video}.")
-        results.append(bool(step_value))
-    
-    conn.close()
+        results.append(step_value)
+
     return all(results)
+
+
+def populate_queue(tasks:list, db_path:str, max_attempts:int=3, retry_failed:bool=False) -> int:
+    """
+    Add (video_name, clip_id, dp_step) tasks to the work queue. Tasks already in
+    the queue are kept; tasks whose step is complete in the summary table are
+    marked as done. If `retry_failed`, failed tasks are reset to pending.
+    Returns the number of pending tasks.
+    """
+    for _, _, dp_step in tasks:
+        assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+
+    def populate(cursor):
+        _create_queue_table(cursor)
+        cursor.executemany(f"""
+            INSERT OR IGNORE INTO {QUEUE_TABLE} (video_name, clip_id, step, max_attempts)
+            VALUES (?, ?, ?, ?)
+        """, [(video_name, clip_id, dp_step, max_attempts) for video_name, clip_id, dp_step in tasks])
+        for dp_step in DP_STEPS:
+            cursor.execute(f"""
+                UPDATE {QUEUE_TABLE}
+                   SET state = 'done', updated_at = CURRENT_TIMESTAMP
+                 WHERE step = ? AND state != 'done'
+                   AND video_name IN (SELECT video_name FROM {SUMMARY_TABLE} WHERE {dp_step} = 1)
+            """, (dp_step,))
+        if retry_failed:
+            cursor.execute(f"""
+                UPDATE {QUEUE_TABLE}
+                   SET state = 'pending', attempts = 0, max_attempts = ?, updated_at = CURRENT_TIMESTAMP
+                 WHERE state = 'failed'
+            """, (max_attempts,))
+        cursor.execute(f"SELECT COUNT(*) FROM {QUEUE_TABLE} WHERE state = 'pending'")
+        return cursor.fetchone()[0]
+
+    return run_transaction(db_path, populate)
+
+
+def _expire_leases(cursor, now):
+    # Tasks of workers that stopped renewing their lease go back to the queue,
+    # or fail if they used all their attempts.
+    cursor.execute(f"""
+        UPDATE {QUEUE_TABLE}
+           SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+               last_error = 'lease of ' || worker || ' expired',
+               worker = NULL, lease_expires = NULL, updated_at = CURRENT_TIMESTAMP
+         WHERE state = 'running' AND lease_expires < ?
+    """, (now,))
+
+
+def _select_ready(cursor, steps, mono_depth, limit=1):
+    # Pending tasks whose dependencies are complete in the summary table.
+    # Earlier steps first, as they unlock more work.
+    conditions = []
+    for dp_step in steps:
+        assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+        condition = f"q.step = '{dp_step}'"
+        for dep in step_dependencies(dp_step, mono_depth):
+            condition += f" AND s.{dep} = 1"
+        conditions.append(f"({condition})")
+    cursor.execute(f"""
+        SELECT q.id, q.video_name, q.clip_id, q.step, q.attempts
+          FROM {QUEUE_TABLE} q
+          JOIN {SUMMARY_TABLE} s ON s.video_name = q.video_name
+         WHERE q.state = 'pending' AND ({' OR '.join(conditions)})
+         ORDER BY q.step, q.clip_id
+         LIMIT ?
+    """, (limit,))
+    return cursor.fetchall()
+
+
+def claim_task(db_path, worker:str, lease_s:float, steps=DP_STEPS, mono_depth=False):
+    """
+    Atomically claim the next pending task of the given steps whose dependencies
+    are complete. The task is leased to `worker` for `lease_s` seconds.
+    Returns a dictionary with the task (id, video_name, clip_id, step, attempt)
+    or None if no task is ready.
+    """
+    def claim(cursor):
+        now = time.time()
+        _expire_leases(cursor, now)
+        rows = _select_ready(cursor, steps, mono_depth)
+        if not rows:
+            return None
+        task_id, video_name, clip_id, dp_step, attempts = rows[0]
+        cursor.execute(f"""
+            UPDATE {QUEUE_TABLE}
+               SET state = 'running', attempts = attempts + 1, worker = ?,
+                   lease_expires = ?, updated_at = CURRENT_TIMESTAMP
+             WHERE id = ?
+        """, (worker, now + lease_s, task_id))
+        return {'id': task_id, 'video_name': video_name, 'clip_id': clip_id, 'step': dp_step, 'attempt': attempts + 1}
+
+    return run_transaction(db_path, claim)
+
+
+def renew_lease(db_path, task_id:int, worker:str, lease_s:float) -> bool:
+    """Extend the lease of a running task. Returns False if the worker lost the lease."""
+    def renew(cursor):
+        cursor.execute(f"""
+            UPDATE {QUEUE_TABLE}
+               SET lease_expires = ?
+             WHERE id = ? AND worker = ? AND state = 'running'
+        """, (time.time() + lease_s, task_id, worker))
+        return cursor.rowcount == 1
+
+    return run_transaction(db_path, renew)
+
+
+def finish_task(db_path, task_id:int, worker:str, success:bool, error:str=None) -> str:
+    """
+    Release a running task as done, or as failed. Failed tasks go back to pending
+    until they used all their attempts. Returns the new state of the task.
+    """
+    def finish(cursor):
+        cursor.execute(f"""
+            UPDATE {QUEUE_TABLE}
+               SET state = CASE WHEN ? THEN 'done'
+                                WHEN attempts >= max_attempts THEN 'failed'
+                                ELSE 'pending' END,
+                   last_error = ?, worker = NULL, lease_expires = NULL, updated_at = CURRENT_TIMESTAMP
+             WHERE id = ? AND worker = ?
+        """, (int(success), error, task_id, worker))
+        cursor.execute(f"SELECT state FROM {QUEUE_TABLE} WHERE id = ?", (task_id,))
+        return cursor.fetchone()[0]
+
+    return run_transaction(db_path, finish)
+
+
+def get_queue_status(db_path, steps=DP_STEPS, mono_depth=False) -> dict:
+    """
+    Number of tasks of each step in each state of the work queue, and number of
+    pending tasks that are ready to run: {step: {state: count, 'ready': count}}.
+    """
+    def query(cursor):
+        cursor.execute(f"SELECT step, state, COUNT(*) FROM {QUEUE_TABLE} GROUP BY step, state")
+        counts = cursor.fetchall()
+        ready = _select_ready(cursor, steps, mono_depth, limit=-1)
+        return counts, ready
+
+    counts, ready = run_transaction(db_path, query, write=False)
+    status = {}
+    for dp_step, state, count in counts:
+        status.setdefault(dp_step, {s: 0 for s in QUEUE_STATES + ['ready']})[state] = count
+    for _, _, _, dp_step, _ in ready:
+        status[dp_step]['ready'] += 1
+    return status
+
+
+def get_step_output_bytes(db_path, steps=DP_STEPS) -> dict:
+    """Median bytes written by the successful runs of each step: {step: bytes}. Steps without runs are omitted."""
+    def query(cursor):
+        _create_metrics_table(cursor)
+        cursor.execute(f"""
+            SELECT step, bytes_written FROM {METRICS_TABLE}
+             WHERE event = 'end' AND status = 1 AND bytes_written IS NOT NULL
+        """)
+        return cursor.fetchall()
+
+    sizes = {}
+    for dp_step, size in run_transaction(db_path, query):
+        sizes.setdefault(dp_step, []).append(size)
+    return {dp_step: sorted(values)[len(values) // 2] for dp_step, values in sizes.items() if dp_step in steps}
+
+
+def record_eviction(video_name, artifact:str, size:int, archive:str, db_path):
+    """Record that an intermediate of a video was removed (and archived, if `archive` is not None)."""
+    def record(cursor):
+        # Logs created before the evictions table existed get it on first use
+        _create_evictions_table(cursor)
+        cursor.execute(f"""
+            INSERT INTO {EVICTIONS_TABLE} (video_name, artifact, bytes, archive)
+            VALUES (?, ?, ?, ?)
+        """, (video_name, artifact, size, archive))
+
+    run_transaction(db_path, record)
+
+
+def record_restore(video_name, artifact:str, db_path):
+    """Mark the evictions of an intermediate of a video as restored."""
+    def record(cursor):
+        _create_evictions_table(cursor)
+        cursor.execute(f"""
+            UPDATE {EVICTIONS_TABLE}
+               SET restored_at = CURRENT_TIMESTAMP
+             WHERE video_name = ? AND artifact = ? AND restored_at IS NULL
+        """, (video_name, artifact))
+
+    run_transaction(db_path, record)
+
+
+def get_evictions(db_path, videos=None) -> dict:
+    """
+    Intermediates that are currently evicted: {video_name: {artifact: {'bytes', 'archive', 'evicted_at'}}}
+    for the requested videos (all videos by default).
+    """
+    if isinstance(videos, str):
+        videos = [videos]
+
+    def query(cursor):
+        _create_evictions_table(cursor)
+        cursor.execute(f"""
+            SELECT video_name, artifact, bytes, archive, evicted_at FROM {EVICTIONS_TABLE}
+             WHERE restored_at IS NULL ORDER BY id
+        """)
+        return cursor.fetchall()
+
+    wanted = None if videos is None else set(videos)
+    evictions = {}
+    for video_name, artifact, size, archive, evicted_at in run_transaction(db_path, query):
+        if wanted is None or video_name in wanted:
+            evictions.setdefault(video_name, {})[artifact] = {'bytes': size, 'archive': archive, 'evicted_at': evicted_at}
+    return evictions
@@ -0,0 +1,29 @@
+import numpy as np
+
+
+def pyramid_levels(config:dict) -> list:
+    """Downscale factors of the resolution pyramid written by steps 3 and 4 (RESOLUTION-PYRAMID.levels)."""
+    levels = list((config.get('RESOLUTION-PYRAMID') or {}).get('levels') or [])
+    for level in levels:
+        assert int(level) == level and level > 1, f"Pyramid levels must be integer downscale factors > 1, got {level}"
+    return sorted(set(int(level) for level in levels))
+
+
+def level_folder(folder:str, level:int) -> str:
+    """Folder of the frames of a pyramid level: <folder>_x<level>, or the folder itself for level 1."""
+    return folder if level == 1 else '{}_x{}'.format(folder, level)
+
+
+def subsample(image:np.ndarray, level:int) -> np.ndarray:
+    """
+    Downscale a map by `level` keeping the center pixel of each block. Used for
+    depth and confidence, where averaging would mix depths across edges.
+    """
+    H, W = image.shape[:2]
+    offset = level // 2
+    return np.ascontiguousarray(image[offset::level, offset::level][:H // level, :W // level])
+
+
+def scale_intrinsics(fx, fy, cx, cy, level:int):
+    """Intrinsics of the frames of a pyramid level (pixel centers at integer coordinates)."""
+    return fx / level, fy / level, (cx + 0.5) / level - 0.5, (cy + 0.5) / level - 0.5
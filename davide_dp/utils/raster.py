@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def segment_coverage(p0:np.ndarray, p1:np.ndarray, linewidth:float, clip:tuple) -> tuple:
+    """
+    Antialiased coverage of thick line segments on a pixel grid.
+
+    Parameters
+    ----------
+    p0, p1 : np.ndarray
+        Start and end points of the segments, shape (N, 2), in pixel coordinates
+        (x to the right, y downwards, pixel (r, c) centred at (c + 0.5, r + 0.5)).
+    linewidth : float
+        Line width in pixels.
+    clip : tuple
+        Clip box (x0, y0, x1, y1) in pixel coordinates, e.g. the axes of a plot.
+        It must lie within the image (x0, y0 >= 0).
+
+    Returns
+    -------
+    tuple
+        Rows, columns and coverage in (0, 1] of the covered pixels. Pixels covered
+        by several segments are returned once with their maximum coverage.
+    """
+    p0 = np.asarray(p0, dtype=np.float64).reshape(-1, 2)
+    p1 = np.asarray(p1, dtype=np.float64).reshape(-1, 2)
+    if len(p0) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    radius = linewidth / 2
+    reach = int(np.ceil(radius + 1))
+
+    # Sample points every half pixel along each segment
+    delta = p1 - p0
+    samples = np.ceil(np.hypot(delta[:, 0], delta[:, 1]) / 0.5).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(p0)), samples)
+    t = (np.arange(len(seg)) - np.repeat(np.cumsum(samples) - samples, samples)) / np.maximum(samples[seg] - 1, 1)
+    points = p0[seg] + t[:, None] * delta[seg]
+
+    # Candidate pixels around the sample points, deduplicated per segment
+    offsets = np.arange(-reach, reach + 1)
+    cols = (np.floor(points[:, 0]).astype(np.int64)[:, None, None] + offsets[None, None, :]).repeat(len(offsets), axis=1)
+    rows = (np.floor(points[:, 1]).astype(np.int64)[:, None, None] + offsets[None, :, None]).repeat(len(offsets), axis=2)
+    seg = np.broadcast_to(seg[:, None, None], rows.shape).ravel()
+    rows, cols = rows.ravel(), cols.ravel()
+    x0, y0, x1, y1 = clip
+    inside = (cols + 0.5 >= x0) & (cols + 0.5 <= x1) & (rows + 0.5 >= y0) & (rows + 0.5 <= y1)
+    rows, cols, seg = rows[inside], cols[inside], seg[inside]
+    width, height = int(np.ceil(x1)) + 1, int(np.ceil(y1)) + 1
+    seg, rest = np.divmod(np.unique((seg * height + rows) * width + cols), height * width)
+    rows, cols = np.divmod(rest, width)
+
+    # Distance from the pixel centres to the segments
+    centres = np.stack([cols + 0.5, rows + 0.5], axis=-1)
+    d = delta[seg]
+    length2 = np.maximum(np.sum(d * d, axis=-1), 1e-12)
+    t = np.clip(np.sum((centres - p0[seg]) * d, axis=-1) / length2, 0, 1)
+    distance = np.linalg.norm(centres - (p0[seg] + t[:, None] * d), axis=-1)
+    alpha = np.clip(radius + 0.5 - distance, 0, 1)
+    covered = alpha > 0
+    rows, cols, alpha = rows[covered], cols[covered], alpha[covered]
+
+    # Maximum coverage per pixel
+    flat = rows * width + cols
+    order = np.lexsort((alpha, flat))
+    flat, alpha = flat[order], alpha[order]
+    last = np.r_[flat[1:] != flat[:-1], True]
+    rows, cols = np.divmod(flat[last], width)
+    return rows, cols, alpha[last]
+
+
+class LineRasterizer:
+    """
+    Draws a growing polyline onto an RGB framebuffer.
+
+    Segments can be added in batches (e.g. one batch per animation frame). The
+    coverage already drawn by the line is kept, so pixels shared by consecutive
+    batches (joints) are not blended twice and the result matches drawing the
+    whole polyline at once.
+    """
+
+    def __init__(self, shape:tuple, color:tuple, linewidth:float, clip:tuple):
+        self.color = np.asarray(color, dtype=np.float32)
+        self.linewidth = linewidth
+        x0, y0, x1, y1 = clip
+        self.clip = (max(x0, 0), max(y0, 0), min(x1, shape[1]), min(y1, shape[0]))
+        self.coverage = np.zeros(shape[:2], dtype=np.float32)
+
+    def draw(self, framebuffer:np.ndarray, p0:np.ndarray, p1:np.ndarray):
+        """Blend the segments p0[i] -> p1[i] into framebuffer (uint8, HxWx3) in place."""
+        rows, cols, alpha = segment_coverage(p0, p1, self.linewidth, self.clip)
+        alpha = alpha.astype(np.float32)
+        old = self.coverage[rows, cols]
+        new = np.maximum(alpha, old)
+        grow = new > old
+        rows, cols, old, new = rows[grow], cols[grow], old[grow], new[grow]
+        # Blend the missing coverage: (1 - old) * (1 - a) = 1 - new
+        a = ((new - old) / np.maximum(1 - old, 1e-6))[:, None]
+        pixels = framebuffer[rows, cols].astype(np.float32)
+        framebuffer[rows, cols] = np.rint(pixels * (1 - a) + self.color * a).astype(np.uint8)
+        self.coverage[rows, cols] = new
+
+
+def composite(framebuffer:np.ndarray, overlay:np.ndarray, offset:tuple=(0, 0)) -> np.ndarray:
+    """Alpha-composite a straight-alpha RGBA overlay (uint8) onto an RGB frame at offset (row, col). Returns a new frame."""
+    frame = framebuffer.copy()
+    r, c = offset
+    h, w = overlay.shape[:2]
+    alpha = overlay[..., 3:].astype(np.float32) / 255
+    region = frame[r:r + h, c:c + w].astype(np.float32)
+    frame[r:r + h, c:c + w] = np.rint(overlay[..., :3] * alpha + region * (1 - alpha)).astype(np.uint8)
+    return frame
@@ -0,0 +1,185 @@
+import os
+import glob
+import json
+import time
+import threading
+
+
+# Directory of the trace files. Tracing is off if the variable is not set (or empty)
+TRACE_ENV = 'DAVIDE_TRACE'
+# Trace file of the running step, inherited by worker processes (e.g. DataLoader workers)
+TRACE_FILE_ENV = 'DAVIDE_TRACE_FILE'
+
+
+class _NullSpan:
+    """Span returned while tracing is off: entering and leaving it does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'sync', 'start')
+
+    def __init__(self, tracer, name, cat, args, sync):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.sync = sync
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.sync is not None:
+            self.sync()
+        end = time.perf_counter_ns()
+        event = {'name': self.name, 'cat': self.cat, 'ph': 'X', 'ts': self.start / 1000, 'dur': (end - self.start) / 1000,
+                 'pid': self.tracer.pid, 'tid': threading.get_ident()}
+        if self.args:
+            event['args'] = self.args
+        self.tracer.add(event)
+        return False
+
+
+class Tracer:
+    """
+    Collects the spans of one process as Chrome trace events ('X' complete events).
+
+    The tracer of a step run keeps its events in memory and writes the trace file
+    at the end of the run. Worker processes (forked or spawned) append their
+    events to a part file next to it, line by line, as they may be terminated
+    without cleanup. The parts are merged into the trace when the run finishes.
+    """
+
+    def __init__(self, path:str, process_name:str, worker:bool=False):
+        self.path = path
+        self.pid = os.getpid()
+        self.worker = worker
+        self.events = []
+        self._lock = threading.Lock()
+        self._file = open('{}.{}.part'.format(path, self.pid), 'a') if worker else None
+        self.add({'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': process_name}})
+
+    def add(self, event:dict):
+        if self._file is None:
+            self.events.append(event)
+            return
+        with self._lock:
+            self._file.write(json.dumps(event) + '\n')
+            self._file.flush()
+
+    def finish(self) -> str:
+        """Write the trace file with the events of this process and its workers."""
+        events = list(self.events)
+        threads = {}
+        for part in sorted(glob.glob(glob.escape(self.path) + '.*.part')):
+            with open(part) as f:
+                events.extend(json.loads(line) for line in f if line.endswith('\n'))
+            os.remove(part)
+        for event in events:
+            if event['ph'] == 'X':
+                threads.setdefault((event['pid'], event['tid']), None)
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for pid, tid in threads:
+            name = names.get(tid, 'thread') if pid == self.pid else 'worker'
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return self.path
+
+
+_tracer = None
+
+
+def _process_tracer():
+    """Tracer of this process: the tracer of the run, or a part-file tracer in a worker process of the run."""
+    global _tracer
+    tracer = _tracer
+    if tracer is not None and tracer.pid == os.getpid():
+        return tracer
+    path = os.environ.get(TRACE_FILE_ENV)
+    _tracer = Tracer(path, 'worker', worker=True) if path else None
+    return _tracer
+
+
+def enabled() -> bool:
+    """True if spans are recorded in this process."""
+    return _tracer is not None and _process_tracer() is not None
+
+
+def span(name:str, cat:str='stage', sync=None, **args):
+    """
+    Context manager that records a span of a stage of the running step.
+
+    Without tracing it returns a shared no-op context manager, so spans can stay
+    in inner loops. `sync` (e.g. torch.cuda.synchronize) is called before the
+    span ends, only while tracing, so that asynchronous work is attributed to the
+    stage that launched it.
+
+    Usage:
+        with tracing.span('encode', frame=file_name):
+            cv2.imwrite(path, frame)
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    tracer = _process_tracer()
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, cat, args, sync)
+
+
+def traced(iterable, name:str, cat:str='stage'):
+    """Iterate over `iterable` recording the time spent waiting for each item (e.g. a DataLoader)."""
+    if _tracer is None:
+        return iterable
+    return _traced(iterable, name, cat)
+
+
+def _traced(iterable, name, cat):
+    iterator = iter(iterable)
+    while True:
+        with span(name, cat):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def start_run(video_name:str, dp_step:str):
+    """Start tracing a step run if DAVIDE_TRACE is set. Returns the tracer or None."""
+    global _tracer
+    directory = os.environ.get(TRACE_ENV)
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(os.path.abspath(directory), '{}_{}_{}_{}.json'.format(video_name, dp_step, time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+    _tracer = Tracer(path, '{} {}'.format(dp_step, video_name))
+    os.environ[TRACE_FILE_ENV] = path
+    return _tracer
+
+
+def finish_run(tracer:Tracer):
+    """Stop tracing and write the trace file of the run."""
+    global _tracer
+    if tracer is None:
+        return
+    _tracer = None
+    os.environ.pop(TRACE_FILE_ENV, None)
+    print('Trace written to {} (open in https://ui.perfetto.dev or chrome://tracing)'.format(tracer.finish()))
+
+
+# Spawned worker processes of a traced run
+if os.environ.get(TRACE_FILE_ENV):
+    _process_tracer()
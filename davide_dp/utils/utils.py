@@ -9,6 +9,10 @@ import json
 import torch
 import pandas as pd
 
+from .ids import parse_id_list
+from . import tracing
+from .codecs import DEFAULT_CODEC, read_image
+
 
 # Valid image extensions
 IMG_EXTENSIONS = ['.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.ppm', '.PPM', '.bmp', '.BMP', '.tif']
@@ -79,39 +83,44 @@ def load_conf_bin(conf_name):
 
 
 def read_depth_bin(path, img_shape=(192,256)):
-    depth = load_depth_bin(path)
-    depth = resize(depth, img_shape, anti_aliasing=True)
+    with tracing.span('decode'):
+        depth = load_depth_bin(path)
+    with tracing.span('resize'):
+        depth = resize(depth, img_shape, anti_aliasing=True)
     return depth
 
 
 def read_conf_bin(path, img_shape=(192,256)):
-    conf = load_conf_bin(path)
-    conf = resize(conf, img_shape, anti_aliasing=True)
+    with tracing.span('decode'):
+        conf = load_conf_bin(path)
+    with tracing.span('resize'):
+        conf = resize(conf, img_shape, anti_aliasing=True)
     return conf
 
 
-def save_depth_16bits(depth:np.float32, path):
+def save_depth_16bits(depth:np.float32, path, codec=DEFAULT_CODEC):
     # check single channel
     assert len(depth.shape) == 2
     depth = depth.astype(np.float32) * 1000
     depth = np.clip(depth, 0, 65535)
     depth = depth.astype(np.uint16)
-    cv2.imwrite(path, depth)
+    # the extension of path is replaced by the one of the codec
+    return codec.write(path, depth)
 
 
 def read_depth_16bits(path):
-    depth = cv2.imread(path, cv2.IMREAD_ANYDEPTH)
+    depth = read_image(path, cv2.IMREAD_ANYDEPTH)
     depth = depth.astype(np.float32) / 1000
     return depth
 
 
-def save_conf_8bits(conf:np.float32, path):
+def save_conf_8bits(conf:np.float32, path, codec=DEFAULT_CODEC):
     # check single channel
     assert len(conf.shape) == 2
     conf = conf.astype(np.float32) * 255
     conf = conf.astype(np.uint8)
-    # save conf with cv2 (8bits)
-    cv2.imwrite(path, conf)
+    # save conf (8bits)
+    return codec.write(path, conf)
 
 
 
@@ -187,7 +196,7 @@ def imread2Tensor(path):
     return img
 
 
-def imsaveTensor(path, tensor):
+def imsaveTensor(path, tensor, codec=DEFAULT_CODEC):
     def denorm255_np(x):
         # numpy
         out = (x + 1.0) / 2.0
@@ -196,7 +205,7 @@ def imsaveTensor(path, tensor):
                        [1, 2, 0]).astype(np.uint8)
     # reverse order of channels (RGB -> BGR)
     img = img[:, :, [2, 1, 0]]
-    cv2.imwrite(path, img)
+    return codec.write(path, img)
 
 
 def imsave(path, img):
@@ -228,7 +237,8 @@ class VideoDataset(data.Dataset):
     def __getitem__(self, idx):
         frame_path = self.frames_path[idx]
 
-        frame = imread2Tensor(frame_path)
+        with tracing.span('decode', frame=idx):
+            frame = imread2Tensor(frame_path)
         # including "np2Tensor [-1,1] normalized"
 
         return frame, idx
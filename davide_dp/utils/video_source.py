@@ -0,0 +1,203 @@
+import os
+import json
+import subprocess
+import numpy as np
+
+
+FRAME_NAME = '{:08d}.png'
+
+
+class VideoFrameSource:
+    """
+    Frames of a video decoded by ffmpeg through a rawvideo pipe.
+
+    Frames are uint8 arrays of shape (height, width, 3) in the requested pixel
+    format ('rgb24' or 'bgr24'), with the rotation of the container applied as
+    when ffmpeg extracts png frames. Random access seeks to the keyframe before
+    the requested frame and decodes from there; the seek position comes from
+    the packet timestamps, so it is exact for variable frame rates too.
+
+    Usage:
+        source = VideoFrameSource('vid.mov', pix_fmt='bgr24')
+        for index, frame in source.frames(start=120):
+            ...
+        frame = source.read(42)
+    """
+
+    def __init__(self, path:str, pix_fmt:str='rgb24'):
+        assert pix_fmt in ['rgb24', 'bgr24'], f"Unsupported pixel format {pix_fmt}"
+        self.path = path
+        self.pix_fmt = pix_fmt
+        self.width, self.height, self.fps, self.num_frames = probe_video(path)
+        self._timestamps = None
+        self._keyframes = None
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    @property
+    def shape(self) -> tuple:
+        return (self.height, self.width, 3)
+
+    def frame_name(self, index:int) -> str:
+        """File name of a frame, as written by step 1."""
+        return FRAME_NAME.format(index)
+
+    def _probe_packets(self):
+        if self._timestamps is None:
+            self._timestamps, self._keyframes = probe_packets(self.path)
+            self.num_frames = min(self.num_frames, len(self._timestamps))
+
+    def keyframes(self) -> np.ndarray:
+        """Indices of the keyframes (presentation order)."""
+        self._probe_packets()
+        return self._keyframes
+
+    def seek_time(self, index:int) -> float:
+        """Input seek position of a frame: halfway between the frame and the previous one."""
+        self._probe_packets()
+        return (self._timestamps[index - 1] + self._timestamps[index]) / 2
+
+    def segments(self, parts:int) -> list:
+        """Split the frames into at most `parts` (start, stop) ranges of similar length that start at keyframes."""
+        keyframes = self.keyframes()
+        targets = np.arange(1, parts) * self.num_frames / parts
+        cuts = []
+        if len(keyframes):
+            # Nearest keyframe to each target
+            after = np.clip(np.searchsorted(keyframes, targets), 0, len(keyframes) - 1)
+            before = np.clip(after - 1, 0, len(keyframes) - 1)
+            cuts = np.where(np.abs(keyframes[before] - targets) <= np.abs(keyframes[after] - targets), keyframes[before], keyframes[after])
+        bounds = sorted({0, self.num_frames} | {int(cut) for cut in cuts if 0 < cut < self.num_frames})
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def frames(self, start:int=0, stop:int=None):
+        """Yield (index, frame) for frames start..stop-1. Frames are read-only arrays."""
+        stop = self.num_frames if stop is None else min(stop, self.num_frames)
+        if start >= stop:
+            return
+        command = ['ffmpeg', '-nostdin', '-loglevel', 'error']
+        if start > 0:
+            # Input seeking: jumps to the keyframe before the seek position and decodes up to the frame
+            command += ['-ss', '{:.6f}'.format(self.seek_time(start))]
+        command += ['-i', self.path, '-frames:v', str(stop - start), '-vsync', '0',
+                    '-f', 'rawvideo', '-pix_fmt', self.pix_fmt, 'pipe:']
+
+        frame_bytes = self.width * self.height * 3
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=frame_bytes)
+        index = start
+        try:
+            while index < stop:
+                buffer = process.stdout.read(frame_bytes)
+                if len(buffer) < frame_bytes:
+                    break
+                yield index, np.frombuffer(buffer, dtype=np.uint8).reshape(self.shape)
+                index += 1
+        finally:
+            process.stdout.close()
+            if index < stop:
+                process.kill()
+            error = process.stderr.read().decode(errors='replace').strip()
+            process.wait()
+        if index < stop and process.returncode not in (0, -9):
+            raise RuntimeError('ffmpeg failed decoding {} at frame {}:\n{}'.format(self.path, index, error))
+
+    def __iter__(self):
+        return self.frames()
+
+    def read(self, index:int) -> np.ndarray:
+        """Random access to a single frame."""
+        for _, frame in self.frames(index, index + 1):
+            return frame
+        raise IndexError(f"Frame {index} out of range of {self.path} ({self.num_frames} frames)")
+
+
+class FolderFrameSource:
+    """Frames of a folder of png images (e.g. the output of step 1), with the interface of VideoFrameSource."""
+
+    def __init__(self, folder:str, pix_fmt:str='rgb24'):
+        import cv2
+
+        self._cv2 = cv2
+        self.path = folder
+        self.pix_fmt = pix_fmt
+        self.names = sorted(name for name in os.listdir(folder) if name.endswith('.png'))
+        assert self.names, f"No png frames in {folder}"
+        self.height, self.width = self._read(self.names[0]).shape[:2]
+        self.num_frames = len(self.names)
+
+    def _read(self, name:str) -> np.ndarray:
+        frame = self._cv2.imread(os.path.join(self.path, name), self._cv2.IMREAD_COLOR)
+        return frame if self.pix_fmt == 'bgr24' else frame[..., ::-1]
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    @property
+    def shape(self) -> tuple:
+        return (self.height, self.width, 3)
+
+    def frame_name(self, index:int) -> str:
+        return self.names[index]
+
+    def frames(self, start:int=0, stop:int=None):
+        for index in range(start, self.num_frames if stop is None else min(stop, self.num_frames)):
+            yield index, self._read(self.names[index])
+
+    def __iter__(self):
+        return self.frames()
+
+    def read(self, index:int) -> np.ndarray:
+        return self._read(self.names[index])
+
+
+def probe_video(path:str) -> tuple:
+    """Width, height (after rotation), frame rate and number of frames of a video (ffprobe)."""
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+               '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate,nb_read_packets:stream_tags=rotate:stream_side_data=rotation',
+               '-of', 'json', path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('ffprobe failed on {}:\n{}'.format(path, result.stderr.strip()))
+    stream = json.loads(result.stdout)['streams'][0]
+
+    rotation = int(float(stream.get('tags', {}).get('rotate', 0)))
+    for side_data in stream.get('side_data_list', []):
+        rotation = int(float(side_data.get('rotation', rotation)))
+    width, height = int(stream['width']), int(stream['height'])
+    if rotation % 180 != 0:
+        width, height = height, width
+
+    num, den = stream.get('avg_frame_rate', '0/0').split('/')
+    if int(den) == 0 or int(num) == 0:
+        num, den = stream['r_frame_rate'].split('/')
+    return width, height, int(num) / int(den), int(stream['nb_read_packets'])
+
+
+def probe_packets(path:str) -> tuple:
+    """Presentation timestamps (seconds from the start of the file, sorted) and keyframe indices
+    of the video packets (ffprobe, no decoding)."""
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags:format=start_time', '-of', 'json', path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('ffprobe failed on {}:\n{}'.format(path, result.stderr.strip()))
+    info = json.loads(result.stdout)
+    start_time = float(info.get('format', {}).get('start_time', 0) or 0)
+    packets = [(float(packet['pts_time']), 'K' in packet.get('flags', ''))
+               for packet in info.get('packets', []) if packet.get('pts_time', 'N/A') != 'N/A']
+    packets.sort(key=lambda packet: packet[0])
+    timestamps = np.array([pts for pts, _ in packets]) - start_time
+    keyframes = np.array([index for index, (_, key) in enumerate(packets) if key], dtype=np.int64)
+    return timestamps, keyframes
+
+
+def open_frame_source(rgb_dir:str, video_file:str, pix_fmt:str='rgb24'):
+    """
+    Frames of a video: the png frames of step 1 if they were written, otherwise
+    the video itself. Png frames are only moved to `rgb_dir` once all of them are
+    written (extract_rgb.write_frame_folder), so any png means a complete set.
+    """
+    if os.path.isdir(rgb_dir) and any(name.endswith('.png') for name in os.listdir(rgb_dir)):
+        return FolderFrameSource(rgb_dir, pix_fmt)
+    return VideoFrameSource(video_file, pix_fmt)
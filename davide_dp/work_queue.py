@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import pandas as pd
+
+from davide_dp.configs import read_config
+from davide_dp.utils.ids import parse_id_list
+from davide_dp.utils.progress_db import DP_STEPS, populate_queue, claim_task, renew_lease, finish_task, \
+    get_queue_status, get_step_status
+from davide_dp.scheduler import step_command
+from davide_dp.disk_budget import DiskBudget
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Work queue of (video, step) tasks backed by the data processing logger')
+    parser.add_argument("command", type=str, choices=['populate', 'worker', 'status'],
+                        help='populate: add tasks to the queue, worker: run tasks until the queue is drained, status: print queue status')
+    parser.add_argument("--config", type=str, default='./davide_dp/configs/config.yaml', help='Path to config file')
+    parser.add_argument("--clips", type=str, default=None, help='[populate] Video ids. E.g. 0-92 or 0,2,5-7. Default: all videos')
+    parser.add_argument("--steps", type=str, default='1-5,8', help='Steps to queue (populate) or to run (worker). E.g. 1-5,8')
+    parser.add_argument("--retry_failed", action='store_true', help='[populate] Reset failed tasks to pending')
+    parser.add_argument("--mono_depth", action='store_true', help='Step 8 requires step 7 and exports mono depth')
+    parser.add_argument("--max_time", type=float, default=None, help='[worker] Do not claim new tasks after this many hours (e.g. SLURM time limit minus the longest task)')
+    parser.add_argument("--log_dir", type=str, default='logs/queue', help='[worker] Directory for task logs')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+class Heartbeat:
+    """Renews the lease of a running task from a background thread."""
+
+    def __init__(self, db_path:str, task_id:int, worker:str, lease_s:float, interval_s:float):
+        self.db_path = db_path
+        self.task_id = task_id
+        self.worker = worker
+        self.lease_s = lease_s
+        self.interval_s = interval_s
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                if not renew_lease(self.db_path, self.task_id, self.worker, self.lease_s):
+                    self.lost = True
+                    return
+            except Exception as error:
+                # The lease is long enough to survive a few failed renewals
+                print('Heartbeat of task {} failed: {}'.format(self.task_id, error))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def populate(config:dict, clip_ids:list, steps:list, video_list:list, retry_failed:bool=False):
+    """Add the tasks of the given videos and steps to the queue."""
+    tasks = [(video_list[clip_id], clip_id, dp_step) for clip_id in clip_ids for dp_step in steps]
+    pending = populate_queue(tasks, config['DATA-GEN-PARAMS']['dp_log'], config['QUEUE']['max_attempts'], retry_failed)
+    print('{} tasks queued, {} pending.'.format(len(tasks), pending))
+
+
+def print_status(config:dict, mono_depth:bool=False):
+    status = get_queue_status(config['DATA-GEN-PARAMS']['dp_log'], mono_depth=mono_depth)
+    table = pd.DataFrame.from_dict(status, orient='index').reindex(columns=['pending', 'ready', 'running', 'done', 'failed'])
+    print(table.sort_index().fillna(0).astype(int))
+
+
+def run_worker(config_file:str, config:dict, steps:list, log_dir:str, mono_depth:bool=False, max_time:float=None) -> bool:
+    """
+    Claim and run ready tasks until none is left. The worker waits while other
+    workers run tasks that may unlock more work. Returns True if all tasks run by
+    this worker succeeded. With DISK-BUDGET.enabled, consumed intermediates are
+    evicted before each claim and throttled steps wait for disk space.
+    """
+    db_path = config['DATA-GEN-PARAMS']['dp_log']
+    queue_config = config['QUEUE']
+    conda_envs = config['SCHEDULER'].get('conda_envs') or {}
+    budget = DiskBudget(config, mono_depth) if (config.get('DISK-BUDGET') or {}).get('enabled') else None
+    worker = '{}:{}:{}'.format(socket.gethostname(), os.environ.get('SLURM_JOB_ID', '-'), os.getpid())
+    os.makedirs(log_dir, exist_ok=True)
+    print('Worker {} running {}'.format(worker, ', '.join(steps)))
+
+    start = time.time()
+    idle_since = None
+    failures = 0
+    while max_time is None or time.time() - start < 3600 * max_time:
+        claimable = steps
+        if budget is not None:
+            budget.evict()
+            claimable = budget.claimable(steps)
+        task = claim_task(db_path, worker, queue_config['lease_s'], claimable, mono_depth) if claimable else None
+        if task is None:
+            # Stop when nothing runs that could unlock work (or free disk space), or after waiting too long.
+            # Ready tasks only count for the steps of this worker, running tasks of any step may unlock more
+            throttled = set(steps) - set(claimable)
+            status = get_queue_status(db_path, steps=steps, mono_depth=mono_depth)
+            if not any(counts['running'] or (counts['ready'] and dp_step not in throttled) for dp_step, counts in status.items()):
+                if throttled:
+                    print('Disk budget exhausted: {} cannot run within the quota.'.format(', '.join(sorted(throttled))))
+                break
+            idle_since = idle_since or time.time()
+            if time.time() - idle_since > queue_config['idle_timeout_s']:
+                print('No task ready for {:.0f} s.'.format(time.time() - idle_since))
+                break
+            time.sleep(queue_config['poll_s'])
+            continue
+        idle_since = None
+
+        video_name, dp_step = task['video_name'], task['step']
+        print('[{}] claimed {}[{}] (attempt {})'.format(time.strftime('%H:%M:%S'), dp_step, video_name, task['attempt']))
+        if budget is not None:
+            # Re-runs of a step read intermediates that may have been evicted
+            budget.restore_inputs(video_name, dp_step)
+        command = step_command(dp_step, task['clip_id'], config_file, mono_depth, conda_envs.get(dp_step))
+        log_file = os.path.join(log_dir, '{}_{}.txt'.format(video_name, dp_step))
+        task_start = time.time()
+        with open(log_file, 'a') as log, \
+                Heartbeat(db_path, task['id'], worker, queue_config['lease_s'], queue_config['heartbeat_s']) as heartbeat:
+            returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+
+        if heartbeat.lost:
+            # The task was reclaimed by another worker: its state is not ours to change
+            print('[{}] lost the lease of {}[{}]'.format(time.strftime('%H:%M:%S'), dp_step, video_name))
+            continue
+        # The step scripts mark the step as complete in the summary table
+        complete = get_step_status(db_path, videos=[video_name], steps=[dp_step]).get(video_name, {}).get(dp_step, False)
+        success = returncode == 0 and complete
+        error = None if success else 'exit code {}, step complete: {}. See {}'.format(returncode, complete, log_file)
+        state = finish_task(db_path, task['id'], worker, success, error)
+        print('[{}] {} {}[{}] in {:.0f} s -> {}'.format(
+            time.strftime('%H:%M:%S'), 'finished' if success else 'FAILED', dp_step, video_name, time.time() - task_start, state))
+        failures += not success
+
+    print('Worker {} stopped after {:.1f} h with {} failed tasks.'.format(worker, (time.time() - start) / 3600, failures))
+    return failures == 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = read_config(args.config)
+    steps = ['step_{}'.format(i) for i in parse_id_list(args.steps)]
+    for dp_step in steps:
+        assert dp_step in DP_STEPS, f"Step must be one of {DP_STEPS}"
+
+    if args.command == 'populate':
+        annotations = pd.read_csv(config['DATA-GEN-PARAMS']['annotations'])
+        video_list = annotations['recording'].values.tolist()
+        clip_ids = parse_id_list(args.clips) if args.clips is not None else list(range(len(video_list)))
+        populate(config, clip_ids, steps, video_list, args.retry_failed)
+    elif args.command == 'worker':
+        return 0 if run_worker(args.config, config, steps, args.log_dir, args.mono_depth, args.max_time) else 1
+    print_status(config, args.mono_depth)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
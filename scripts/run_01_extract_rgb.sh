@@ -11,9 +11,8 @@
 CLIP_ID=$1
 shift 1
 
-# Default values
+# Default config file
 CONFIG=./davide_dp/configs/config.yaml
-STEP=1
 
 # Parse optional --config argument
 if [ "$1" == "--config" ]; then
@@ -33,28 +32,5 @@ if [ -z "$CLIP_ID" ]; then
   exit 1
 fi
 
-# Retrive info from the config file
-VIDEOS_PATH_LIST=( )
-INPUT_ROOT=$(python -c "from davide_dp.configs import *;retrieve_attribute('$CONFIG', 'DAVIDE-raw', 'ROOT')")
-OUTPUT_ROOT=$(python -c "from davide_dp.configs import *;retrieve_attribute('$CONFIG', 'DAVIDE-tmp', 'ROOT')")
-DP_LOG=$(python -c "from davide_dp.configs import *;retrieve_attribute('$CONFIG', 'DATA-GEN-PARAMS', 'dp_log')")
-RGB_DIR=$(python -c "from davide_dp.configs import *;retrieve_attribute('$CONFIG', 'DAVIDE-tmp', 'rgb_folder')")
-
-# Get video clip
-VIDEO_LIST=( $(ls $INPUT_ROOT) )
-VIDEO=${VIDEO_LIST[$CLIP_ID]}
-
-# Set the input and output paths
-INPUT_PATH="$INPUT_ROOT/$VIDEO/vid.mov"
-OUTPUT_DIR="$OUTPUT_ROOT/$VIDEO/$RGB_DIR"
-mkdir -p $OUTPUT_DIR 
-OUTPUT_PATH="$OUTPUT_DIR/%08d.png"
-
-# Extract RGB frames from the video
-ffmpeg -y -i $INPUT_PATH -start_number 0 $OUTPUT_PATH 
-# ffmpeg -i $INPUT_PATH -start_number 0 -c:v libx264 -crf 0 $OUTPUT_PATH
-
-# Register the Step 1 in the DP log
-python davide_dp/update_db.py --dp_log $DP_LOG --recording $VIDEO --step $STEP
-echo "Step 1 completed for video $VIDEO"
-
+# Decode vid.mov through an ffmpeg pipe and write the frames as png (RGB-EXTRACTION in the config)
+python -m davide_dp.extract_rgb --id $CLIP_ID --config $CONFIG
@@ -1,7 +1,9 @@
 #!/bin/bash
 # ----------------------------------------------------------------------------------
 # This script runs to compute monocular depth from the RGB images of the DAVIDE dataset.
-# It requires a CLIP_ID to specify which video to process.
+# It requires a CLIP_ID to specify which video to process. CLIP_ID also accepts
+# ranges and lists (e.g. 0-92 or 0,2,5-7) to process many videos with a single
+# model load.
 # Optional arguments include a custom config file.
 # ----------------------------------------------------------------------------------
 # Usage: bash ./scripts/run_07_mono_depth.sh <CLIP_ID> [--config <CONFIG_FILE>]
@@ -33,5 +35,4 @@ if [ -z "$CLIP_ID" ]; then
 fi
 
 # Run the monocular depth estimation for both sharp and blurred images
-python davide_dp/mono_depth.py --id $CLIP_ID --config $CONFIG --rgb_dir sharp
-python davide_dp/mono_depth.py --id $CLIP_ID --config $CONFIG --rgb_dir blur
\ No newline at end of file
+python davide_dp/mono_depth.py --id $CLIP_ID --config $CONFIG --rgb_dir sharp blur
\ No newline at end of file
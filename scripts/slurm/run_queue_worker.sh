@@ -0,0 +1,28 @@
+#!/bin/bash
+#SBATCH --job-name=DAVIDE-Worker
+# slurm logs
+#SBATCH --output=logs/queue/worker_%a.txt
+#SBATCH --error=logs/queue/worker_%a.txt
+# slurm settings
+#SBATCH --partition=gpu
+#SBATCH --time=24:00:00
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=3
+#SBATCH --mem-per-cpu=16000
+#SBATCH --gres=gpu:v100:1
+#SBATCH --array=0-11
+
+# Generic workers draining the work queue. Populate it first with:
+#   python -m davide_dp.work_queue populate --clips 0-92 --steps 1-5,8
+# Workers stop claiming tasks after --max_time hours, so that the last task
+# finishes before the time limit. Tasks of killed workers are reclaimed when
+# their lease expires.
+
+# Load CUDA and ffmpeg
+module load cuda
+module load ffmpeg
+# Activate enviroment, export variables
+source ~/env_vars/DAVIDE-DP.sh
+
+cd ../..
+srun python -m davide_dp.work_queue worker --steps 1-5,8 --max_time 14 --config ./davide_dp/configs/config.yaml
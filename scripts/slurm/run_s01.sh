@@ -7,7 +7,8 @@
 #SBATCH --partition=small
 #SBATCH --time=02:00:00
 #SBATCH --ntasks=1
-#SBATCH --mem-per-cpu=16000
+#SBATCH --cpus-per-task=4
+#SBATCH --mem-per-cpu=4000
 #SBATCH --array=0-92
 
 # Load ffmpeg
@@ -7,8 +7,8 @@
 #SBATCH --partition=small
 #SBATCH --time=06:00:00
 #SBATCH --ntasks=1
-#SBATCH --cpus-per-task=1
-#SBATCH --mem-per-cpu=16000
+#SBATCH --cpus-per-task=6
+#SBATCH --mem-per-cpu=4000
 #SBATCH --array=0-92
 
 # Activate enviroment, export variables
@@ -0,0 +1,41 @@
+#!/bin/bash
+#SBATCH --job-name=Mono-Depth-Worker
+# slurm logs
+#SBATCH --output=logs/s07/worker_%a.txt
+#SBATCH --error=logs/s07/worker_%a.txt
+# slurm settings
+#SBATCH --partition=gpu
+#SBATCH --time=48:00:00
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=1
+#SBATCH --mem-per-cpu=16000
+#SBATCH --gres=gpu:v100:1
+#SBATCH --array=0-3
+
+# Load CUDA
+module load cuda
+# Activate enviroment, export variables
+source ~/env_vars/DAVIDE-MONO.sh
+
+cd ../..
+
+# Each worker loads the model once and processes a contiguous chunk of videos.
+# NUM_VIDEOS: rows of the annotations file, NUM_WORKERS: tasks of the array
+EXPORTS=$(python -m davide_dp.configs.export --config ./davide_dp/configs/config.yaml) || exit 1
+eval "$EXPORTS"
+if [ -z "$NUM_VIDEOS" ]; then
+  echo "Error: annotations file $DATA_GEN_PARAMS_ANNOTATIONS not found."
+  exit 1
+fi
+NUM_WORKERS=${SLURM_ARRAY_TASK_COUNT:-4}
+CHUNK=$(( (NUM_VIDEOS + NUM_WORKERS - 1) / NUM_WORKERS ))
+START=$(( SLURM_ARRAY_TASK_ID * CHUNK ))
+END=$(( START + CHUNK - 1 ))
+if [ $END -ge $NUM_VIDEOS ]; then
+  END=$(( NUM_VIDEOS - 1 ))
+fi
+if [ $START -gt $END ]; then
+  echo "No videos left for worker $SLURM_ARRAY_TASK_ID."
+  exit 0
+fi
+srun python davide_dp/mono_depth.py --id $START-$END --config ./davide_dp/configs/config.yaml --rgb_dir sharp blur --skip_complete